@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+##
+# qmapbenchmark.py
+#
+# This file is part of Tiled.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+##
+
+##
+# Micro-benchmarks for the QMap shim, comparing it with a list of pairs
+# that is scanned linearly, which is how QMap used to be implemented.
+#
+# Run from the src directory: python benchmarks/qmapbenchmark.py
+##
+
+import sys
+import timeit
+sys.path.append('libtiled')
+sys.path.append('libqt5')
+
+from pyqtcore import QMap
+
+class LinearMap(list):
+    def __getitem__(self, key):
+        for x in self.__iter__():
+            if x[0]==key:
+                return x[1]
+        return None
+
+    def __setitem__(self, key, value):
+        for i in range(self.__len__()):
+            if super().__getitem__(i)[0]==key:
+                super().__setitem__(i, [key, value])
+                return
+        self.append([key, value])
+
+    def contains(self, key):
+        return self.__getitem__(key) != None
+
+    def remove(self, key):
+        for x in self.__iter__():
+            if x[0]==key:
+                index = self.index(x)
+                self.__delitem__(index)
+                return
+
+    def upperBound(self, key):
+        keys = sorted(x[0] for x in self.__iter__())
+        for index, _key in enumerate(keys):
+            if key < _key:
+                return index
+        return len(keys)
+
+def report(name, linear, hashed):
+    print("%-40s %10.2f ms %10.2f ms %8.1fx" % (name, linear * 1000, hashed * 1000, linear / hashed))
+
+def benchmarkFirstGids(tilesetCount, lookups):
+    maps = []
+    for cls in (LinearMap, QMap):
+        m = cls()
+        firstGid = 1
+        for i in range(tilesetCount):
+            m[firstGid] = i
+            firstGid += 64
+        maps.append((m, firstGid))
+    times = []
+    for m, lastGid in maps:
+        gids = range(1, lastGid, max(1, lastGid // lookups))
+        times.append(timeit.timeit(lambda: [m.upperBound(gid) for gid in gids], number=1))
+    report("upperBound, %d tilesets" % tilesetCount, *times)
+
+def benchmarkProperties(propertyCount, objectCount):
+    times = []
+    for cls in (LinearMap, QMap):
+        def run():
+            for o in range(objectCount):
+                properties = cls()
+                for i in range(propertyCount):
+                    properties["property%d" % i] = str(i)
+                for i in range(propertyCount):
+                    properties.contains("property%d" % i)
+                    properties["property%d" % i]
+        times.append(timeit.timeit(run, number=1))
+    report("properties, %d objects x %d properties" % (objectCount, propertyCount), *times)
+
+def benchmarkLookups(keyCount, lookups):
+    times = []
+    for cls in (LinearMap, QMap):
+        m = cls()
+        for i in range(keyCount):
+            m[object()] = i
+        keys = [x[0] for x in list.__iter__(m)]
+        times.append(timeit.timeit(lambda: [m[keys[i % keyCount]] for i in range(lookups)], number=1))
+    report("lookups, %d object keys" % keyCount, *times)
+
+def benchmarkRemove(keyCount):
+    times = []
+    for cls in (LinearMap, QMap):
+        def run():
+            m = cls()
+            for i in range(keyCount):
+                m[i] = i
+            # Remove from the middle, as when objects or tiles are dropped
+            for i in range(keyCount // 2, keyCount):
+                m.remove(i)
+            for i in range(keyCount // 2):
+                m.remove(i)
+        times.append(timeit.timeit(run, number=1))
+    report("remove, %d keys" % keyCount, *times)
+
+if __name__ == '__main__':
+    print("%-40s %13s %13s %9s" % ("", "linear", "QMap", "speedup"))
+    benchmarkFirstGids(300, 10000)
+    benchmarkProperties(100, 200)
+    benchmarkLookups(500, 100000)
+    benchmarkRemove(5000)
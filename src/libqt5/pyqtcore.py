@@ -25,6 +25,7 @@ RAND_MAX = 0x7FFF
 
 import random
 import os
+import bisect
 
 def rand():
     return int(random.random()*RAND_MAX)
@@ -247,41 +248,107 @@ class QList(list):
                 return True
         return False
 
+##
+# An ordered map. Items are kept in insertion order, like the list of
+# [key, value] pairs this class derives from, while lookups go through a
+# hash of the keys. Keys that cannot be hashed are looked up by comparing
+# them one by one.
+#
+# Each pair gets an increasing sequence number when it is inserted. Since the
+# pairs stay in insertion order, remove() finds the position of a pair by
+# bisecting the sequence numbers of the remaining pairs.
+#
+# lowerBound() and upperBound() return positions in the sorted list of keys,
+# which is built on the first bound query and kept up to date afterwards.
+##
 class QMap(QList):
     def __init__(self, key=None, value=None):
         super(QMap, self).__init__()
 
+        self.mPairs = {}
+        # The sequence numbers of the pairs, in list order, and of their keys
+        self.mSequenceNumbers = []
+        self.mKeySequenceNumbers = {}
+        self.mNextSequenceNumber = 0
+        self.mSortedKeys = None
         self.insert = self.__setitem__
         self.find = self.get
         if key or value:
             self.__setitem__(key, value)
 
+    def __pair(self, key):
+        try:
+            return self.mPairs.get(key)
+        except TypeError:
+            for x in self.__iter__():
+                if x[0]==key:
+                    return x
+            return None
+
     def __getitem__(self, key):
-        for x in self.__iter__():
-            if x[0]==key:
-                return x[1]
-        return None
+        x = self.__pair(key)
+        if x is None:
+            return None
+        return x[1]
 
     def __setitem__(self, key, value):
-        for i in range(self.__len__()):
-            x = super(QMap, self).__getitem__(i)
-            if x[0]==key:
-                super(QMap, self).__setitem__(i, [key, value])
-                return
-        self.append([key, value])
+        x = self.__pair(key)
+        if x is not None:
+            x[1] = value
+            return
+        x = [key, value]
+        self.append(x)
+        self.mSequenceNumbers.append(self.mNextSequenceNumber)
+        try:
+            self.mPairs[key] = x
+            self.mKeySequenceNumbers[key] = self.mNextSequenceNumber
+        except TypeError:
+            pass
+        self.mNextSequenceNumber += 1
+        if self.mSortedKeys is not None:
+            try:
+                bisect.insort(self.mSortedKeys, key)
+            except TypeError:
+                self.mSortedKeys = None
         return self.__len__()
 
+    def __delitem__(self, index):
+        x = super(QMap, self).__getitem__(index)
+        super(QMap, self).__delitem__(index)
+        del self.mSequenceNumbers[index]
+        self.__forget(x[0])
+
+    def __forget(self, key):
+        try:
+            self.mPairs.pop(key, None)
+            self.mKeySequenceNumbers.pop(key, None)
+        except TypeError:
+            pass
+        if self.mSortedKeys is not None:
+            try:
+                i = bisect.bisect_left(self.mSortedKeys, key)
+                if i < len(self.mSortedKeys) and self.mSortedKeys[i] == key:
+                    del self.mSortedKeys[i]
+            except TypeError:
+                self.mSortedKeys = None
+
+    def __sortedKeys(self):
+        if self.mSortedKeys is None:
+            self.mSortedKeys = sorted(self.keys())
+        return self.mSortedKeys
+
+    def clear(self):
+        super(QMap, self).clear()
+        self.mPairs.clear()
+        self.mSequenceNumbers.clear()
+        self.mKeySequenceNumbers.clear()
+        self.mSortedKeys = None
+
     def keys(self):
-        r = []
-        for x in self.__iter__():
-            r.append(x[0])
-        return r
+        return [x[0] for x in self.__iter__()]
 
     def values(self):
-        r = []
-        for x in self.__iter__():
-            r.append(x[1])
-        return r
+        return [x[1] for x in self.__iter__()]
 
     def value(self, key, defValue = None):
         return self.get(key, defValue)
@@ -293,11 +360,17 @@ class QMap(QList):
         return v
 
     def remove(self, key):
-        for x in self.__iter__():
-            if x[0]==key:
-                index = self.index(x)
-                self.__delitem__(index)
-                return
+        try:
+            sequenceNumber = self.mKeySequenceNumbers.get(key)
+        except TypeError:
+            for i in range(self.__len__()):
+                if super(QMap, self).__getitem__(i)[0]==key:
+                    self.__delitem__(i)
+                    return
+            return
+        if sequenceNumber is None:
+            return
+        self.__delitem__(bisect.bisect_left(self.mSequenceNumbers, sequenceNumber))
 
     def erase(self, iter):
         self.remove(iter)
@@ -314,40 +387,15 @@ class QMap(QList):
     def take(self, key):
         v = self.__getitem__(key)
         if v==None:
-            return None 
+            return None
         self.remove(key)
         return v
 
     def lowerBound(self, key):
-        keys = sorted(self.keys())
-        _keyfind = len(keys)
-
-        _keys = QSet(keys)
-
-        index = 0
-        for _key in _keys:
-            if key <= _key:
-                _keyfind = index
-                break
-            index += 1
-
-        return _keyfind
+        return bisect.bisect_left(self.__sortedKeys(), key)
         
     def upperBound(self, key):
-        keys = self.keys()
-        _keyfind = len(keys)
-
-        _keys = QSet(keys)
-        
-        _keys = sorted(_keys)
-        index = 0
-        for _key in _keys:
-            if key < _key:
-                _keyfind = index
-                break
-            index += 1
-
-        return _keyfind
+        return bisect.bisect_right(self.__sortedKeys(), key)
 
     def itemByIndex(self, index):
         if index<0 or index>=self.__len__():
@@ -0,0 +1,348 @@
+##
+# cellgrid.py
+#
+# This file is part of libtiled.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE CONTRIBUTORS ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+##
+
+
+from array import array
+from collections import Counter
+from itertools import chain
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# A cell is packed into a single unsigned 32-bit value. The flags use the same
+# bits as the flags of a global tile ID, the remaining bits hold an index
+# into the tile table of the owning tile layer. A value of 0 is an empty cell.
+FlippedHorizontallyFlag   = 0x80000000
+FlippedVerticallyFlag     = 0x40000000
+FlippedAntiDiagonallyFlag = 0x20000000
+FlagsMask                 = 0xE0000000
+TileIndexMask             = 0x1FFFFFFF
+FlagsShift                = 29
+
+##
+# Returns a new row of \a width empty cells.
+##
+def emptyRow(width):
+    return array('I', bytes(4 * width))
+
+##
+# Returns a copy of the given packed \a values, an array('I') or a numpy
+# array, with the flags of every non-empty cell replaced through
+# \a flagTable. The table maps each of the eight flag combinations, as
+# found in value >> FlagsShift, to a new one.
+##
+def remapFlags(values, flagTable):
+    if numpy and isinstance(values, numpy.ndarray):
+        table = numpy.array([flags << FlagsShift for flags in flagTable], dtype=numpy.uint32)
+        remapped = (values & TileIndexMask) | table[values >> FlagsShift]
+        return numpy.where(values != 0, remapped, values)
+    table = [flags << FlagsShift for flags in flagTable]
+    remapped = {}
+    for value in set(values):
+        if value:
+            remapped[value] = (value & TileIndexMask) | table[value >> FlagsShift]
+        else:
+            remapped[value] = 0
+    return array('I', map(remapped.__getitem__, values))
+
+##
+# Returns the \a width x \a height area of packed \a values, stored row by
+# row, mirrored horizontally or vertically. The flags of the cells are
+# remapped through \a flagTable.
+##
+def mirroredArea(values, width, height, horizontally, flagTable):
+    if numpy:
+        area = numpy.frombuffer(values, dtype=numpy.uint32).reshape(height, width)
+        if horizontally:
+            area = area[:, ::-1]
+        else:
+            area = area[::-1]
+        return numpy.ascontiguousarray(remapFlags(area, flagTable))
+    rows = [values[y * width:(y + 1) * width] for y in range(height)]
+    if horizontally:
+        rows = [row[::-1] for row in rows]
+    else:
+        rows.reverse()
+    return remapFlags(array('I', b''.join(rows)), flagTable)
+
+##
+# Returns the \a width x \a height area of packed \a values, stored row by
+# row, rotated by 90 degrees clockwise or counterclockwise. The returned area
+# is \a height cells wide and \a width cells high. The flags of the cells are
+# remapped through \a flagTable.
+##
+def rotatedArea(values, width, height, clockwise, flagTable):
+    if numpy:
+        area = numpy.frombuffer(values, dtype=numpy.uint32).reshape(height, width)
+        area = numpy.rot90(area, -1 if clockwise else 1)
+        return numpy.ascontiguousarray(remapFlags(area, flagTable))
+    rows = [values[y * width:(y + 1) * width] for y in range(height)]
+    if clockwise:
+        rotated = (reversed(column) for column in zip(*rows))
+    else:
+        rotated = reversed(list(zip(*rows)))
+    return remapFlags(array('I', chain.from_iterable(rotated)), flagTable)
+
+##
+# A packed grid of cell values, stored as one array('I') per row so that
+# each cell takes four bytes.
+#
+# Cloning a grid is copy-on-write: the clone shares the row list and the
+# rows with the original, and each side copies a row only before its first
+# write to it. mShared marks the rows that may still be shared, and is None
+# when the grid owns all of its rows.
+#
+# The grid only deals with packed values. Translating them to and from
+# Cell instances is up to the TileLayer owning the grid.
+##
+class CellGrid():
+    def __init__(self, width, height):
+        self.mWidth = max(0, width)
+        self.mHeight = max(0, height)
+        self.mRows = [emptyRow(self.mWidth) for y in range(self.mHeight)]
+        self.mShared = None
+        self.mRowListShared = False
+
+    def width(self):
+        return self.mWidth
+
+    def height(self):
+        return self.mHeight
+
+    ##
+    # Returns the packed value at the given coordinates.
+    ##
+    def at(self, x, y):
+        return self.mRows[y][x]
+
+    ##
+    # Sets the packed value at the given coordinates.
+    ##
+    def setAt(self, x, y, value):
+        if self.mShared is not None and self.mShared[y]:
+            self.__detachRow(y)
+        self.mRows[y][x] = value
+
+    ##
+    # Returns the row at \a y. The returned array should not be modified,
+    # use mutableRow() or setRow() instead.
+    ##
+    def row(self, y):
+        return self.mRows[y]
+
+    ##
+    # Returns the row at \a y for modification, copying it first when it is
+    # shared with another grid.
+    ##
+    def mutableRow(self, y):
+        if self.mShared is not None and self.mShared[y]:
+            self.__detachRow(y)
+        return self.mRows[y]
+
+    ##
+    # Replaces the row at \a y with the given array of packed values. The
+    # grid takes ownership of the array.
+    ##
+    def setRow(self, y, row):
+        if self.mRowListShared:
+            self.__detachRowList()
+        self.mRows[y] = row
+        if self.mShared is not None:
+            self.mShared[y] = 0
+
+    ##
+    # Returns a copy of the \a width values starting at \a x on row \a y.
+    ##
+    def rowSlice(self, y, x, width):
+        return self.mRows[y][x:x + width]
+
+    ##
+    # Overwrites the values starting at \a x on row \a y with \a values.
+    ##
+    def setRowSlice(self, y, x, values):
+        self.mutableRow(y)[x:x + len(values)] = values
+
+    ##
+    # Returns a copy of the \a width x \a height area at (\a x, \a y) as a
+    # flat array('I'), row by row.
+    ##
+    def area(self, x, y, width, height):
+        return array('I', b''.join(row[x:x + width] for row in self.mRows[y:y + height]))
+
+    ##
+    # Overwrites the \a width x \a height area at (\a x, \a y) with the
+    # given flat sequence of packed \a values, which has to support the
+    # buffer protocol.
+    ##
+    def setArea(self, x, y, width, height, values):
+        data = memoryview(values).cast('B')
+        rowSize = 4 * width
+        for i in range(height):
+            row = array('I')
+            row.frombytes(data[i * rowSize:(i + 1) * rowSize])
+            if width == self.mWidth:
+                self.setRow(y + i, row)
+            else:
+                self.setRowSlice(y + i, x, row)
+
+    ##
+    # Iterates over (x, values) pairs covering the part of row \a y between
+    # \a left and \a right (inclusive) that may hold non-empty cells.
+    ##
+    def rowSegments(self, y, left, right):
+        if left <= right:
+            yield left, self.mRows[y][left:right + 1]
+
+    ##
+    # Returns an (x, y, width, height) area containing the cell at \a x, \a y
+    # that is known to hold only empty cells, or None when it is not known.
+    ##
+    def emptyAreaAt(self, x, y):
+        return None
+
+    ##
+    # Returns a list of (x, y, width, height) areas which together contain
+    # all non-empty cells of this grid.
+    ##
+    def occupiedRects(self):
+        if self.isEmpty():
+            return []
+        return [(0, 0, self.mWidth, self.mHeight)]
+
+    ##
+    # Iterates over (x, y, width, height, values) tuples for the areas
+    # returned by occupiedRects(), with the packed values of each area row by
+    # row.
+    ##
+    def occupiedAreas(self):
+        for x, y, width, height in self.occupiedRects():
+            yield x, y, width, height, self.area(x, y, width, height)
+
+    ##
+    # Replaces every value in this grid by the result of calling \a function
+    # with it. The function has to map 0 to 0.
+    ##
+    def mapValues(self, function):
+        for y in range(self.mHeight):
+            self.setRow(y, array('I', map(function, self.mRows[y])))
+
+    ##
+    # Returns the list of rows.
+    ##
+    def rows(self):
+        return self.mRows
+
+    ##
+    # Iterates over all packed values, row by row.
+    ##
+    def values(self):
+        return chain.from_iterable(self.mRows)
+
+    ##
+    # Replaces all values of this grid by the given flat sequence of
+    # \a values, which has to support the buffer protocol and hold
+    # width * height native unsigned 32-bit integers.
+    ##
+    def setValues(self, values):
+        data = memoryview(values).cast('B')
+        rowSize = 4 * self.mWidth
+        rows = []
+        for y in range(self.mHeight):
+            row = array('I')
+            row.frombytes(data[y * rowSize:(y + 1) * rowSize])
+            rows.append(row)
+        self.mRows = rows
+        self.mShared = None
+        self.mRowListShared = False
+
+    ##
+    # Returns all values of this grid as bytes, in native byte order.
+    ##
+    def toBytes(self):
+        return b''.join(self.mRows)
+
+    ##
+    # Returns the set of distinct packed values in this grid.
+    ##
+    def distinctValues(self):
+        values = set()
+        for row in self.mRows:
+            values.update(row)
+        return values
+
+    ##
+    # Returns a copy of this grid. The copy shares its rows with this grid
+    # until either of them is modified, so this is a constant time operation.
+    ##
+    def clone(self):
+        clone = CellGrid(0, 0)
+        clone.mWidth = self.mWidth
+        clone.mHeight = self.mHeight
+        clone.mRows = self.mRows
+        clone.mShared = bytearray(b'\x01') * self.mHeight
+        clone.mRowListShared = True
+        self.mShared = bytearray(b'\x01') * self.mHeight
+        self.mRowListShared = True
+        return clone
+
+    ##
+    # Returns a dictionary mapping each distinct packed value in this grid
+    # to the number of cells holding it.
+    ##
+    def valueCounts(self):
+        if numpy:
+            values = numpy.frombuffer(self.toBytes(), dtype=numpy.uint32)
+            distinct, counts = numpy.unique(values, return_counts=True)
+            return dict(zip(distinct.tolist(), counts.tolist()))
+        return Counter(self.values())
+
+    ##
+    # Returns True when all cells of this grid are empty.
+    ##
+    def isEmpty(self):
+        for row in self.mRows:
+            if any(row):
+                return False
+        return True
+
+    ##
+    # Gives this grid its own copy of the row at \a y.
+    ##
+    def __detachRow(self, y):
+        if self.mRowListShared:
+            self.__detachRowList()
+        self.mRows[y] = array('I', self.mRows[y])
+        self.mShared[y] = 0
+
+    ##
+    # Gives this grid its own copy of the row list, still referring to the
+    # same rows.
+    ##
+    def __detachRowList(self):
+        self.mRows = list(self.mRows)
+        self.mRowListShared = False
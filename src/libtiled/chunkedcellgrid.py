@@ -0,0 +1,432 @@
+##
+# chunkedcellgrid.py
+#
+# This file is part of libtiled.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE CONTRIBUTORS ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+##
+
+from array import array
+from collections import Counter
+from itertools import chain
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ChunkBits = 5
+ChunkSize = 1 << ChunkBits
+ChunkMask = ChunkSize - 1
+
+##
+# Returns a new chunk of empty cells.
+##
+def emptyChunk():
+    return [array('I', bytes(4 * ChunkSize * ChunkSize)), 0]
+
+##
+# A sparse grid of packed cell values, divided into chunks of
+# ChunkSize x ChunkSize cells. Chunks without any non-empty cell are not
+# stored, so memory use scales with the content rather than with the area.
+#
+# Offers the same interface as CellGrid. Each chunk is stored as a
+# [values, count] pair, where count is the number of non-empty cells in it.
+# Cloning is copy-on-write per chunk, like it is per row for CellGrid.
+##
+class ChunkedCellGrid():
+    def __init__(self, width, height):
+        self.mWidth = max(0, width)
+        self.mHeight = max(0, height)
+        self.mChunks = {}
+        self.mOwned = set()
+        self.mChunksShared = False
+
+    def width(self):
+        return self.mWidth
+
+    def height(self):
+        return self.mHeight
+
+    ##
+    # Returns the packed value at the given coordinates.
+    ##
+    def at(self, x, y):
+        chunk = self.mChunks.get((x >> ChunkBits, y >> ChunkBits))
+        if chunk is None:
+            return 0
+        return chunk[0][((y & ChunkMask) << ChunkBits) | (x & ChunkMask)]
+
+    ##
+    # Sets the packed value at the given coordinates.
+    ##
+    def setAt(self, x, y, value):
+        key = (x >> ChunkBits, y >> ChunkBits)
+        chunk = self.__mutableChunk(key, value != 0)
+        if chunk is None:
+            return
+        values = chunk[0]
+        index = ((y & ChunkMask) << ChunkBits) | (x & ChunkMask)
+        previous = values[index]
+        values[index] = value
+        if not previous:
+            if value:
+                chunk[1] += 1
+        elif not value:
+            chunk[1] -= 1
+            if chunk[1] == 0:
+                self.__removeChunk(key)
+
+    ##
+    # Returns a copy of the row at \a y.
+    ##
+    def row(self, y):
+        return self.rowSlice(y, 0, self.mWidth)
+
+    ##
+    # Replaces the row at \a y with the given array of packed values.
+    ##
+    def setRow(self, y, row):
+        self.setRowSlice(y, 0, row)
+
+    ##
+    # Returns a copy of the \a width values starting at \a x on row \a y.
+    ##
+    def rowSlice(self, y, x, width):
+        result = array('I', bytes(4 * width))
+        for x0, values in self.rowSegments(y, x, x + width - 1):
+            result[x0 - x:x0 - x + len(values)] = values
+        return result
+
+    ##
+    # Overwrites the values starting at \a x on row \a y with \a values,
+    # which has to be an array('I').
+    ##
+    def setRowSlice(self, y, x, values):
+        cy = y >> ChunkBits
+        offset = (y & ChunkMask) << ChunkBits
+        right = x + len(values)
+        for cx in range(x >> ChunkBits, ((right - 1) >> ChunkBits) + 1):
+            x0 = max(x, cx << ChunkBits)
+            x1 = min(right, (cx + 1) << ChunkBits)
+            segment = values[x0 - x:x1 - x]
+            nonEmpty = len(segment) - segment.count(0)
+            key = (cx, cy)
+            chunk = self.__mutableChunk(key, nonEmpty > 0)
+            if chunk is None:
+                continue
+            start = offset + (x0 & ChunkMask)
+            previous = chunk[0][start:start + len(segment)]
+            chunk[0][start:start + len(segment)] = segment
+            chunk[1] += nonEmpty - (len(previous) - previous.count(0))
+            if chunk[1] == 0:
+                self.__removeChunk(key)
+
+    ##
+    # Returns a copy of the \a width x \a height area at (\a x, \a y) as a
+    # flat array('I'), row by row.
+    ##
+    def area(self, x, y, width, height):
+        if (x >> ChunkBits == (x + width - 1) >> ChunkBits and
+                y >> ChunkBits == (y + height - 1) >> ChunkBits):
+            # The area lies within a single chunk
+            chunk = self.mChunks.get((x >> ChunkBits, y >> ChunkBits))
+            if chunk is None:
+                return array('I', bytes(4 * width * height))
+            start = ((y & ChunkMask) << ChunkBits) + (x & ChunkMask)
+            if width == ChunkSize:
+                return chunk[0][start:start + (height << ChunkBits)]
+            return array('I', b''.join(chunk[0][row:row + width]
+                                       for row in range(start, start + (height << ChunkBits), ChunkSize)))
+        return array('I', b''.join(self.rowSlice(row, x, width) for row in range(y, y + height)))
+
+    ##
+    # Overwrites the \a width x \a height area at (\a x, \a y) with the
+    # given flat sequence of packed \a values, which has to support the
+    # buffer protocol.
+    ##
+    def setArea(self, x, y, width, height, values):
+        data = memoryview(values).cast('B')
+        rowSize = 4 * width
+        for i in range(height):
+            row = array('I')
+            row.frombytes(data[i * rowSize:(i + 1) * rowSize])
+            self.setRowSlice(y + i, x, row)
+
+    ##
+    # Iterates over (x, values) pairs covering the part of row \a y between
+    # \a left and \a right (inclusive) that may hold non-empty cells. Empty
+    # chunks are skipped.
+    ##
+    def rowSegments(self, y, left, right):
+        cy = y >> ChunkBits
+        offset = (y & ChunkMask) << ChunkBits
+        right = min(right, self.mWidth - 1)
+        for cx in range(left >> ChunkBits, (right >> ChunkBits) + 1):
+            chunk = self.mChunks.get((cx, cy))
+            if chunk is None:
+                continue
+            x0 = max(left, cx << ChunkBits)
+            x1 = min(right + 1, (cx + 1) << ChunkBits)
+            start = offset + (x0 & ChunkMask)
+            yield x0, chunk[0][start:start + x1 - x0]
+
+    ##
+    # Returns the (x, y, width, height) area of the chunk containing the cell
+    # at \a x, \a y when that chunk is empty, or None otherwise.
+    ##
+    def emptyAreaAt(self, x, y):
+        cx = x >> ChunkBits
+        cy = y >> ChunkBits
+        if (cx, cy) in self.mChunks:
+            return None
+        x = cx << ChunkBits
+        y = cy << ChunkBits
+        return (x, y,
+                min(ChunkSize, self.mWidth - x),
+                min(ChunkSize, self.mHeight - y))
+
+    ##
+    # Returns a list of (x, y, width, height) areas which together contain
+    # all non-empty cells of this grid, one for each stored chunk.
+    ##
+    def occupiedRects(self):
+        rects = []
+        for cx, cy in sorted(self.mChunks, key=lambda key: (key[1], key[0])):
+            x = cx << ChunkBits
+            y = cy << ChunkBits
+            rects.append((x, y,
+                          min(ChunkSize, self.mWidth - x),
+                          min(ChunkSize, self.mHeight - y)))
+        return rects
+
+    ##
+    # Iterates over (x, y, width, height, values) tuples for the stored
+    # chunks, with the packed values of the part of each chunk inside the
+    # grid row by row. Empty chunks are never materialized.
+    ##
+    def occupiedAreas(self):
+        for x, y, width, height in self.occupiedRects():
+            yield x, y, width, height, self.area(x, y, width, height)
+
+    ##
+    # Replaces every value in this grid by the result of calling \a function
+    # with it. The function has to map 0 to 0.
+    ##
+    def mapValues(self, function):
+        for key in list(self.mChunks):
+            chunk = self.__mutableChunk(key, False)
+            values = array('I', map(function, chunk[0]))
+            count = len(values) - values.count(0)
+            if count:
+                chunk[0] = values
+                chunk[1] = count
+            else:
+                self.__removeChunk(key)
+
+    ##
+    # Returns the list of rows. This builds every row, including the empty
+    # ones, so it costs as much as a dense grid. Use occupiedAreas() or
+    # rowSegments() to visit the non-empty cells.
+    ##
+    def rows(self):
+        return [self.row(y) for y in range(self.mHeight)]
+
+    ##
+    # Iterates over all packed values, row by row, including the empty
+    # cells. Use occupiedAreas() to visit only the stored chunks.
+    ##
+    def values(self):
+        return chain.from_iterable(self.row(y) for y in range(self.mHeight))
+
+    ##
+    # Replaces all values of this grid by the given flat sequence of
+    # \a values, which has to support the buffer protocol and hold
+    # width * height native unsigned 32-bit integers. Only the chunks
+    # holding non-empty cells are stored.
+    ##
+    def setValues(self, values):
+        self.mChunks = {}
+        self.mOwned = set()
+        self.mChunksShared = False
+        if self.mWidth == 0 or self.mHeight == 0:
+            return
+        data = memoryview(values).cast('B')
+        if numpy:
+            grid = numpy.frombuffer(data, dtype=numpy.uint32)
+            grid = grid.reshape(self.mHeight, self.mWidth)
+            for cy in range((self.mHeight + ChunkMask) >> ChunkBits):
+                band = grid[cy << ChunkBits:(cy + 1) << ChunkBits]
+                occupied = band.any(axis=0)
+                for cx in range((self.mWidth + ChunkMask) >> ChunkBits):
+                    x = cx << ChunkBits
+                    if not occupied[x:x + ChunkSize].any():
+                        continue
+                    part = band[:, x:x + ChunkSize]
+                    block = numpy.zeros((ChunkSize, ChunkSize), dtype=numpy.uint32)
+                    block[:part.shape[0], :part.shape[1]] = part
+                    key = (cx, cy)
+                    self.mChunks[key] = [array('I', block.tobytes()),
+                                         int(numpy.count_nonzero(part))]
+                    self.mOwned.add(key)
+            return
+
+        rowSize = 4 * self.mWidth
+        chunkRowSize = 4 * ChunkSize
+        empty = bytes(chunkRowSize)
+        for y in range(self.mHeight):
+            row = data[y * rowSize:(y + 1) * rowSize]
+            offset = (y & ChunkMask) << ChunkBits
+            for cx in range((self.mWidth + ChunkMask) >> ChunkBits):
+                segment = row[cx * chunkRowSize:(cx + 1) * chunkRowSize]
+                if segment == empty[:len(segment)]:
+                    continue
+                key = (cx, y >> ChunkBits)
+                chunk = self.mChunks.get(key)
+                if chunk is None:
+                    chunk = emptyChunk()
+                    self.mChunks[key] = chunk
+                    self.mOwned.add(key)
+                segmentValues = array('I')
+                segmentValues.frombytes(segment)
+                chunk[0][offset:offset + len(segmentValues)] = segmentValues
+                chunk[1] += len(segmentValues) - segmentValues.count(0)
+
+    ##
+    # Returns all values of this grid as bytes, in native byte order. The
+    # result is as large as a dense grid, so this is meant for writing the
+    # layer data, which needs every cell. Other code should use
+    # occupiedAreas() instead.
+    ##
+    def toBytes(self):
+        if numpy:
+            grid = numpy.zeros((self.mHeight, self.mWidth), dtype=numpy.uint32)
+            for (x, y, width, height), chunk in self.__chunkAreas():
+                block = numpy.frombuffer(chunk[0], dtype=numpy.uint32)
+                block = block.reshape(ChunkSize, ChunkSize)
+                grid[y:y + height, x:x + width] = block[:height, :width]
+            return grid.tobytes()
+
+        data = bytearray(4 * self.mWidth * self.mHeight)
+        for (x, y, width, height), chunk in self.__chunkAreas():
+            for row in range(height):
+                start = 4 * ((y + row) * self.mWidth + x)
+                values = chunk[0][row << ChunkBits:(row << ChunkBits) + width]
+                data[start:start + 4 * width] = values.tobytes()
+        return bytes(data)
+
+    ##
+    # Returns the set of distinct packed values in this grid.
+    ##
+    def distinctValues(self):
+        values = set()
+        nonEmpty = 0
+        for chunk in self.mChunks.values():
+            values.update(chunk[0])
+            nonEmpty += chunk[1]
+        values.discard(0)
+        if nonEmpty < self.mWidth * self.mHeight:
+            values.add(0)
+        return values
+
+    ##
+    # Returns a copy of this grid. The copy shares its chunks with this grid
+    # until either of them is modified, so this is a constant time operation.
+    ##
+    def clone(self):
+        clone = ChunkedCellGrid(0, 0)
+        clone.mWidth = self.mWidth
+        clone.mHeight = self.mHeight
+        clone.mChunks = self.mChunks
+        clone.mChunksShared = True
+        self.mOwned = set()
+        self.mChunksShared = True
+        return clone
+
+    ##
+    # Returns a dictionary mapping each distinct packed value in this grid
+    # to the number of cells holding it.
+    ##
+    def valueCounts(self):
+        counts = {}
+        if self.mChunks:
+            if numpy:
+                values = numpy.frombuffer(b''.join(chunk[0] for chunk in self.mChunks.values()),
+                                          dtype=numpy.uint32)
+                distinct, valueCounts = numpy.unique(values, return_counts=True)
+                counts = dict(zip(distinct.tolist(), valueCounts.tolist()))
+            else:
+                counts = Counter(chain.from_iterable(chunk[0] for chunk in self.mChunks.values()))
+        counts.pop(0, None)
+        empty = self.mWidth * self.mHeight - sum(chunk[1] for chunk in self.mChunks.values())
+        if empty:
+            counts[0] = empty
+        return counts
+
+    ##
+    # Returns True when all cells of this grid are empty.
+    ##
+    def isEmpty(self):
+        return not self.mChunks
+
+    ##
+    # Iterates over the stored chunks together with the (x, y, width,
+    # height) area they cover within the grid.
+    ##
+    def __chunkAreas(self):
+        for (cx, cy), chunk in self.mChunks.items():
+            x = cx << ChunkBits
+            y = cy << ChunkBits
+            yield (x, y,
+                   min(ChunkSize, self.mWidth - x),
+                   min(ChunkSize, self.mHeight - y)), chunk
+
+    ##
+    # Returns the chunk at \a key for modification, copying it first when it
+    # may be shared with another grid. When there is no chunk at \a key, a
+    # new one is created if \a create is True and None is returned otherwise.
+    ##
+    def __mutableChunk(self, key, create):
+        if key in self.mOwned:
+            return self.mChunks[key]
+        chunk = self.mChunks.get(key)
+        if chunk is None:
+            if not create:
+                return None
+            chunk = emptyChunk()
+        else:
+            chunk = [array('I', chunk[0]), chunk[1]]
+        if self.mChunksShared:
+            self.mChunks = dict(self.mChunks)
+            self.mChunksShared = False
+        self.mChunks[key] = chunk
+        self.mOwned.add(key)
+        return chunk
+
+    ##
+    # Removes the chunk at \a key, after it became empty.
+    ##
+    def __removeChunk(self, key):
+        if self.mChunksShared:
+            self.mChunks = dict(self.mChunks)
+            self.mChunksShared = False
+        del self.mChunks[key]
+        self.mOwned.discard(key)
@@ -25,17 +25,191 @@
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 ##
+
+import bz2
+import lzma
 import zlib
-import gzip
 from PyQt5.QtCore import QByteArray
 
+# The amount of data produced per decompression step
+StreamChunkSize = 1 << 18
+
 class CompressionMethod():
     Gzip = 1
     Zlib = 2
+    Lzma = 3
+    Bzip2 = 4
 
 ##
-# Decompresses either zlib or gzip compressed memory. Returns a null
-# QByteArray if decompressing failed.
+# Describes a compression format: the \a name used for it in map files, a
+# function telling whether data starts with its header and factories for
+# compressor and decompressor objects.
+#
+# The compressor factory takes a compression level, where -1 means the
+# default level of the format. When \a multiStream is True, the format allows
+# several compressed streams to follow each other, whose contents are joined.
+##
+class Codec():
+    def __init__(self, method, name, matches, compressor, decompressor,
+                 multiStream = False):
+        self.method = method
+        self.name = name
+        self.matches = matches
+        self.compressor = compressor
+        self.decompressor = decompressor
+        self.multiStream = multiStream
+
+def isZlibHeader(data):
+    return (len(data) >= 2 and data[0] & 0x0f == 8
+            and ((data[0] << 8) | data[1]) % 31 == 0)
+
+def zlibCompressor(level, wbits):
+    return zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+def bzip2Compressor(level):
+    if (level < 1 or level > 9):
+        level = 9
+    return bz2.BZ2Compressor(level)
+
+def lzmaCompressor(level):
+    if (level < 0 or level > 9):
+        return lzma.LZMACompressor(lzma.FORMAT_XZ)
+    return lzma.LZMACompressor(lzma.FORMAT_XZ, preset=level)
+
+codecs = []
+
+##
+# Registers the given \a codec, replacing any codec registered for the same
+# compression method.
+##
+def registerCodec(codec):
+    unregisterCodec(codec.method)
+    codecs.append(codec)
+
+def unregisterCodec(method):
+    codecs[:] = [codec for codec in codecs if codec.method != method]
+
+##
+# Returns the codec registered for the given compression \a method, or None.
+##
+def codecForMethod(method):
+    for codec in codecs:
+        if (codec.method == method):
+            return codec
+    return None
+
+##
+# Returns the codec registered under the given \a name, or None.
+##
+def codecForName(name):
+    for codec in codecs:
+        if (codec.name == name):
+            return codec
+    return None
+
+##
+# Returns the codec whose header \a data starts with, or None when the format
+# is not recognized.
+##
+def codecForData(data):
+    for codec in codecs:
+        if (codec.matches(data)):
+            return codec
+    return None
+
+registerCodec(Codec(CompressionMethod.Gzip, "gzip",
+                    lambda data: data[:2] == b'\x1f\x8b',
+                    lambda level: zlibCompressor(level, 16 + zlib.MAX_WBITS),
+                    lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+                    multiStream = True))
+registerCodec(Codec(CompressionMethod.Zlib, "zlib",
+                    isZlibHeader,
+                    lambda level: zlibCompressor(level, zlib.MAX_WBITS),
+                    lambda: zlib.decompressobj(zlib.MAX_WBITS)))
+registerCodec(Codec(CompressionMethod.Lzma, "lzma",
+                    lambda data: data[:6] == b'\xfd7zXZ\x00',
+                    lzmaCompressor,
+                    lambda: lzma.LZMADecompressor(lzma.FORMAT_XZ)))
+registerCodec(Codec(CompressionMethod.Bzip2, "bzip2",
+                    lambda data: data[:3] == b'BZh',
+                    bzip2Compressor,
+                    bz2.BZ2Decompressor,
+                    multiStream = True))
+
+##
+# Yields the data decompressed by \a decompressor from \a data in chunks of at
+# most StreamChunkSize bytes. Returns the data following the end-of-stream
+# marker. Raises an exception when the data is corrupt or truncated.
+##
+def decompressStream(decompressor, data):
+    if hasattr(decompressor, 'unconsumed_tail'):
+        # zlib keeps the input it could not process yet for the caller
+        while (data and not decompressor.eof):
+            yield decompressor.decompress(data, StreamChunkSize)
+            data = decompressor.unconsumed_tail
+        if (not decompressor.eof):
+            yield decompressor.flush()
+    else:
+        yield decompressor.decompress(data, StreamChunkSize)
+        while (not decompressor.eof and not decompressor.needs_input):
+            yield decompressor.decompress(b'', StreamChunkSize)
+
+    if (not decompressor.eof):
+        raise EOFError("Compressed data ended before the end-of-stream marker")
+    return decompressor.unused_data
+
+##
+# Yields the data decompressed by \a codec from \a data in chunks of at most
+# StreamChunkSize bytes. For formats allowing several streams, the streams
+# following the first one are decompressed as well. Raises an exception when
+# the data is corrupt, truncated or followed by unexpected data.
+##
+def decompressChunks(codec, data):
+    while True:
+        data = yield from decompressStream(codec.decompressor(), data)
+        if (codec.multiStream):
+            # Like gzip.decompress, allow streams to be padded with zeroes
+            data = data.lstrip(b'\x00')
+        if (not data):
+            return
+        if (not codec.multiStream):
+            raise ValueError("Unexpected data after the end-of-stream marker")
+
+##
+# Decompresses \a data in any of the registered formats, which is detected
+# from its header. When the header is not recognized, the codec of the given
+# \a method is tried. Returns a bytearray, or None if decompressing failed.
+#
+# The output is allocated for \a expectedSize bytes up front and filled while
+# decompressing, so the uncompressed data is never held twice.
+##
+def decompressBytes(data, expectedSize = 1024, method = None):
+    codec = codecForData(data)
+    if (codec is None and method is not None):
+        codec = codecForMethod(method)
+    if (codec is None):
+        return None
+
+    result = bytearray(expectedSize)
+    size = 0
+    try:
+        for chunk in decompressChunks(codec, data):
+            end = size + len(chunk)
+            if (end <= expectedSize):
+                result[size:end] = chunk
+            else:
+                del result[size:]
+                result += chunk
+            size = end
+    except (zlib.error, lzma.LZMAError, OSError, EOFError, ValueError):
+        return None
+
+    del result[size:]
+    return result
+
+##
+# Decompresses memory compressed in any of the registered formats. Returns a
+# null QByteArray if decompressing failed.
 #
 # Needed because qUncompress does not support gzip compressed data. Also,
 # this method does not need the expected size to be prepended to the data,
@@ -46,28 +220,30 @@ class CompressionMethod():
 # @return the uncompressed data, or a null QByteArray if decompressing failed
 ##
 def decompress(data, expectedSize = 1024):
-    try:
-        obj = zlib.decompress(data.data())
-    except:
-        try:
-            obj = gzip.decompress(data.data())
-        except:
-            obj = b''
-    return QByteArray(obj), len(obj)
+    result = decompressBytes(data.data(), expectedSize)
+    if (result is None):
+        return QByteArray(), 0
+    return QByteArray(bytes(result)), len(result)
 
 ##
-# Compresses the give data in either gzip or zlib format. Returns a null
+# Compresses the given bytes-like \a data with the given \a method. Returns
+# the compressed bytes.
+#
+# @param level the compression level, or -1 for the default level
+##
+def compressBytes(data, method, level = -1):
+    compressor = codecForMethod(method).compressor(level)
+    return compressor.compress(data) + compressor.flush()
+
+##
+# Compresses the give data in any of the registered formats. Returns a null
 # QByteArray if compression failed.
 #
 # Needed because qCompress does not support gzip compression.
 #
 # @param data the uncompressed data
+# @param level the compression level, or -1 for the default level
 # @return the compressed data, or a null QByteArray if compression failed
 ##
-def compress(data, method):
-    if method == CompressionMethod.Gzip:
-        obj = gzip.compress(data.data())
-    elif method == CompressionMethod.Zlib:
-        obj = zlib.compress(data.data())
-
-    return QByteArray(obj)
+def compress(data, method, level = -1):
+    return QByteArray(compressBytes(data.data(), method, level))
@@ -26,16 +26,102 @@
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 ##
 
-from map import Map
-from compression import compress, decompress, CompressionMethod
+import os
+import sys
+import time
+import warnings
+import weakref
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from map import isBase64LayerDataFormat, layerDataCompressionMethod
+from compression import compressBytes, decompressBytes
 from tilelayer import Cell
 from pyqtcore import QMap
 from PyQt5.QtCore import QByteArray
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # Bits on the far end of the 32-bit global tile ID are used for tile flags
 FlippedHorizontallyFlag   = 0x80000000
 FlippedVerticallyFlag     = 0x40000000
 FlippedAntiDiagonallyFlag = 0x20000000
 
+##
+# Returns the gids stored as little-endian 32-bit integers in \a data, as a
+# NumPy array when NumPy is available and as an array('I') otherwise.
+##
+def gidsFromBytes(data):
+    if numpy:
+        return numpy.frombuffer(data, dtype='<u4').astype(numpy.uint32, copy=False)
+    gids = array('I')
+    gids.frombytes(data)
+    if sys.byteorder == 'big':
+        gids.byteswap()
+    return gids
+
+##
+# Returns the given \a gids as little-endian 32-bit integers.
+##
+def gidsToBytes(gids):
+    if numpy and isinstance(gids, numpy.ndarray):
+        return gids.astype('<u4', copy=False).tobytes()
+    if sys.byteorder == 'big':
+        gids = array('I', gids)
+        gids.byteswap()
+    return gids.tobytes()
+
+##
+# Decodes the base64 encoded and optionally compressed \a layerData of a
+# layer in the given \a format, which should hold \a size bytes once decoded.
+# Returns the raw gid bytes, or None when the layer data is corrupt.
+#
+# Only plain values are passed in and out, so that the layers of a map can be
+# decoded by worker threads or processes.
+##
+def decodeLayerPayload(layerData, format, size):
+    _layerData = QByteArray()
+    _layerData.append(layerData)
+    decodedData = QByteArray.fromBase64(_layerData).data()
+
+    method = layerDataCompressionMethod(format)
+    if (method is not None):
+        decodedData = decompressBytes(decodedData, size, method)
+        if (decodedData is None):
+            return None
+
+    if (size != len(decodedData)):
+        return None
+
+    return decodedData
+
+##
+# Parses the \a count comma separated gids in \a text at once. Returns them
+# as a NumPy array when NumPy is available and as an array('I') otherwise, or
+# None when not every value is a valid gid.
+##
+def gidsFromCSV(text, count):
+    if numpy:
+        with warnings.catch_warnings():
+            # NumPy warns instead of failing on text it can't parse
+            warnings.simplefilter('error', DeprecationWarning)
+            try:
+                gids = numpy.fromstring(text, dtype=numpy.int64, sep=',')
+            except (ValueError, DeprecationWarning):
+                return None
+        if (len(gids) != count or (count and (gids.min() < 0 or gids.max() > 0xFFFFFFFF))):
+            return None
+        return gids.astype(numpy.uint32)
+
+    try:
+        gids = array('I', map(int, text.split(',')))
+    except (ValueError, OverflowError):
+        return None
+    if (len(gids) != count):
+        return None
+    return gids
+
 class DecodeError():
     NoError = 0
     CorruptLayerData = 1
@@ -52,8 +138,10 @@ class GidMapper():
     ##
     def __init__(self, *args):
         self.mInvalidTile = None
-        self.mTilesetColumnCounts = QMap()
+        self.mTilesetColumnCounts = {}
+        self.mTilesetColumnRemaps = {}
         self.mFirstGidToTileset = QMap()
+        self.mTilesetToFirstGid = {}
         if len(args)==1:
             ##
             # Constructor that initializes the gid mapper using the given \a tilesets.
@@ -68,13 +156,18 @@ class GidMapper():
     # Insert the given \a tileset with \a firstGid as its first global ID.
     ##
     def insert(self, firstGid, tileset):
+        replaced = self.mFirstGidToTileset.value(firstGid)
+        if replaced and self.mTilesetToFirstGid.get(replaced) == firstGid:
+            del self.mTilesetToFirstGid[replaced]
         self.mFirstGidToTileset.insert(firstGid, tileset)
+        self.mTilesetToFirstGid.setdefault(tileset, firstGid)
 
     ##
     # Clears the gid mapper, so that it can be reused.
     ##
     def clear(self):
         self.mFirstGidToTileset.clear()
+        self.mTilesetToFirstGid.clear()
 
     ##
     # Returns True when no tilesets are known to this gid mapper.
@@ -82,6 +175,15 @@ class GidMapper():
     def isEmpty(self):
         return self.mFirstGidToTileset.isEmpty()
 
+    ##
+    # Returns the first gids and tilesets known to this gid mapper, along with
+    # the revisions of the tilesets. Two gid mappers with equal assignments
+    # map cells to the same gids.
+    ##
+    def assignment(self):
+        return tuple((firstGid, tileset, tileset.revision())
+                     for firstGid, tileset in self.mFirstGidToTileset)
+
     ##
     # Returns the GID of the invalid tile in case decodeLayerData() returns
     # the InvalidTile error.
@@ -118,13 +220,12 @@ class GidMapper():
                 tileId = gid - item[0]
                 tileset = item[1]
 
-                columnCount = self.mTilesetColumnCounts.value(tileset, 0)
-                if (columnCount > 0 and columnCount != tileset.columnCount()):
+                remap = self.__columnRemap(tileset)
+                if remap is None:
+                    result.tile = tileset.tileAt(tileId)
+                elif tileId < len(remap):
                     # Correct tile index for changes in image width
-                    row = int(tileId / columnCount)
-                    column = int(tileId % columnCount)
-                    tileId = row * tileset.columnCount() + column
-                result.tile = tileset.tileAt(tileId)
+                    result.tile = tileset.tileAt(remap[tileId])
                 ok = True
 
         return result, ok
@@ -136,19 +237,36 @@ class GidMapper():
     def cellToGid(self, cell):
         if (cell.isEmpty()):
             return 0
-        tileset = cell.tile.tileset()
         # Find the first GID for the tileset
-        for item in self.mFirstGidToTileset:
-            if item[1] == tileset:
-                gid = item[0] + cell.tile.id()
-                if (cell.flippedHorizontally):
-                    gid |= FlippedHorizontallyFlag
-                if (cell.flippedVertically):
-                    gid |= FlippedVerticallyFlag
-                if (cell.flippedAntiDiagonally):
-                    gid |= FlippedAntiDiagonallyFlag
-                return gid
-        return 0
+        firstGid = self.mTilesetToFirstGid.get(cell.tile.tileset())
+        if firstGid is None:
+            return 0
+        gid = firstGid + cell.tile.id()
+        if (cell.flippedHorizontally):
+            gid |= FlippedHorizontallyFlag
+        if (cell.flippedVertically):
+            gid |= FlippedVerticallyFlag
+        if (cell.flippedAntiDiagonally):
+            gid |= FlippedAntiDiagonallyFlag
+        return gid
+
+    ##
+    # Returns the global tile IDs of all cells of \a tileLayer, row by row, as
+    # a NumPy array when NumPy is available and as an array('I') otherwise.
+    # Each distinct cell is only mapped once.
+    ##
+    def cellsToGids(self, tileLayer):
+        grid = tileLayer.grid()
+        if numpy:
+            values = numpy.frombuffer(grid.toBytes(), dtype=numpy.uint32)
+            distinct, inverse = numpy.unique(values, return_inverse=True)
+            gids = [self.cellToGid(tileLayer.unpackCell(value)) for value in distinct.tolist()]
+            return numpy.array(gids, dtype=numpy.uint32)[inverse.ravel()]
+
+        gids = {}
+        for value in grid.distinctValues():
+            gids[value] = self.cellToGid(tileLayer.unpackCell(value))
+        return array('I', map(gids.__getitem__, grid.values()))
 
     ##
     # This sets the original tileset width. In case the image size has
@@ -159,70 +277,228 @@ class GidMapper():
         if (tileset.tileWidth() == 0):
             return
         self.mTilesetColumnCounts[tileset] = tileset.columnCountForWidth(width)
+        self.mTilesetColumnRemaps.pop(tileset, None)
+
+    ##
+    # Returns the table mapping the tile IDs of \a tileset as they were saved
+    # to its current tile IDs, or None when the width of the tileset image
+    # did not change.
+    #
+    # The tileset image is usually only loaded after setTilesetWidth() has
+    # been called, so the table is built on first use and rebuilt in case the
+    # column count of the tileset changes afterwards.
+    ##
+    def __columnRemap(self, tileset):
+        oldColumnCount = self.mTilesetColumnCounts.get(tileset, 0)
+        columnCount = tileset.columnCount()
+        if (oldColumnCount <= 0 or columnCount <= 0 or oldColumnCount == columnCount):
+            return None
+        cached = self.mTilesetColumnRemaps.get(tileset)
+        if cached and cached[0] == columnCount:
+            return cached[1]
+
+        # Old tile IDs past the last row can not refer to an existing tile
+        rowCount = -(-tileset.tileCount() // columnCount)
+        remap = array('I')
+        for row in range(rowCount):
+            remap.extend(range(row * columnCount, row * columnCount + oldColumnCount))
+        self.mTilesetColumnRemaps[tileset] = (columnCount, remap)
+        return remap
+
+    ##
+    # Sets the cells of \a tileLayer to the cells matched by the given \a gids,
+    # which are given row by row for the whole layer. Distinct gids are only
+    # looked up once, after which the layer is filled in one go.
+    #
+    # Returns DecodeError.NoError on success, in which case all cells have been
+    # replaced. On error the layer is left untouched.
+    ##
+    def gidsToCells(self, tileLayer, gids):
+        if numpy:
+            gids = numpy.asarray(gids, dtype=numpy.uint32)
+            distinct, inverse = numpy.unique(gids, return_inverse=True)
+            distinct = distinct.tolist()
+        else:
+            distinct = set(gids)
+
+        values = {}
+        invalid = set()
+        for gid in distinct:
+            result, ok = self.gidToCell(gid)
+            if ok:
+                values[gid] = tileLayer.packCell(result)
+            else:
+                invalid.add(gid)
+
+        if invalid:
+            # Report the first invalid gid in layer order
+            if numpy:
+                self.mInvalidTile = int(gids[numpy.isin(gids, list(invalid)).argmax()])
+            else:
+                self.mInvalidTile = next(gid for gid in gids if gid in invalid)
+            if self.isEmpty():
+                return DecodeError.TileButNoTilesets
+            else:
+                return DecodeError.InvalidTile
+
+        if numpy:
+            lookup = numpy.array([values[gid] for gid in distinct], dtype=numpy.uint32)
+            tileLayer.setPackedCells(lookup[inverse.ravel()])
+        else:
+            tileLayer.setPackedCells(array('I', map(values.__getitem__, gids)))
+
+        return DecodeError.NoError
 
     ##
     # Encodes the tile layer data of the given \a tileLayer in the given
     # \a format. This function should only be used for base64 encoding, with or
-    # without compression.
+    # without compression, where \a compressionLevel is -1 for the default level.
     ##
-    def encodeLayerData(self, tileLayer, format):
-        if format in [Map.LayerDataFormat.XML, Map.LayerDataFormat.CSV]:
+    def encodeLayerData(self, tileLayer, format, compressionLevel = -1):
+        if not isBase64LayerDataFormat(format):
             raise
 
-        tileData = QByteArray()
-        for y in range(tileLayer.height()):
-            for x in range(tileLayer.width()):
-                gid = self.cellToGid(tileLayer.cellAt(x, y))
-                tileData.append(bytes([gid&0xff]))
-                tileData.append(bytes([(gid >> 8)&0xff]))
-                tileData.append(bytes([(gid >> 16)&0xff]))
-                tileData.append(bytes([(gid >> 24)&0xff]))
-                
-        if len(tileData)%4 != 0:
-            raise
+        tileData = gidsToBytes(self.cellsToGids(tileLayer))
 
-        if (format == Map.LayerDataFormat.Base64Gzip):
-            tileData = compress(tileData, CompressionMethod.Gzip)
-        elif (format == Map.LayerDataFormat.Base64Zlib):
-            tileData = compress(tileData, CompressionMethod.Zlib)
+        method = layerDataCompressionMethod(format)
+        if (method is not None):
+            tileData = compressBytes(tileData, method, compressionLevel)
 
-        return tileData.toBase64()
+        return QByteArray(tileData).toBase64()
 
     def decodeLayerData(self, tileLayer, layerData, format):
-        if format in [Map.LayerDataFormat.XML, Map.LayerDataFormat.CSV]:
+        if not isBase64LayerDataFormat(format):
             raise
             
-        _layerData = QByteArray()
-        _layerData.append(layerData)
-        decodedData = QByteArray.fromBase64(_layerData)
         size = (tileLayer.width() * tileLayer.height()) * 4
+        decodedData = decodeLayerPayload(layerData, format, size)
+        if (decodedData is None):
+            return DecodeError.CorruptLayerData
 
-        if (format == Map.LayerDataFormat.Base64Gzip or format == Map.LayerDataFormat.Base64Zlib):
-            decodedData, size = decompress(decodedData, size)
+        return self.gidsToCells(tileLayer, gidsFromBytes(decodedData))
 
-        if (size != decodedData.length()):
-            return DecodeError.CorruptLayerData
+# Number of threads encoding layer data when saving, 0 meaning one per processor
+preferredEncodeWorkerCount = 0
 
-        data = decodedData.data()
-        x = 0
-        y = 0
+##
+# Sets the number of threads used to encode the layer data of a map when
+# saving it. A \a count of 0 uses one thread per processor.
+##
+def setEncodeWorkerCount(count):
+    global preferredEncodeWorkerCount
+    preferredEncodeWorkerCount = max(0, count)
 
-        for i in range(0, size - 3, 4):
-            gid = data[i] | data[i + 1] << 8 | data[i + 2] << 16 | data[i + 3] << 24
+##
+# Returns the number of threads used to encode the layer data of a map.
+##
+def encodeWorkerCount():
+    return preferredEncodeWorkerCount or os.cpu_count() or 1
 
-            result, ok = self.gidToCell(gid)
-            if (not ok):
-                self.mInvalidTile = gid
-                if self.isEmpty():
-                    return DecodeError.TileButNoTilesets
-                else:
-                    return DecodeError.InvalidTile
+##
+# Encodes the data of all \a tileLayers in the given base64 \a format, like
+# GidMapper.encodeLayerData() does, and returns it in the same order.
+#
+# The layers are spread over \a workerCount threads, defaulting to
+# encodeWorkerCount(). The compression functions release the interpreter lock,
+# so the layers are compressed in parallel. Each layer is still encoded as a
+# whole, so the result does not depend on the number of threads.
+##
+def encodeLayersData(gidMapper, tileLayers, format, compressionLevel = -1, workerCount = 0):
+    workerCount = min(workerCount or encodeWorkerCount(), len(tileLayers))
+    if (workerCount <= 1):
+        return [gidMapper.encodeLayerData(tileLayer, format, compressionLevel)
+                for tileLayer in tileLayers]
 
-            tileLayer.setCell(x, y, result)
+    def encode(tileLayer):
+        return gidMapper.encodeLayerData(tileLayer, format, compressionLevel)
 
-            x += 1
-            if (x == tileLayer.width()):
-                x = 0
-                y += 1
+    with ThreadPoolExecutor(workerCount) as executor:
+        return list(executor.map(encode, tileLayers))
 
-        return DecodeError.NoError
+##
+# Keeps the encoded data of tile layers between saves, so that only the layers
+# that changed since the last save need to be encoded again.
+#
+# Only the last encoding of each layer is kept, and it is dropped together
+# with the layer. It is reused when the modification count of the layer, the
+# layer data format, the compression level and the gid assignment all match.
+##
+class LayerDataCache():
+    def __init__(self):
+        self.mEntries = weakref.WeakKeyDictionary()
+        self.resetStatistics()
+
+    ##
+    # Returns the encoded data of \a tileLayer, like
+    # GidMapper.encodeLayerData() does, encoding it only when needed.
+    ##
+    def encodeLayerData(self, gidMapper, tileLayer, format, compressionLevel = -1):
+        return self.encodeLayersData(gidMapper, [tileLayer], format, compressionLevel)[0]
+
+    ##
+    # Returns the encoded data of all \a tileLayers, like encodeLayersData()
+    # does, encoding only the layers that changed. These are encoded using
+    # \a workerCount threads.
+    ##
+    def encodeLayersData(self, gidMapper, tileLayers, format, compressionLevel = -1, workerCount = 0):
+        assignment = gidMapper.assignment()
+        keys = []
+        result = []
+        changedLayers = []
+        for tileLayer in tileLayers:
+            key = (tileLayer.modificationCount(), format, compressionLevel, assignment)
+            entry = self.mEntries.get(tileLayer)
+            if (entry and entry[0] == key):
+                self.mHits += 1
+                result.append(entry[1])
+            else:
+                keys.append(key)
+                result.append(None)
+                changedLayers.append(tileLayer)
+
+        if (not changedLayers):
+            return result
+
+        start = time.perf_counter()
+        changedData = encodeLayersData(gidMapper, changedLayers, format,
+                                       compressionLevel, workerCount)
+        self.mEncodeTime += time.perf_counter() - start
+        self.mMisses += len(changedLayers)
+
+        changed = iter(zip(changedLayers, keys, changedData))
+        for i in range(len(result)):
+            if (result[i] is None):
+                tileLayer, key, tileData = next(changed)
+                self.mEntries[tileLayer] = (key, tileData)
+                result[i] = tileData
+
+        return result
+
+    ##
+    # Forgets all encoded layer data.
+    ##
+    def clear(self):
+        self.mEntries.clear()
+
+    ##
+    # Returns the number of layers whose encoded data could be reused.
+    ##
+    def hits(self):
+        return self.mHits
+
+    ##
+    # Returns the number of layers that had to be encoded.
+    ##
+    def misses(self):
+        return self.mMisses
+
+    ##
+    # Returns the time spent encoding layers, in seconds.
+    ##
+    def encodeTime(self):
+        return self.mEncodeTime
+
+    def resetStatistics(self):
+        self.mHits = 0
+        self.mMisses = 0
+        self.mEncodeTime = 0.0
@@ -265,6 +265,8 @@ class HexagonalRenderer(OrthogonalRenderer):
         if (inLeftHalf):
             startTile.setX(startTile.x() - 1)
         renderer = CellRenderer(painter)
+        step = p.tileWidth + p.sideLengthX
+        # Only visit the non-empty cells of each row
         if (p.staggerX):
             startTile.setX(max(-1, startTile.x()))
             startTile.setY(max(-1, startTile.y()))
@@ -272,17 +274,16 @@ class HexagonalRenderer(OrthogonalRenderer):
             startPos.setY(startPos.y() + p.tileHeight)
             staggeredRow = p.doStaggerX(startTile.x() + layer.x())
             while(startPos.y() < rect.bottom() and startTile.y() < layer.height()):
-                rowTile = QPoint(startTile)
-                rowPos = QPoint(startPos)
-                while(rowPos.x() < rect.right() and rowTile.x() < layer.width()):
-                    if (layer.contains(rowTile)):
-                        cell = layer.cellAt(rowTile)
-                        if (not cell.isEmpty()):
+                # Only every second column is part of this row
+                if (startTile.y() >= 0):
+                    columns = self.__columnCount(startPos.x(), rect.right(), step)
+                    endX = startTile.x() + 2 * (columns - 1)
+                    for x, cell in layer.cellsInRow(startTile.y(), startTile.x(), endX):
+                        if ((x - startTile.x()) % 2 == 0):
+                            rowPos = QPoint(startPos.x() + (x - startTile.x()) // 2 * step,
+                                            startPos.y())
                             renderer.render(cell, rowPos, QSizeF(0, 0), CellRenderer.BottomLeft)
 
-                    rowPos.setX(rowPos.x() + p.tileWidth + p.sideLengthX)
-                    rowTile.setX(rowTile.x() + 2)
-
                 if (staggeredRow):
                     startTile.setX(startTile.x() - 1)
                     startTile.setY(startTile.y() + 1)
@@ -304,20 +305,27 @@ class HexagonalRenderer(OrthogonalRenderer):
             if (p.doStaggerY(startTile.y() + layer.y())):
                 startPos.setX(startPos.x() - p.columnWidth)
             while(startPos.y() < rect.bottom() and startTile.y() < layer.height()):
-                rowTile = QPoint(startTile)
-                rowPos = QPoint(startPos)
+                rowX = startPos.x()
                 if (p.doStaggerY(startTile.y() + layer.y())):
-                    rowPos.setX(rowPos.x() + p.columnWidth)
-                while(rowPos.x() < rect.right() and rowTile.x() < layer.width()):
-                    cell = layer.cellAt(rowTile)
-                    if (not cell.isEmpty()):
-                        renderer.render(cell, rowPos, QSizeF(0, 0), CellRenderer.BottomLeft)
-                    rowPos.setX(rowPos.x() + p.tileWidth + p.sideLengthX)
-                    rowTile.setX(rowTile.x() + 1)
+                    rowX += p.columnWidth
+                columns = self.__columnCount(rowX, rect.right(), step)
+                endX = startTile.x() + columns - 1
+                for x, cell in layer.cellsInRow(startTile.y(), startTile.x(), endX):
+                    rowPos = QPoint(rowX + (x - startTile.x()) * step, startPos.y())
+                    renderer.render(cell, rowPos, QSizeF(0, 0), CellRenderer.BottomLeft)
 
                 startPos.setY(startPos.y() + p.rowHeight)
                 startTile.setY(startTile.y() + 1)
 
+        renderer.flush()
+
+    ##
+    # Returns the number of columns, \a step pixels apart and starting at \a x,
+    # that start left of \a right.
+    ##
+    def __columnCount(self, x, right, step):
+        return max(0, (right - x + step - 1) // step)
+
     def drawTileSelection(self, painter, region, color, exposed):
         painter.setBrush(color)
         painter.setPen(Qt.NoPen)
@@ -81,7 +81,7 @@ class IsometricRenderer(MapRenderer):
             if (not object.cell().isEmpty()):
                 bottomCenter = self.pixelToScreenCoords_(object.position())
                 tile = object.cell().tile
-                imgSize = tile.image().size()
+                imgSize = tile.size()
                 tileOffset = tile.offset()
                 objectSize = object.size()
                 scale = QSizeF(objectSize.width() / imgSize.width(), objectSize.height() / imgSize.height())
@@ -211,6 +211,17 @@ class IsometricRenderer(MapRenderer):
             x = startPos.x()
             while(x < rect.right()):
                 if (layer.contains(columnItr)):
+                    empty = layer.emptyAreaAt(columnItr.x(), columnItr.y())
+                    if (empty):
+                        # Skip to where the row leaves the empty area
+                        emptyX, emptyY, emptyWidth, emptyHeight = empty
+                        steps = min(emptyX + emptyWidth - columnItr.x(),
+                                    columnItr.y() - emptyY + 1)
+                        columnItr.setX(columnItr.x() + steps)
+                        columnItr.setY(columnItr.y() - steps)
+                        x += tileWidth * steps
+                        continue
+
                     cell = layer.cellAt(columnItr)
                     if (not cell.isEmpty()):
                         renderer.render(cell, QPointF(x, y/2), QSizeF(0, 0),
@@ -232,6 +243,8 @@ class IsometricRenderer(MapRenderer):
                 shifted = False
             y += tileHeight
 
+        renderer.flush()
+
     def drawTileSelection(self, painter, region, color, exposed):
         painter.setBrush(color)
         painter.setPen(Qt.NoPen)
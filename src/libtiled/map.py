@@ -29,12 +29,15 @@
 ##
 
 import math
+from collections import Counter
 from enum import Enum
 from layer import Layer
 from pyqtcore import QList, QVector
 from object import Object
+from compression import CompressionMethod, codecForMethod, codecForName
 from PyQt5.QtGui import (
-    QColor
+    QColor,
+    QRegion
 )
 from PyQt5.QtCore import (
     QSize,
@@ -127,6 +130,44 @@ def renderOrderFromString(string):
         renderOrder = Map.RenderOrder.LeftUp
     return renderOrder
 
+##
+# Returns whether tile layer data in the given \a format is base64 encoded.
+##
+def isBase64LayerDataFormat(format):
+    return format not in (Map.LayerDataFormat.XML, Map.LayerDataFormat.CSV)
+
+##
+# Returns the compression method used by the given layer data \a format, or
+# None when the data is not compressed.
+##
+def layerDataCompressionMethod(format):
+    return LayerDataCompressionMethods.get(format)
+
+##
+# Returns the name of the compression used by the given layer data \a
+# format, or an empty string when the data is not compressed.
+##
+def layerDataCompressionToString(format):
+    method = layerDataCompressionMethod(format)
+    if method is None:
+        return ''
+    return codecForMethod(method).name
+
+##
+# Returns the base64 layer data format using the compression with the given
+# name, or None when the compression is not supported.
+##
+def base64LayerDataFormatFromString(compression):
+    if compression == '':
+        return Map.LayerDataFormat.Base64
+    codec = codecForName(compression)
+    if codec is None:
+        return None
+    for format, method in LayerDataCompressionMethods.items():
+        if method == codec.method:
+            return format
+    return None
+
 ##
 # A tile map. Consists of a stack of layers, each can be either a TileLayer
 # or an ObjectGroup.
@@ -149,11 +190,13 @@ class Map(Object):
     # The different formats in which the tile layer data can be stored.
     ##
     class LayerDataFormat(Enum):
-        XML        = 0
-        Base64     = 1
-        Base64Gzip = 2
-        Base64Zlib = 3
-        CSV        = 4
+        XML         = 0
+        Base64      = 1
+        Base64Gzip  = 2
+        Base64Zlib  = 3
+        CSV         = 4
+        Base64Lzma  = 5
+        Base64Bzip2 = 6
 
     ##
     # The order in which tiles are rendered on screen.
@@ -195,7 +238,9 @@ class Map(Object):
         self.mLayers = QList()
         self.mTilesets = QVector()
         self.mLayerDataFormat = None
+        self.mCompressionLevel = -1
         self.mNextObjectId = 0
+        self.mTilesetReferences = Counter()
 
         l = len(args)
         if l==1:
@@ -219,6 +264,7 @@ class Map(Object):
             self.mDrawMargins = map.mDrawMargins
             self.mTilesets = map.mTilesets
             self.mLayerDataFormat = map.mLayerDataFormat
+            self.mCompressionLevel = map.mCompressionLevel
             self.mNextObjectId = 1
             for layer in map.mLayers:
                 clone = layer.clone()
@@ -596,11 +642,67 @@ class Map(Object):
     # map.
     ##
     def isTilesetUsed(self, tileset):
+        if (self.mTilesetReferences[tileset] > 0):
+            return True
         for layer in self.mLayers:
-            if (layer.referencesTileset(tileset)):
+            if (not layer.isTileLayer() and layer.referencesTileset(tileset)):
                 return True
         return False
 
+    ##
+    # Compares the tile layers of this map to those of the \a other map and
+    # returns a list with the region that changed for each layer index, in
+    # map coordinates. Layers are matched by index. A tile layer without a
+    # tile layer counterpart changed wherever it has tiles, and the region is
+    # empty where neither map has a tile layer.
+    ##
+    def diffRegions(self, other):
+        regions = QList()
+        for index in range(max(self.layerCount(), other.layerCount())):
+            layer = None
+            otherLayer = None
+            if (index < self.layerCount()):
+                layer = self.layerAt(index).asTileLayer()
+            if (index < other.layerCount()):
+                otherLayer = other.layerAt(index).asTileLayer()
+            if (layer and otherLayer):
+                regions.append(layer.diffRegion(otherLayer))
+            elif (layer or otherLayer):
+                regions.append((layer or otherLayer).region())
+            else:
+                regions.append(QRegion())
+        return regions
+
+    ##
+    # Called by the tile layers of this map when they start referring to
+    # the given \a tilesets.
+    ##
+    def addTilesetReferences(self, tilesets):
+        for tileset in tilesets:
+            self.mTilesetReferences[tileset] += 1
+
+    ##
+    # Called by the tile layers of this map when they no longer refer to
+    # the given \a tilesets.
+    ##
+    def removeTilesetReferences(self, tilesets):
+        for tileset in tilesets:
+            count = self.mTilesetReferences[tileset] - 1
+            if (count > 0):
+                self.mTilesetReferences[tileset] = count
+            else:
+                del self.mTilesetReferences[tileset]
+
+    ##
+    # Verifies the number of tile layers referring to each tileset against
+    # the tilesets used by each tile layer.
+    ##
+    def verifyTilesetReferences(self):
+        references = Counter()
+        for layer in self.tileLayers():
+            references.update(layer.usedTilesets())
+        assert references == self.mTilesetReferences, "Tileset references of map out of sync"
+
     ##
     # Creates a new map that contains the given \a layer. The map size will be
     # determined by the size of the layer.
@@ -620,6 +722,16 @@ class Map(Object):
     def setLayerDataFormat(self, format):
         self.mLayerDataFormat = format
 
+    ##
+    # Returns the level used to compress the tile layer data, where -1 stands
+    # for the default level of the compression method.
+    ##
+    def compressionLevel(self):
+        return self.mCompressionLevel
+
+    def setCompressionLevel(self, level):
+        self.mCompressionLevel = level
+
     ##
     # Sets the next id to be used for objects on this map.
     ##
@@ -648,3 +760,10 @@ class Map(Object):
             for o in group.objects():
                 if (o.id() == 0):
                     o.setId(self.takeNextObjectId())
+
+LayerDataCompressionMethods = {
+    Map.LayerDataFormat.Base64Gzip: CompressionMethod.Gzip,
+    Map.LayerDataFormat.Base64Zlib: CompressionMethod.Zlib,
+    Map.LayerDataFormat.Base64Lzma: CompressionMethod.Lzma,
+    Map.LayerDataFormat.Base64Bzip2: CompressionMethod.Bzip2,
+}
@@ -26,6 +26,9 @@
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 ##
 
+import os
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from tiled_global import Int, Int2, Float, Float2
 from properties import Properties
 from tile import Frame
@@ -37,9 +40,16 @@ from map import (
     orientationFromString, 
     staggerAxisFromString, 
     staggerIndexFromString, 
-    renderOrderFromString
+    renderOrderFromString,
+    base64LayerDataFormatFromString
+)
+from gidmapper import (
+    GidMapper,
+    DecodeError,
+    decodeLayerPayload,
+    gidsFromBytes,
+    gidsFromCSV
 )
-from gidmapper import GidMapper, DecodeError
 from mapobject import MapObject
 from objectgroup import ObjectGroup, drawOrderFromString
 from imagelayer import ImageLayer
@@ -77,7 +87,26 @@ def readLayerAttributes(layer, atts):
                          Float(atts.value("offsety")))
 
     layer.setOffset(offset)
-    
+
+##
+# Decodes the given base64 layer \a payloads, which are tuples of layer data,
+# format and expected size, using up to \a workerCount workers. Processes are
+# used instead of threads when \a useProcesses is True.
+#
+# Returns the decoded gid bytes (or None for corrupt data) in payload order.
+##
+def decodeLayerPayloads(payloads, workerCount, useProcesses):
+    workerCount = min(workerCount, len(payloads))
+    if (workerCount <= 1):
+        return [decodeLayerPayload(*payload) for payload in payloads]
+
+    if (useProcesses):
+        executor = ProcessPoolExecutor(workerCount)
+    else:
+        executor = ThreadPoolExecutor(workerCount)
+    with executor:
+        return list(executor.map(decodeLayerPayload, *zip(*payloads)))
+
 ##
 # A fast QXmlStreamReader based reader for the TMX and TSX formats.
 #
@@ -92,6 +121,32 @@ class MapReader():
     def __del__(self):
         del self.d
 
+    ##
+    # Sets the maximum number of workers used to decode the base64 layer data
+    # of a map. Layers are decoded one after the other when \a count is 1.
+    ##
+    def setDecodeWorkerCount(self, count):
+        self.d.mDecodeWorkerCount = max(1, count)
+
+    ##
+    # Returns the maximum number of workers used to decode layer data.
+    ##
+    def decodeWorkerCount(self):
+        return self.d.mDecodeWorkerCount
+
+    ##
+    # Sets whether layer data is decoded by worker processes rather than
+    # threads. Threads are used by default.
+    ##
+    def setDecodeInProcesses(self, enabled):
+        self.d.mDecodeInProcesses = enabled
+
+    ##
+    # Returns whether layer data is decoded by worker processes.
+    ##
+    def decodeInProcesses(self):
+        return self.d.mDecodeInProcesses
+
     ##
     # Reads a TMX map from the given \a device. Optionally a \a path can
     # be given, which will be used to resolve relative references to external
@@ -200,9 +255,13 @@ class MapReaderPrivate():
         self.mReadingExternalTileset = False
         self.xml = QXmlStreamReader()
         self.mGidMapper = GidMapper()
+        self.mPendingLayerData = []
+        self.mDecodeWorkerCount = os.cpu_count() or 1
+        self.mDecodeInProcesses = False
 
     def readMap(self, device, path):
         self.mError = QString('')
+        self.mPendingLayerData = []
         self.mPath = path
         map = None
         self.xml.setDevice(device)
@@ -241,7 +300,10 @@ class MapReaderPrivate():
         if self.mError != '':
             return self.mError
         else:
-            return self.tr("%d\n\nLine %d, column %s"%(self.xml.lineNumber(), self.xml.columnNumber(), self.xml.errorString()))
+            return self.__formatError(self.xml.lineNumber(), self.xml.columnNumber(), self.xml.errorString())
+
+    def __formatError(self, lineNumber, columnNumber, errorString):
+        return self.tr("%d\n\nLine %d, column %s"%(lineNumber, columnNumber, errorString))
 
     def __readUnknownElement(self):
         qDebug("Unknown element (fixme): "+self.xml.name()+" at line "+self.xml.lineNumber()+", column "+self.xml.columnNumber())
@@ -266,6 +328,7 @@ class MapReaderPrivate():
         renderOrderString = atts.value("renderorder")
         renderOrder = renderOrderFromString(renderOrderString)
         nextObjectId = Int(atts.value("nextobjectid"))
+        compressionLevel, ok = Int2(atts.value("compressionlevel"))
         self.mMap = Map(orientation, mapWidth, mapHeight, tileWidth, tileHeight)
         self.mMap.setHexSideLength(hexSideLength)
         self.mMap.setStaggerAxis(staggerAxis)
@@ -273,6 +336,8 @@ class MapReaderPrivate():
         self.mMap.setRenderOrder(renderOrder)
         if (nextObjectId):
             self.mMap.setNextObjectId(nextObjectId)
+        if (ok):
+            self.mMap.setCompressionLevel(compressionLevel)
 
         bgColorString = atts.value("backgroundcolor")
         if len(bgColorString)>0:
@@ -281,6 +346,9 @@ class MapReaderPrivate():
             if (self.xml.name() == "properties"):
                 self.mMap.mergeProperties(self.__readProperties())
             elif (self.xml.name() == "tileset"):
+                # Layer data read so far only refers to the previous tilesets
+                if (not self.__decodePendingLayerData()):
+                    break
                 self.mMap.addTileset(self.__readTileset())
             elif (self.xml.name() == "layer"):
                 self.mMap.addLayer(self.__readLayer())
@@ -291,6 +359,8 @@ class MapReaderPrivate():
             else:
                 self.__readUnknownElement()
 
+        self.__decodePendingLayerData()
+
         # Clean up in case of error
         if (self.xml.hasError()):
             self.mMap = None
@@ -509,13 +579,8 @@ class MapReaderPrivate():
         elif (encoding == "csv"):
             layerDataFormat = Map.LayerDataFormat.CSV
         elif (encoding == "base64"):
-            if (compression == ''):
-                layerDataFormat = Map.LayerDataFormat.Base64
-            elif (compression == "gzip"):
-                layerDataFormat = Map.LayerDataFormat.Base64Gzip
-            elif (compression == "zlib"):
-                layerDataFormat = Map.LayerDataFormat.Base64Zlib
-            else:
+            layerDataFormat = base64LayerDataFormatFromString(compression)
+            if (layerDataFormat is None):
                 self.xml.raiseError(self.tr("Compression method '%s' not supported"%compression))
                 return
         else:
@@ -554,37 +619,83 @@ class MapReaderPrivate():
                 elif (encoding == "csv"):
                     self.__decodeCSVLayerData(tileLayer, self.xml.text())
 
+    ##
+    # Queues the base64 layer \a data for decoding together with the other
+    # layers of the map. The current position is kept for error reporting.
+    ##
     def __decodeBinaryLayerData(self, tileLayer, data, format):
-        error = self.mGidMapper.decodeLayerData(tileLayer, data, format)
+        size = (tileLayer.width() * tileLayer.height()) * 4
+        self.mPendingLayerData.append((tileLayer, data, format, size,
+                                       self.xml.lineNumber(),
+                                       self.xml.columnNumber()))
+
+    ##
+    # Decodes the queued layer data, possibly in parallel, after which the
+    # cells are assigned in document order. The first error is reported at
+    # the position of its layer data, like when decoding it right away.
+    #
+    # Returns False when an error occurred.
+    ##
+    def __decodePendingLayerData(self):
+        pending = self.mPendingLayerData
+        if (not pending):
+            return True
+        self.mPendingLayerData = []
+
+        payloads = [(data, format, size) for _, data, format, size, _, _ in pending]
+        decoded = decodeLayerPayloads(payloads, self.mDecodeWorkerCount,
+                                      self.mDecodeInProcesses)
+
+        for (tileLayer, _, _, _, lineNumber, columnNumber), data in zip(pending, decoded):
+            if (data is None):
+                error = DecodeError.CorruptLayerData
+            else:
+                error = self.mGidMapper.gidsToCells(tileLayer, gidsFromBytes(data))
 
+            if error==DecodeError.NoError:
+                continue
+
+            message = self.__decodeErrorString(tileLayer, error)
+            self.mError = self.__formatError(lineNumber, columnNumber, message)
+            self.xml.raiseError(message)
+            return False
+
+        return True
+
+    def __decodeErrorString(self, tileLayer, error):
         if error==DecodeError.CorruptLayerData:
-            self.xml.raiseError(self.tr("Corrupt layer data for layer '%s'"%tileLayer.name()))
-            return
+            return self.tr("Corrupt layer data for layer '%s'"%tileLayer.name())
         elif error==DecodeError.TileButNoTilesets:
-            self.xml.raiseError(self.tr("Tile used but no tilesets specified"))
-            return
+            return self.tr("Tile used but no tilesets specified")
         elif error==DecodeError.InvalidTile:
-            self.xml.raiseError(self.tr("Invalid tile: %d"%self.mGidMapper.invalidTile()))
-            return
-        elif error==DecodeError.NoError:
-            pass
+            return self.tr("Invalid tile: %d"%self.mGidMapper.invalidTile())
 
     def __decodeCSVLayerData(self, tileLayer, text):
         trimText = text.strip()
-        tiles = trimText.split(',')
-        if (len(tiles) != tileLayer.width() * tileLayer.height()):
+        size = tileLayer.width() * tileLayer.height()
+        if (trimText.count(',') + 1 != size):
             self.xml.raiseError(self.tr("Corrupt layer data for layer '%s'"%tileLayer.name()))
             return
 
-        for y in range(tileLayer.height()):
-            for x in range(tileLayer.width()):
-                conversionOk = False
-                gid, conversionOk = Int2(tiles[y * tileLayer.width() + x])
+        gids = gidsFromCSV(trimText, size)
+        if (gids is None):
+            # Parse tile by tile to find the first one that is not a valid gid
+            gids = array('I')
+            for index, tile in enumerate(trimText.split(',')):
+                gid, conversionOk = Int2(tile)
+                x = index % tileLayer.width()
+                y = index // tileLayer.width()
                 if (not conversionOk):
                     self.xml.raiseError(self.tr("Unable to parse tile at (%d,%d) on layer '%s'"%(x + 1, y + 1, tileLayer.name())))
                     return
+                elif (gid < 0 or gid > 0xFFFFFFFF):
+                    self.xml.raiseError(self.tr("Invalid tile: %d"%gid))
+                    return
+                gids.append(gid)
 
-                tileLayer.setCell(x, y, self.__cellForGid(gid))
+        error = self.mGidMapper.gidsToCells(tileLayer, gids)
+        if (error != DecodeError.NoError):
+            self.xml.raiseError(self.__decodeErrorString(tileLayer, error))
 
     ##
     # Returns the cell for the given global tile ID. Errors are raised with
@@ -26,7 +26,16 @@
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 ##
 
+import weakref
+from array import array
+from collections import OrderedDict
+from object import Object
+from cellgrid import TileIndexMask
 from pyqtcore import QVector
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from PyQt5.QtCore import (
     Qt,
     QRect, 
@@ -39,7 +48,10 @@ from PyQt5.QtGui import (
     QVector2D,
     QPolygonF, 
     QPaintEngine,
-    QPainter
+    QPainter,
+    QImage,
+    QPixmap,
+    QTransform
 )
 ##
 # Converts a line running from \a start to \a end to a polygon which
@@ -65,12 +77,14 @@ RenderFlags = RenderFlag
 # orientations.
 ##
 class MapRenderer():
+    DefaultLevelOfDetailThreshold = 0.25
 
     def __init__(self, map):
         self.mMap = map
         self.mFlags = 0
         self.mObjectLineWidth = 2
         self.mPainterScale = 1
+        self.mLevelOfDetailThreshold = MapRenderer.DefaultLevelOfDetailThreshold
 
     def __del__(self):
         pass
@@ -254,6 +268,29 @@ class MapRenderer():
     def setFlags(self, flags):
         self.mFlags = flags
 
+    def levelOfDetailThreshold(self):
+        return self.mLevelOfDetailThreshold
+
+    ##
+    # Sets the painter scale below which tile layers are drawn with one
+    # average color per tile (see TileColorCache). A threshold of 0 disables
+    # this. Not all renderers support it.
+    ##
+    def setLevelOfDetailThreshold(self, threshold):
+        self.mLevelOfDetailThreshold = threshold
+
+    ##
+    # Returns whether tile layers drawn with \a painter should be drawn with
+    # one average color per tile, which is the case when the painter scales
+    # them down below the level of detail threshold.
+    ##
+    def useLevelOfDetail(self, painter):
+        transform = painter.worldTransform()
+        if (transform.type() > QTransform.TxScale):
+            return False
+        scale = max(abs(transform.m11()), abs(transform.m22()))
+        return scale < self.mLevelOfDetailThreshold
+
     def lineToPolygon(self, start, end):
         direction = QVector2D(end - start).normalized().toPointF()
         perpendicular = QPointF(-direction.y(), direction.x())
@@ -273,6 +310,331 @@ class MapRenderer():
     def map(self):
         return self.mMap
 
+##
+# Returns where the area \a rect of an image of the given \a width and
+# \a height ends up when the image is mirrored as requested by
+# \a mirrorHorizontally and \a mirrorVertically and then rotated by 90 degrees
+# clockwise when \a rotated is True.
+##
+def variantRect(rect, width, height, mirrorHorizontally, mirrorVertically, rotated):
+    x = rect.x()
+    y = rect.y()
+    if (mirrorHorizontally):
+        x = width - x - rect.width()
+    if (mirrorVertically):
+        y = height - y - rect.height()
+    if (rotated):
+        return QRect(height - y - rect.height(), x, rect.height(), rect.width())
+    return QRect(x, y, rect.width(), rect.height())
+
+##
+# Keeps mirrored and rotated copies of tileset images and of the images of
+# tiles that are not part of a tileset image, so that flipped cells can be
+# drawn as fragments with a positive scale. The raster paint engine does not
+# support mirroring fragments. Whole tileset images are copied when all their
+# variants fit in a fraction of the cache (see holdsImageVariants()), so
+# flipped cells of the same tileset can still be drawn together. Tiles of
+# larger tileset images get copies of their own.
+#
+# The copies are made on first use. When their total size exceeds
+# maximumCost() bytes, the least recently used ones are dropped.
+##
+class TileVariantCache():
+    mInstance = None
+    DefaultMaximumCost = 64 * 1024 * 1024
+    # The number of mirrored and rotated variants an image can have
+    VariantCount = 7
+
+    def __init__(self):
+        self.mVariants = OrderedDict()
+        self.mMaximumCost = TileVariantCache.DefaultMaximumCost
+        self.mTotalCost = 0
+
+    def instance():
+        if (not TileVariantCache.mInstance):
+            TileVariantCache.mInstance = TileVariantCache()
+        return TileVariantCache.mInstance
+
+    def deleteInstance():
+        del TileVariantCache.mInstance
+        TileVariantCache.mInstance = None
+
+    ##
+    # Returns whether all variants of the image of \a tileset fit in the cache
+    # together, so that drawing cells flipped in different ways does not make
+    # them evict each other.
+    ##
+    def holdsImageVariants(self, tileset):
+        image = tileset.image()
+        cost = image.width() * image.height() * 4
+        return cost * TileVariantCache.VariantCount <= self.mMaximumCost
+
+    ##
+    # Returns the image of \a source, which is a tile or a tileset, mirrored
+    # as requested by \a mirrorHorizontally and \a mirrorVertically and then
+    # rotated by 90 degrees clockwise when \a rotated is True. Use variantRect()
+    # to find a tile in it.
+    ##
+    def variant(self, source, mirrorHorizontally, mirrorVertically, rotated):
+        image = source.image()
+        key = (source, mirrorHorizontally, mirrorVertically, rotated)
+        entry = self.mVariants.get(key)
+        if (entry):
+            # The variant is outdated when the image was replaced
+            if (entry[0] == image.cacheKey()):
+                self.mVariants.move_to_end(key)
+                return entry[1]
+            self.__remove(key)
+
+        variant = QPixmap.fromImage(image.toImage().mirrored(mirrorHorizontally,
+                                                             mirrorVertically))
+        if (rotated):
+            variant = variant.transformed(QTransform().rotate(90))
+
+        cost = variant.width() * variant.height() * 4
+        self.mVariants[key] = (image.cacheKey(), variant, cost)
+        self.mTotalCost += cost
+        self.__trim()
+        return variant
+
+    ##
+    # Drops the variants of \a tileset and of its tiles. Should be called when
+    # the images of its tiles changed.
+    ##
+    def invalidate(self, tileset):
+        for key in list(self.mVariants):
+            source = key[0]
+            if (source.typeId() == Object.TileType):
+                source = source.tileset()
+            if (source is tileset):
+                self.__remove(key)
+
+    def clear(self):
+        self.mVariants.clear()
+        self.mTotalCost = 0
+
+    ##
+    # Sets the maximum total size of the cached variants, in bytes. The most
+    # recently used variant is kept even when it is larger.
+    ##
+    def setMaximumCost(self, cost):
+        self.mMaximumCost = cost
+        self.__trim()
+
+    def maximumCost(self):
+        return self.mMaximumCost
+
+    ##
+    # Returns the total size of the cached variants, in bytes.
+    ##
+    def totalCost(self):
+        return self.mTotalCost
+
+    def __remove(self, key):
+        self.mTotalCost -= self.mVariants.pop(key)[2]
+
+    def __trim(self):
+        while (self.mTotalCost > self.mMaximumCost and len(self.mVariants) > 1):
+            self.mTotalCost -= self.mVariants.popitem(last=False)[1][2]
+
+##
+# Keeps the average color of tiles and, for each tile layer, an image with
+# one pixel per cell showing the average color of its tile. Renderers draw
+# these images instead of the tiles when zoomed far out, which costs the same
+# regardless of the number of visible tiles.
+#
+# Layers larger than MaximumImageSize cells in either direction get an image
+# with one pixel per square block of cells (see cellsPerPixel()), holding the
+# average color of the block. Only the occupied areas of a layer are
+# rendered, the rest of its image stays transparent.
+#
+# A layer image is rebuilt when the cells of its layer changed and dropped
+# when a tileset used by the layer was invalidated or the layer was deleted.
+# When the total size of the layer images exceeds maximumCost() bytes, the
+# least recently used ones are dropped.
+##
+class TileColorCache():
+    mInstance = None
+    DefaultMaximumCost = 128 * 1024 * 1024
+    MaximumImageSize = 2048
+
+    def __init__(self):
+        self.mColors = {}
+        # The layers are referenced weakly, so that the images of deleted
+        # layers do not keep these and their maps alive
+        self.mLayerImages = weakref.WeakKeyDictionary()
+        # Maps weak references to the layers to the size of their images, in
+        # the order they were last used
+        self.mLayerCosts = OrderedDict()
+        self.mMaximumCost = TileColorCache.DefaultMaximumCost
+        self.mTotalCost = 0
+
+    def instance():
+        if (not TileColorCache.mInstance):
+            TileColorCache.mInstance = TileColorCache()
+        return TileColorCache.mInstance
+
+    def deleteInstance():
+        del TileColorCache.mInstance
+        TileColorCache.mInstance = None
+
+    ##
+    # Returns the average color of \a tile, as an unpremultiplied ARGB value.
+    ##
+    def tileColor(self, tile):
+        return self.__tileColor(tile, {})
+
+    ##
+    # Returns the number of cells along each side of the square block of
+    # cells shown by one pixel of the image of \a layer. This is the smallest
+    # power of two keeping the image within MaximumImageSize pixels.
+    ##
+    def cellsPerPixel(layer):
+        size = max(layer.width(), layer.height())
+        cells = 1
+        while (size > cells * TileColorCache.MaximumImageSize):
+            cells *= 2
+        return cells
+
+    ##
+    # Returns an image of \a layer with one pixel per block of cells (see
+    # cellsPerPixel()), holding the average color of the tiles in that
+    # block. Flipping is ignored, since it does not change the average color.
+    ##
+    def layerImage(self, layer):
+        entry = self.mLayerImages.get(layer)
+        if (entry):
+            if (entry[0] == layer.modificationCount()):
+                self.mLayerCosts.move_to_end(weakref.ref(layer))
+                return entry[1]
+            self.__remove(layer)
+
+        image = self.__renderLayerImage(layer)
+        cost = image.width() * image.height() * 4
+        self.mLayerImages[layer] = (layer.modificationCount(), image)
+        self.mLayerCosts[weakref.ref(layer, self.__layerDeleted)] = cost
+        self.mTotalCost += cost
+        self.__trim()
+        return image
+
+    ##
+    # Drops the colors of the tiles of \a tileset and the images of the
+    # layers using it. Should be called when the images of its tiles changed.
+    ##
+    def invalidate(self, tileset):
+        for tile in list(self.mColors):
+            if (tile.tileset() is tileset):
+                del self.mColors[tile]
+        for layer in list(self.mLayerImages.keys()):
+            if (layer.referencesTileset(tileset)):
+                self.__remove(layer)
+
+    def clear(self):
+        self.mColors.clear()
+        self.mLayerImages.clear()
+        self.mLayerCosts.clear()
+        self.mTotalCost = 0
+
+    ##
+    # Sets the maximum total size of the cached layer images, in bytes. The
+    # most recently used image is kept even when it is larger.
+    ##
+    def setMaximumCost(self, cost):
+        self.mMaximumCost = cost
+        self.__trim()
+
+    def maximumCost(self):
+        return self.mMaximumCost
+
+    ##
+    # Returns the total size of the cached layer images, in bytes.
+    ##
+    def totalCost(self):
+        return self.mTotalCost
+
+    ##
+    # Returns the average color of \a tile. The \a images dictionary keeps
+    # the source images converted during one layer image update.
+    ##
+    def __tileColor(self, tile, images):
+        rect = tile.imageRect()
+        if (rect.isNull()):
+            pixmap = tile.image()
+            rect = pixmap.rect()
+        else:
+            pixmap = tile.tileset().image()
+        if (pixmap.isNull()):
+            return 0
+
+        entry = self.mColors.get(tile)
+        if (entry and entry[0] == pixmap.cacheKey()):
+            return entry[1]
+
+        image = images.get(pixmap.cacheKey())
+        if (image is None):
+            image = pixmap.toImage()
+            images[pixmap.cacheKey()] = image
+        # Smooth scaling averages all pixels of the tile
+        color = image.copy(rect).scaled(1, 1, Qt.IgnoreAspectRatio,
+                                        Qt.SmoothTransformation).pixel(0, 0)
+        self.mColors[tile] = (pixmap.cacheKey(), color)
+        return color
+
+    def __renderLayerImage(self, layer):
+        cells = TileColorCache.cellsPerPixel(layer)
+        width = (layer.width() + cells - 1) // cells
+        height = (layer.height() + cells - 1) // cells
+        if (width <= 0 or height <= 0):
+            return QImage()
+
+        grid = layer.grid()
+        images = {}
+        colors = {}
+        for value in grid.distinctValues():
+            tile = layer.tileForValue(value) if value else None
+            colors[value] = self.__tileColor(tile, images) if tile else 0
+        if numpy:
+            indexes = [value & TileIndexMask for value in colors]
+            table = numpy.zeros(max(indexes, default=0) + 1, dtype=numpy.uint32)
+            for value, color in colors.items():
+                table[value & TileIndexMask] = color
+
+        image = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+        painter = QPainter(image)
+        # Only the occupied areas of the layer are visited
+        for x, y, areaWidth, areaHeight, values in grid.occupiedAreas():
+            if numpy:
+                data = table[numpy.frombuffer(values, dtype=numpy.uint32) & TileIndexMask].tobytes()
+            else:
+                data = array('I', map(colors.__getitem__, values)).tobytes()
+            areaImage = QImage(data, areaWidth, areaHeight, areaWidth * 4,
+                               QImage.Format_ARGB32)
+            if (cells > 1):
+                # Smooth scaling averages the colors of each block of cells
+                areaImage = areaImage.scaled((areaWidth + cells - 1) // cells,
+                                             (areaHeight + cells - 1) // cells,
+                                             Qt.IgnoreAspectRatio,
+                                             Qt.SmoothTransformation)
+            painter.drawImage(x // cells, y // cells, areaImage)
+        painter.end()
+        return image
+
+    def __remove(self, layer):
+        del self.mLayerImages[layer]
+        self.mTotalCost -= self.mLayerCosts.pop(weakref.ref(layer))
+
+    def __layerDeleted(self, ref):
+        self.mTotalCost -= self.mLayerCosts.pop(ref, 0)
+
+    def __trim(self):
+        while (self.mTotalCost > self.mMaximumCost and len(self.mLayerCosts) > 1):
+            ref, cost = self.mLayerCosts.popitem(last=False)
+            layer = ref()
+            if (layer is not None):
+                del self.mLayerImages[layer]
+            self.mTotalCost -= cost
+
 ##
 # A utility class for rendering cells.
 ##
@@ -281,7 +643,8 @@ class CellRenderer():
 
     def __init__(self, painter):
         self.mPainter = painter
-        self.mTile = None
+        self.mSource = None
+        self.mPixmap = None
         self.mIsOpenGL = hasOpenGLEngine(painter)
 
         self.mFragments = QVector()
@@ -293,16 +656,17 @@ class CellRenderer():
     # Renders a \a cell with the given \a origin at \a pos, taking into account
     # the flipping and tile offset.
     #
-    # For performance reasons, the actual drawing is delayed until a different
-    # kind of tile has to be drawn. For this reason it is necessary to call
-    # flush when finished doing drawCell calls. This function is also called by
-    # the destructor so usually an explicit call is not needed.
+    # For performance reasons, the actual drawing is delayed until a tile from
+    # a different image has to be drawn. Tiles cut from a tileset image are
+    # drawn straight from that image, so consecutive tiles of the same tileset
+    # are drawn together. For this reason it is necessary to call flush when
+    # finished doing drawCell calls. This function is also called by the
+    # destructor so usually an explicit call is not needed.
     ##
     def render(self, cell, pos, cellSize, origin):
-        if (self.mTile != cell.tile):
-            self.flush()
-        image = cell.tile.currentFrameImage()
-        size = image.size()
+        tile = cell.tile.currentFrameTile()
+        imageRect = tile.imageRect()
+        size = tile.size()
         if cellSize == QSizeF(0,0):
             objectSize = size
         else:
@@ -313,8 +677,8 @@ class CellRenderer():
         fragment = QPainter.PixmapFragment()
         fragment.x = pos.x() + (offset.x() * scale.width()) + sizeHalf.x()
         fragment.y = pos.y() + (offset.y() * scale.height()) + sizeHalf.y() - objectSize.height()
-        fragment.sourceLeft = 0
-        fragment.sourceTop = 0
+        fragment.sourceLeft = imageRect.x()
+        fragment.sourceTop = imageRect.y()
         fragment.width = size.width()
         fragment.height = size.height()
         
@@ -355,27 +719,65 @@ class CellRenderer():
             x = 1
         fragment.scaleY = scale.height() * x
         if (self.mIsOpenGL or (fragment.scaleX > 0 and fragment.scaleY > 0)):
-            self.mTile = cell.tile
+            if (imageRect.isNull()):
+                self.__setSource(tile)
+            else:
+                self.__setSource(tile.tileset())
             self.mFragments.append(fragment)
             return
 
         # The Raster paint engine as of Qt 4.8.4 / 5.0.2 does not support
-        # drawing fragments with a negative scaling factor.
-        self.flush() # make sure we drew all tiles so far
-        oldTransform = self.mPainter.transform()
-        transform = oldTransform
-        transform.translate(fragment.x, fragment.y)
-        transform.rotate(fragment.rotation)
-        transform.scale(fragment.scaleX, fragment.scaleY)
-        target = QRectF(fragment.width * -0.5, fragment.height * -0.5, fragment.width, fragment.height)
-        source = QRectF(0, 0, fragment.width, fragment.height)
-        self.mPainter.setTransform(transform)
-        self.mPainter.drawPixmap(target, image, source)
-        self.mPainter.setTransform(oldTransform)
+        # drawing fragments with a negative scaling factor. Instead, a mirrored
+        # (and rotated) copy of the tile is drawn with a positive scale.
+        mirrorHorizontally = fragment.scaleX < 0
+        mirrorVertically = fragment.scaleY < 0
+        rotated = fragment.rotation != 0
+        cache = TileVariantCache.instance()
+        if (imageRect.isNull() or not cache.holdsImageVariants(tile.tileset())):
+            source = tile
+            imageRect = QRect(0, 0, size.width(), size.height())
+        else:
+            source = tile.tileset()
+        pixmap = cache.variant(source, mirrorHorizontally, mirrorVertically,
+                               rotated)
+        self.__setSource(pixmap)
+        scaleX = abs(fragment.scaleX)
+        scaleY = abs(fragment.scaleY)
+        if (rotated):
+            # The rotation swaps the axes the scale factors apply to
+            scaleX, scaleY = scaleY, scaleX
+            width, height = pixmap.height(), pixmap.width()
+        else:
+            width, height = pixmap.width(), pixmap.height()
+        sourceRect = variantRect(imageRect, width, height,
+                                 mirrorHorizontally, mirrorVertically, rotated)
+        fragment.sourceLeft = sourceRect.x()
+        fragment.sourceTop = sourceRect.y()
+        fragment.width = sourceRect.width()
+        fragment.height = sourceRect.height()
+        fragment.scaleX = scaleX
+        fragment.scaleY = scaleY
+        fragment.rotation = 0
+        self.mFragments.append(fragment)
 
-    def flush(self):
-        if (not self.mTile):
+    ##
+    # Makes the fragments drawn next come from the image of \a source, which
+    # is a tile, a tileset or a pixmap. Flushes the fragments collected so far
+    # when the source changes.
+    ##
+    def __setSource(self, source):
+        if (self.mSource is source):
             return
-        self.mPainter.drawPixmapFragments(self.mFragments, self.mTile.currentFrameImage())
-        self.mTile = None
-        self.mFragments.resize(0)
+        self.flush()
+        self.mSource = source
+        if (isinstance(source, QPixmap)):
+            self.mPixmap = source
+        else:
+            self.mPixmap = source.image()
+
+    def flush(self):
+        if (not self.mFragments.isEmpty()):
+            self.mPainter.drawPixmapFragments(self.mFragments, self.mPixmap)
+            self.mFragments.resize(0)
+        self.mSource = None
+        self.mPixmap = None
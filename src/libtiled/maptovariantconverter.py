@@ -31,9 +31,11 @@ from map import (
     orientationToString, 
     renderOrderToString, 
     staggerAxisToString, 
-    staggerIndexToString
+    staggerIndexToString,
+    isBase64LayerDataFormat,
+    layerDataCompressionToString
 )
-from gidmapper import GidMapper
+from gidmapper import GidMapper, encodeLayersData
 from pyqtcore import QString
 from PyQt5.QtCore import (
     QDir
@@ -48,6 +50,8 @@ class MapToVariantConverter():
         pass
         self.mMapDir = QDir()
         self.mGidMapper = GidMapper()
+        self.mEncodedLayerData = {}
+        self.mCompressionLevel = -1
         
     def toVariant(self, arg1, arg2):
         tp1 = type(arg1)
@@ -59,6 +63,7 @@ class MapToVariantConverter():
             ##
             map, mapDir = arg1, arg2
             self.mMapDir = mapDir
+            self.mCompressionLevel = map.compressionLevel()
             self.mGidMapper.clear()
             mapVariant = {}
             mapVariant["version"] = 1.0
@@ -70,6 +75,8 @@ class MapToVariantConverter():
             mapVariant["tileheight"] = map.tileHeight()
             mapVariant["properties"] = self.__toVariant(map.properties())
             mapVariant["nextobjectid"] = map.nextObjectId()
+            if (map.compressionLevel() != -1):
+                mapVariant["compressionlevel"] = map.compressionLevel()
             if (map.orientation() == Map.Orientation.Hexagonal) :
                 mapVariant["hexsidelength"] = map.hexSideLength()
             
@@ -88,6 +95,14 @@ class MapToVariantConverter():
                 firstGid += tileset.tileCount()
             
             mapVariant["tilesets"] = tilesetVariants
+            # Encode all tile layers up front, so that they are encoded in parallel
+            if (isBase64LayerDataFormat(map.layerDataFormat())):
+                tileLayers = map.tileLayers()
+                layerData = encodeLayersData(self.mGidMapper, tileLayers,
+                                             map.layerDataFormat(),
+                                             self.mCompressionLevel)
+                self.mEncodedLayerData = dict(zip(tileLayers, layerData))
+
             layerVariants = []
             for layer in map.layers():
                 x = layer.layerType()
@@ -98,6 +113,7 @@ class MapToVariantConverter():
                 elif x==Layer.ImageLayerType:
                     layerVariants.append(self.__toVariant(layer))
             
+            self.mEncodedLayerData = {}
             mapVariant["layers"] = layerVariants
             return mapVariant
         elif tp1==Tileset and tp2==QDir:
@@ -294,20 +310,18 @@ class MapToVariantConverter():
                 self.addLayerAttributes(tileLayerVariant, tileLayer)
                 
                 if format == Map.LayerDataFormat.XML or format == Map.LayerDataFormat.CSV:
-                    tileVariants = []
-                    for y in range(tileLayer.height()):
-                        for x in range(tileLayer.width()):
-                            tileVariants.append(self.mGidMapper.cellToGid(tileLayer.cellAt(x, y)))
-                    tileLayerVariant["data"] = tileVariants
-                elif format in [Map.LayerDataFormat.Base64, Map.LayerDataFormat.Base64Zlib, Map.LayerDataFormat.Base64Gzip]:
+                    tileLayerVariant["data"] = self.mGidMapper.cellsToGids(tileLayer).tolist()
+                elif isBase64LayerDataFormat(format):
                     tileLayerVariant["encoding"] = "base64"
 
-                    if format == Map.LayerDataFormat.Base64Zlib:
-                        tileLayerVariant["compression"] = "zlib"
-                    elif format == Map.LayerDataFormat.Base64Gzip:
-                        tileLayerVariant["compression"] = "gzip"
+                    compression = layerDataCompressionToString(format)
+                    if compression != '':
+                        tileLayerVariant["compression"] = compression
 
-                    layerData = self.mGidMapper.encodeLayerData(tileLayer, format)
+                    layerData = self.mEncodedLayerData.get(tileLayer)
+                    if (layerData is None):
+                        layerData = self.mGidMapper.encodeLayerData(tileLayer, format,
+                                                                    self.mCompressionLevel)
                     tileLayerVariant["data"] = layerData.data().decode()
                     
                 return tileLayerVariant
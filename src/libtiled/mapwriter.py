@@ -28,7 +28,8 @@
 ##
 
 from layer import Layer
-from gidmapper import GidMapper
+import time
+from gidmapper import GidMapper, LayerDataCache, encodeLayersData
 from mapobject import MapObject
 from objectgroup import ObjectGroup, drawOrderToString
 from map import (
@@ -36,10 +37,13 @@ from map import (
     orientationToString,
     renderOrderToString,
     staggerAxisToString,
-    staggerIndexToString
+    staggerIndexToString,
+    isBase64LayerDataFormat,
+    layerDataCompressionToString
 )
-from pyqtcore import QString
+from pyqtcore import QString, qgetenv
 from PyQt5.QtCore import (
+    qDebug,
     QSaveFile,
     QIODevice,
     QXmlStreamWriter,
@@ -50,12 +54,62 @@ from PyQt5.QtCore import (
     QCoreApplication
 )
 
+# When set, the time taken by each map save and the number of tile layers
+# whose encoded data was reused are printed.
+SaveStatistics = bool(qgetenv("TILED_SAVE_STATISTICS"))
+
+# The encoded layer data shared by map writers by default
+sharedLayerDataCache = LayerDataCache()
+
+# The number of spaces per level of indentation
+AutoFormattingIndent = 1
+
+# The number of elements written as text at once
+TextChunkSize = 4096
+
+AttributeEscapes = str.maketrans({
+    '&': "&amp;",
+    '<': "&lt;",
+    '>': "&gt;",
+    '"': "&quot;"
+})
+
 def createWriter(device):
     writer = QXmlStreamWriter(device)
     writer.setAutoFormatting(True)
-    writer.setAutoFormattingIndent(1)
+    writer.setAutoFormattingIndent(AutoFormattingIndent)
     return writer
 
+##
+# Returns the line break and indentation the writer puts in front of an
+# element at the given \a depth.
+##
+def indentation(depth):
+    return "\n" + " " * (depth * AutoFormattingIndent)
+
+##
+# Escapes \a value the way QXmlStreamWriter escapes attribute values. Returns
+# None for values containing control characters, which are left to the writer.
+##
+def escapeAttribute(value):
+    if any(c < ' ' or c == '\x7f' for c in value):
+        return None
+    return value.translate(AttributeEscapes)
+
+##
+# Writes the preformatted XML \a text directly to the device of \a w, which
+# saves a call into the writer for each element it contains.
+#
+# The text should start with the indentation of its first element. When the
+# writer is used again afterwards, the text should also end with the
+# indentation the writer would have written for what follows, since the writer
+# does not indent after character data.
+##
+def writeText(w, text):
+    # Closes the current start tag, if any
+    w.writeCharacters('')
+    w.device().write(text.encode())
+
 def makeTerrainAttribute(tile):
     terrain = QString()
     for i in range(4):
@@ -168,6 +222,17 @@ class MapWriter():
     def isDtdEnabled(self):
         return self.d.mDtdEnabled
 
+    ##
+    # Sets the cache holding the encoded tile layer data of earlier saves.
+    # By default the cache is shared by all map writers. Passing None disables
+    # caching.
+    ##
+    def setLayerDataCache(self, cache):
+        self.d.mLayerDataCache = cache
+
+    def layerDataCache(self):
+        return self.d.mLayerDataCache
+
 class MapWriterPrivate():
 
     def tr(self, sourceText, disambiguation = '', n = -1):
@@ -178,17 +243,26 @@ class MapWriterPrivate():
 
     def __init__(self):
         self.mLayerDataFormat = Map.LayerDataFormat.Base64Zlib
+        self.mCompressionLevel = -1
         self.mDtdEnabled = False
         self.mUseAbsolutePaths = False
 
         self.mMapDir = QDir()
         self.mGidMapper = GidMapper()
+        self.mLayerDataCache = sharedLayerDataCache
+        self.mEncodedLayerData = {}
         self.mError = ''
 
     def writeMap(self, map, device, path):
+        if (SaveStatistics):
+            start = time.perf_counter()
+            cache = self.mLayerDataCache or LayerDataCache()
+            hits, misses, encodeTime = cache.hits(), cache.misses(), cache.encodeTime()
+
         self.mMapDir = QDir(path)
         self.mUseAbsolutePaths = path==''
         self.mLayerDataFormat = map.layerDataFormat()
+        self.mCompressionLevel = map.compressionLevel()
         writer = createWriter(device)
         writer.writeStartDocument()
         if (self.mDtdEnabled):
@@ -198,6 +272,13 @@ class MapWriterPrivate():
         writer.writeEndDocument()
         del writer
 
+        if (SaveStatistics):
+            qDebug("Wrote map in %.1f ms: %d tile layers encoded in %.1f ms, %d reused"%(
+                   (time.perf_counter() - start) * 1000,
+                   cache.misses() - misses,
+                   (cache.encodeTime() - encodeTime) * 1000,
+                   cache.hits() - hits))
+
     def writeTileset(self, tileset, device, path):
         self.mMapDir = QDir(path)
         self.mUseAbsolutePaths = path==''
@@ -238,6 +319,9 @@ class MapWriterPrivate():
         if (map.backgroundColor().isValid()):
             w.writeAttribute("backgroundcolor", map.backgroundColor().name())
 
+        if (map.compressionLevel() != -1):
+            w.writeAttribute("compressionlevel", str(map.compressionLevel()))
+
         w.writeAttribute("nextobjectid", str(map.nextObjectId()))
         self.__writeProperties(w, map.properties())
         self.mGidMapper.clear()
@@ -247,6 +331,19 @@ class MapWriterPrivate():
             self.mGidMapper.insert(firstGid, tileset)
             firstGid += tileset.tileCount()
 
+        # Encode all tile layers up front, so that they are encoded in parallel
+        if (isBase64LayerDataFormat(self.mLayerDataFormat)):
+            tileLayers = map.tileLayers()
+            if (self.mLayerDataCache):
+                layerData = self.mLayerDataCache.encodeLayersData(self.mGidMapper, tileLayers,
+                                                                  self.mLayerDataFormat,
+                                                                  self.mCompressionLevel)
+            else:
+                layerData = encodeLayersData(self.mGidMapper, tileLayers,
+                                             self.mLayerDataFormat,
+                                             self.mCompressionLevel)
+            self.mEncodedLayerData = dict(zip(tileLayers, layerData))
+
         for layer in map.layers():
             type = layer.layerType()
             if (type == Layer.TileLayerType):
@@ -256,6 +353,7 @@ class MapWriterPrivate():
             elif (type == Layer.ImageLayerType):
                 self.__writeImageLayer(w, layer)
 
+        self.mEncodedLayerData = {}
         w.writeEndElement()
 
     def __writeTileset(self, w, tileset, firstGid):
@@ -392,14 +490,9 @@ class MapWriterPrivate():
         self.__writeProperties(w, tileLayer.properties())
         encoding = QString()
         compression = QString()
-        if (self.mLayerDataFormat == Map.LayerDataFormat.Base64
-                or self.mLayerDataFormat == Map.LayerDataFormat.Base64Gzip
-                or self.mLayerDataFormat == Map.LayerDataFormat.Base64Zlib):
+        if (isBase64LayerDataFormat(self.mLayerDataFormat)):
             encoding = "base64"
-            if (self.mLayerDataFormat == Map.LayerDataFormat.Base64Gzip):
-                compression = "gzip"
-            elif (self.mLayerDataFormat == Map.LayerDataFormat.Base64Zlib):
-                compression = "zlib"
+            compression = layerDataCompressionToString(self.mLayerDataFormat)
         elif (self.mLayerDataFormat == Map.LayerDataFormat.CSV):
             encoding = "csv"
         w.writeStartElement("data")
@@ -408,27 +501,33 @@ class MapWriterPrivate():
         if compression != '':
             w.writeAttribute("compression", compression)
         if (self.mLayerDataFormat == Map.LayerDataFormat.XML):
-            for y in range(tileLayer.height()):
-                for x in range(tileLayer.width()):
-                    gid = self.mGidMapper.cellToGid(tileLayer.cellAt(x, y))
-                    w.writeStartElement("tile")
-                    w.writeAttribute("gid", str(gid))
-                    w.writeEndElement()
+            gids = self.mGidMapper.cellsToGids(tileLayer).tolist()
+            if gids:
+                # The <tile> elements are written as text, in chunks of rows
+                tileStart = indentation(3) + "<tile gid=\""
+                separator = "\"/>" + tileStart
+                width = max(tileLayer.width(), 1)
+                rowsPerChunk = max(1, TextChunkSize // width)
+                for y in range(0, tileLayer.height(), rowsPerChunk):
+                    chunk = gids[y * width:(y + rowsPerChunk) * width]
+                    text = tileStart + separator.join(map(str, chunk)) + "\"/>"
+                    if (y + rowsPerChunk >= tileLayer.height()):
+                        text += indentation(2)
+                    writeText(w, text)
         elif (self.mLayerDataFormat == Map.LayerDataFormat.CSV):
-            tileData = ''
-            for y in range(tileLayer.height()):
-                for x in range(tileLayer.width()):
-                    gid = self.mGidMapper.cellToGid(tileLayer.cellAt(x, y))
-                    tileData += str(gid)
-                    if (x != tileLayer.width() - 1 or y != tileLayer.height() - 1):
-                        tileData += ","
-
+            gids = self.mGidMapper.cellsToGids(tileLayer).tolist()
+            width = tileLayer.width()
+            rows = [",".join(map(str, gids[y * width:(y + 1) * width]))
+                    for y in range(tileLayer.height())]
+            # Every row but the last one ends with a comma
+            tileData = ",\n".join(rows)
+            if (rows):
                 tileData += "\n"
 
             w.writeCharacters("\n")
             w.writeCharacters(tileData)
         else:
-            tileData = self.mGidMapper.encodeLayerData(tileLayer, self.mLayerDataFormat)
+            tileData = self.mEncodedLayerData[tileLayer]
             
             w.writeCharacters("\n   ")
             w.writeCharacters(tileData.data().decode())
@@ -472,10 +571,81 @@ class MapWriterPrivate():
 
         self.__writeLayerAttributes(w, objectGroup)
         self.__writeProperties(w, objectGroup.properties())
+        # Objects are written as text where possible, in chunks
+        chunk = []
         for mapObject in objectGroup.objects():
+            text = self.__objectText(mapObject)
+            if (text is not None):
+                chunk.append(text)
+                if (len(chunk) >= TextChunkSize):
+                    writeText(w, ''.join(chunk))
+                    chunk = []
+                continue
+
+            if chunk:
+                chunk.append(indentation(2))
+                writeText(w, ''.join(chunk))
+                chunk = []
             self.__writeObject(w, mapObject)
+
+        if chunk:
+            chunk.append(indentation(1))
+            writeText(w, ''.join(chunk))
         w.writeEndElement()
 
+    ##
+    # Returns the XML for the given \a mapObject as __writeObject() would
+    # write it, or None when the object has to be written by __writeObject().
+    ##
+    def __objectText(self, mapObject):
+        if (not mapObject.properties().isEmpty() or not mapObject.isVisible()):
+            return None
+        name = escapeAttribute(mapObject.name())
+        type = escapeAttribute(mapObject.type())
+        if (name is None or type is None):
+            return None
+
+        text = [indentation(2), "<object id=\"", str(mapObject.id()), "\""]
+        if name != '':
+            text.append(" name=\"%s\""%name)
+        if type != '':
+            text.append(" type=\"%s\""%type)
+        if (not mapObject.cell().isEmpty()):
+            gid = self.mGidMapper.cellToGid(mapObject.cell())
+            text.append(" gid=\"%s\""%gid)
+
+        pos = mapObject.position()
+        size = mapObject.size()
+        text.append(" x=\"%s\" y=\"%s\""%(pos.x(), pos.y()))
+        if (size.width() != 0):
+            text.append(" width=\"%s\""%size.width())
+        if (size.height() != 0):
+            text.append(" height=\"%s\""%size.height())
+        rotation = mapObject.rotation()
+        if (rotation != 0.0):
+            text.append(" rotation=\"%s\""%rotation)
+
+        children = []
+        polygon = mapObject.polygon()
+        if (not polygon.isEmpty()):
+            if (mapObject.shape() == MapObject.Polygon):
+                element = "polygon"
+            else:
+                element = "polyline"
+            points = ' '.join([str(point.x()) + ',' + str(point.y()) for point in polygon])
+            children.append("%s<%s points=\"%s\"/>"%(indentation(3), element, points))
+
+        if (mapObject.shape() == MapObject.Ellipse):
+            children.append(indentation(3) + "<ellipse/>")
+
+        if children:
+            text.append(">")
+            text.extend(children)
+            text.append(indentation(2) + "</object>")
+        else:
+            text.append("/>")
+        return ''.join(text)
+
     def __writeObject(self, w, mapObject):
         w.writeStartElement("object")
         w.writeAttribute("id", str(mapObject.id()))
@@ -502,7 +672,7 @@ class MapWriterPrivate():
         if (rotation != 0.0):
             w.writeAttribute("rotation", str(rotation))
         if (not mapObject.isVisible()):
-            w.writeAttribute("visible"), "0"
+            w.writeAttribute("visible", "0")
         self.__writeProperties(w, mapObject.properties())
         polygon = mapObject.polygon()
         if (not polygon.isEmpty()):
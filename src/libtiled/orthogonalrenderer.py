@@ -29,7 +29,7 @@
 import math
 from mapobject import MapObject
 from map import Map
-from maprenderer import MapRenderer, CellRenderer, RenderFlag
+from maprenderer import MapRenderer, CellRenderer, RenderFlag, TileColorCache
 from pyqtcore import QVector
 from PyQt5.QtGui  import(
     QPen,
@@ -76,7 +76,7 @@ class OrthogonalRenderer(MapRenderer):
             if (not object.cell().isEmpty()):
                 bottomLeft = bounds.topLeft()
                 tile = object.cell().tile
-                imgSize = tile.image().size()
+                imgSize = tile.size()
                 tileOffset = tile.offset()
                 objectSize = object.size()
                 scale = QSizeF(objectSize.width() / imgSize.width(), objectSize.height() / imgSize.height())
@@ -198,44 +198,43 @@ class OrthogonalRenderer(MapRenderer):
 
         # Return immediately when there is nothing to draw
         if (startX > endX or startY > endY):
+            painter.setTransform(savedTransform)
+            return
+
+        # When zoomed far out, draw one average color per tile instead
+        if (self.useLevelOfDetail(painter)):
+            image = TileColorCache.instance().layerImage(layer)
+            cells = TileColorCache.cellsPerPixel(layer)
+            smooth = painter.testRenderHint(QPainter.SmoothPixmapTransform)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform, False)
+            width = endX - startX + 1
+            height = endY - startY + 1
+            painter.drawImage(QRectF(startX * tileWidth, startY * tileHeight,
+                                     width * tileWidth, height * tileHeight),
+                              image,
+                              QRectF(startX / cells, startY / cells,
+                                     width / cells, height / cells))
+            painter.setRenderHint(QPainter.SmoothPixmapTransform, smooth)
+            painter.setTransform(savedTransform)
             return
+
         renderer = CellRenderer(painter)
         renderOrder = self.map().renderOrder()
-        incX = 1
-        incY = 1
-        x = renderOrder
-        if x==Map.RenderOrder.RightUp:
-            startY, endY = endY, startY
-            incY = -1
-        elif x==Map.RenderOrder.LeftDown:
-            startX, endX = endX, startX
-            incX = -1
-        elif x==Map.RenderOrder.LeftUp:
-            startX, endX = endX, startX
-            startY, endY = endY, startY
-            incX = -1
-            incY = -1
-        elif x==Map.RenderOrder.RightDown:
-            pass
-        else:
-            pass
+        rows = range(startY, endY + 1)
+        if (renderOrder in (Map.RenderOrder.RightUp, Map.RenderOrder.LeftUp)):
+            rows = reversed(rows)
+        leftToRight = renderOrder not in (Map.RenderOrder.LeftDown, Map.RenderOrder.LeftUp)
 
-        endX += incX
-        endY += incY
-        y = startY
-        while(y != endY):
-            x = startX
-            while(x != endX):
-                cell = layer.cellAt(x, y)
-                if cell.isEmpty():
-                    x += incX
-                    continue
+        # Only visit the non-empty cells of each row
+        for y in rows:
+            cells = layer.cellsInRow(y, startX, endX)
+            if (not leftToRight):
+                cells.reverse()
+            for x, cell in cells:
                 renderer.render(cell,
                                 QPointF(x * tileWidth, (y + 1) * tileHeight),
                                 QSizeF(0, 0),
                                 CellRenderer.BottomLeft)
-                x += incX
-            y += incY
 
         renderer.flush()
         painter.setTransform(savedTransform)
@@ -29,6 +29,7 @@
 
 from object import Object
 from pyqtcore import QVector, QString
+from PyQt5.QtCore import QRect
 from PyQt5.QtGui import QPixmap
 
 ##
@@ -62,6 +63,7 @@ class Tile(Object):
         self.mId = id
         self.mTileset = tileset
         self.mImage = image
+        self.mImageRect = QRect()
         self.mTerrain = 0xffffffff
         self.mProbability = 1.0
         self.mObjectGroup = None
@@ -92,8 +94,13 @@ class Tile(Object):
 
     ##
     # Returns the image of this tile.
+    #
+    # For tiles that are part of a tileset image, the image is copied out of
+    # the tileset image the first time it is requested.
     ##
     def image(self):
+        if (self.mImage is None):
+            self.mImage = self.mTileset.image().copy(self.mImageRect)
         return QPixmap(self.mImage)
 
     ##
@@ -101,11 +108,18 @@ class Tile(Object):
     # animations.
     ##
     def currentFrameImage(self):
+        return self.currentFrameTile().image()
+
+    ##
+    # Returns the tile whose image is used for rendering this tile, taking
+    # into account tile animations.
+    ##
+    def currentFrameTile(self):
         if (self.isAnimated()):
             frame = self.mFrames.at(self.mCurrentFrameIndex)
-            return self.mTileset.tileAt(frame.tileId).image()
+            return self.mTileset.tileAt(frame.tileId)
         else:
-            return QPixmap(self.mImage)
+            return self
 
     ##
     # Returns the drawing offset of the tile (in pixels).
@@ -118,6 +132,22 @@ class Tile(Object):
     ##
     def setImage(self, image):
         self.mImage = image
+        self.mImageRect = QRect()
+
+    ##
+    # Returns the area of the tileset image covered by this tile. Returns a
+    # null rectangle when this tile has an image of its own.
+    ##
+    def imageRect(self):
+        return QRect(self.mImageRect)
+
+    ##
+    # Makes this tile refer to the area \a rect of the tileset image. The image
+    # of the tile is only created once it is needed.
+    ##
+    def setImageRect(self, rect):
+        self.mImage = None
+        self.mImageRect = rect
 
     ##
     # Returns the file name of the external image that represents this tile.
@@ -139,18 +169,24 @@ class Tile(Object):
     # Returns the width of this tile.
     ##
     def width(self):
+        if (self.mImage is None):
+            return self.mImageRect.width()
         return self.mImage.width()
 
     ##
     # Returns the height of this tile.
     ##
     def height(self):
+        if (self.mImage is None):
+            return self.mImageRect.height()
         return self.mImage.height()
 
     ##
     # Returns the size of this tile.
     ##
     def size(self):
+        if (self.mImage is None):
+            return self.mImageRect.size()
         return self.mImage.size()
 
     ##
@@ -27,17 +27,47 @@
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 ##
 
+from array import array
+from collections import Counter
+from operator import ne
 from libtiled.tiled import FlipDirection, RotateDirection
 from layer import Layer
-from pyqtcore import QSet, QString, QVector
+from chunkedcellgrid import ChunkedCellGrid
+from cellgrid import (
+    CellGrid,
+    FlippedHorizontallyFlag,
+    FlippedVerticallyFlag,
+    FlippedAntiDiagonallyFlag,
+    FlagsMask,
+    TileIndexMask,
+    mirroredArea,
+    rotatedArea
+)
+from pyqtcore import QSet, QString, qgetenv
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from PyQt5.QtGui import (
     QRegion
 )
 from PyQt5.QtCore import (
     QSize,
     QRect,
+    QPoint,
     QMargins
 )
+
+# When set, the tileset counts of a tile layer and its map are verified
+# against a full scan of the cells after each change. Only meant for
+# debugging, since it makes every change O(cells).
+VerifyTilesetCounts = bool(qgetenv("TILED_VERIFY_TILESET_COUNTS"))
+
+# Tile layers with more than this many cells store them in a ChunkedCellGrid,
+# so that large and mostly empty layers only pay for their content. Layers up
+# to 2048x2048 keep the packed row backend.
+ChunkedGridThreshold = 1 << 22
+
 def maxSize(a, b):
     return QSize(max(a.width(), b.width()),
                  max(a.height(), b.height()))
@@ -48,6 +78,151 @@ def maxMargins(a, b):
                     max(a.right(), b.right()),
                     max(a.bottom(), b.bottom()))
 
+##
+# Returns the margins needed to draw the tiles of \a tileset at their offset.
+##
+def tileOffsetMargins(tileset):
+    offset = tileset.tileOffset()
+    return QMargins(-offset.x(),
+                    -offset.y(),
+                    offset.x(),
+                    offset.y())
+
+##
+# Splits the cells from \a start up to \a end into spans that move by the
+# same amount when offsetting them by \a offset, wrapping around within the
+# \a size cells starting at \a boundsStart when \a wrap is True. Returns a
+# list of (start, end, shift) tuples, clipped so that the moved cells stay
+# within \a start and \a end.
+##
+def offsetSpans(boundsStart, size, start, end, offset, wrap):
+    if (start >= end):
+        return []
+    if (wrap and size > 0):
+        shift = offset % size
+        split = boundsStart + size - shift
+        candidates = [(start, split, shift), (split, end, shift - size)]
+    else:
+        candidates = [(start, end, offset)]
+    spans = []
+    for spanStart, spanEnd, shift in candidates:
+        spanStart = max(spanStart, start, start - shift)
+        spanEnd = min(spanEnd, end, end - shift)
+        if (spanStart < spanEnd):
+            spans.append((spanStart, spanEnd, shift))
+    return spans
+
+##
+# Returns a mask with a 1 byte for each of the packed \a values that is in
+# the set of \a matching values and a 0 byte for the others. When
+# \a matching is None, all non-empty values match.
+##
+def valueMask(values, matching):
+    if numpy:
+        values = numpy.frombuffer(values, dtype=numpy.uint32)
+        if matching is None:
+            return (values != 0).view(numpy.uint8).tobytes()
+        matching = numpy.fromiter(matching, dtype=numpy.uint32, count=len(matching))
+        return numpy.isin(values, matching).view(numpy.uint8).tobytes()
+    if matching is None:
+        return bytes(map(bool, values))
+    return bytes(map(matching.__contains__, values))
+
+##
+# Returns the runs of 1 bytes in the \a width x \a height \a mask, stored
+# row by row. The result is a list of (y, runs) pairs for the rows that have
+# any, where runs is a flat [start, end, start, end, ...] list.
+##
+def maskRuns(mask, width, height):
+    rows = []
+    if numpy:
+        padded = numpy.zeros((height, width + 2), dtype=numpy.int8)
+        padded[:, 1:-1] = numpy.frombuffer(mask, dtype=numpy.uint8).reshape(height, width)
+        edges = numpy.diff(padded, axis=1)
+        ys, starts = numpy.nonzero(edges == 1)
+        ends = numpy.nonzero(edges == -1)[1]
+        bounds = numpy.stack((starts, ends), axis=1).ravel().tolist()
+        rowStarts = numpy.flatnonzero(numpy.diff(ys, prepend=-1)).tolist()
+        rowStarts.append(len(ys))
+        ys = ys.tolist()
+        for i in range(len(rowStarts) - 1):
+            rows.append((ys[rowStarts[i]], bounds[2 * rowStarts[i]:2 * rowStarts[i + 1]]))
+        return rows
+    for y in range(height):
+        row = mask[y * width:(y + 1) * width]
+        start = row.find(1)
+        if start < 0:
+            continue
+        runs = []
+        while start >= 0:
+            end = row.find(0, start)
+            if end < 0:
+                end = width
+            runs.append(start)
+            runs.append(end)
+            start = row.find(1, end)
+        rows.append((y, runs))
+    return rows
+
+##
+# Returns a mask with a 1 byte for each position where the packed values
+# \a a and \a b differ and a 0 byte for the others.
+##
+def differenceMask(a, b):
+    if numpy:
+        a = numpy.frombuffer(a, dtype=numpy.uint32)
+        b = numpy.frombuffer(b, dtype=numpy.uint32)
+        return (a != b).view(numpy.uint8).tobytes()
+    return bytes(map(ne, a, b))
+
+##
+# Adds the runs of the \a width x \a height \a mask, found at (\a x, \a y),
+# to the \a rows dictionary mapping y to a flat list of runs. Areas have to
+# be added in row order and from left to right, runs touching the runs of a
+# previous area are joined.
+##
+def addMaskRuns(rows, mask, x, y, width, height):
+    for row, runs in maskRuns(mask, width, height):
+        runs = [column + x for column in runs]
+        rowRuns = rows.get(y + row)
+        if (rowRuns is None):
+            rows[y + row] = runs
+        elif (rowRuns[-1] == runs[0]):
+            rowRuns[-1] = runs[1]
+            rowRuns.extend(runs[2:])
+        else:
+            rowRuns.extend(runs)
+
+##
+# Builds a region from the runs of each row, given as (y, runs) pairs as
+# returned by maskRuns() and ordered by y, moved by \a dx and \a dy.
+# Consecutive rows with the same runs are merged into bands, so the
+# rectangles match what uniting the runs one by one would give, but they
+# are handed to the region all at once.
+##
+def regionFromRuns(rows, dx, dy):
+    rects = []
+    bandTop = 0
+    bandHeight = 0
+    bandRuns = None
+    for y, runs in rows + [(None, None)]:
+        if (runs == bandRuns and y == bandTop + bandHeight):
+            bandHeight += 1
+            continue
+        if bandRuns:
+            top = bandTop + dy
+            for i in range(0, len(bandRuns), 2):
+                rects.append(QRect(bandRuns[i] + dx, top,
+                                   bandRuns[i + 1] - bandRuns[i], bandHeight))
+        bandTop = y
+        bandHeight = 1
+        bandRuns = runs
+
+    region = QRegion()
+    if rects:
+        region.setRects(rects)
+    return region
+
 ##
 # A cell on a tile layer grid.
 ##
@@ -84,6 +259,14 @@ class Cell():
 #
 # Coordinates and regions passed to function parameters are in local
 # coordinates and do not take into account the position of the layer.
+#
+# The cells are stored packed in a CellGrid. Each packed value combines the
+# flip flags with an index into the tile table of this layer, see packCell()
+# and unpackCell().
+#
+# The layer also counts how many cells refer to each tileset, and how many of
+# those are flipped anti-diagonally. The draw margins are derived from these
+# counts instead of from the individual cells.
 ##
 class TileLayer(Layer):
     ##
@@ -92,14 +275,94 @@ class TileLayer(Layer):
     def __init__(self, name, x, y, width, height):
         super().__init__(Layer.TileLayerType, name, x, y, width, height)
         self.mMaxTileSize = QSize(0, 0)
-        self.mGrid = QVector()
-        for i in range(width * height):
-            self.mGrid.append(Cell())
+        self.mGrid = self.__createGrid(width, height)
+        self.mTiles = [None]
+        self.mTileIndexes = {}
+        self.mTilesetCounts = Counter()
+        self.mTransposedCounts = Counter()
         self.mOffsetMargins = QMargins()
+        self.mOccupancy = None
+        self.mModificationCount = 0
 
     def __iter__(self):
-        return self.mGrid.__iter__()
-        
+        for value in self.mGrid.values():
+            yield self.unpackCell(value)
+
+    ##
+    # Moves the tileset references of this layer over to the new \a map.
+    ##
+    def setMap(self, map):
+        if (self.mMap):
+            self.mMap.removeTilesetReferences(self.mTilesetCounts)
+        super().setMap(map)
+        if (map):
+            map.addTilesetReferences(self.mTilesetCounts)
+
+    ##
+    # Returns the packed value representing the given \a cell, adding its
+    # tile to the tile table of this layer when needed.
+    ##
+    def packCell(self, cell):
+        tile = cell.tile
+        if not tile:
+            return 0
+        value = self.mTileIndexes.get(tile)
+        if value is None:
+            value = len(self.mTiles)
+            self.mTiles.append(tile)
+            self.mTileIndexes[tile] = value
+        if (cell.flippedHorizontally):
+            value |= FlippedHorizontallyFlag
+        if (cell.flippedVertically):
+            value |= FlippedVerticallyFlag
+        if (cell.flippedAntiDiagonally):
+            value |= FlippedAntiDiagonallyFlag
+        return value
+
+    ##
+    # Returns a new cell for the given packed \a value.
+    ##
+    def unpackCell(self, value):
+        cell = Cell(self.mTiles[value & TileIndexMask])
+        if (value & FlagsMask):
+            cell.flippedHorizontally = bool(value & FlippedHorizontallyFlag)
+            cell.flippedVertically = bool(value & FlippedVerticallyFlag)
+            cell.flippedAntiDiagonally = bool(value & FlippedAntiDiagonallyFlag)
+        return cell
+
+    ##
+    # Returns the grid of packed cell values of this layer.
+    ##
+    def grid(self):
+        return self.mGrid
+
+    ##
+    # Replaces all cells of this layer by the given packed \a values, given
+    # row by row. The values have to refer to the tile table of this layer,
+    # see packCell().
+    ##
+    def setPackedCells(self, values):
+        self.mGrid.setValues(values)
+        self.mOccupancy = None
+        self.mModificationCount += 1
+        self.__recountTilesets()
+        self.recomputeDrawMargins()
+        if VerifyTilesetCounts:
+            self.verifyTilesetCounts()
+
+    ##
+    # Returns a number that changes whenever cells of this layer change, which
+    # allows data derived from the cells to be cached.
+    ##
+    def modificationCount(self):
+        return self.mModificationCount
+
+    ##
+    # Returns the tile referred to by the tile index of the packed \a value.
+    ##
+    def tileForValue(self, value):
+        return self.mTiles[value & TileIndexMask]
+
     ##
     # Returns the maximum tile size of this layer.
     ##
@@ -126,22 +389,15 @@ class TileLayer(Layer):
     def recomputeDrawMargins(self):
         maxTileSize = QSize(0, 0)
         offsetMargins = QMargins()
-        i = 0
-        while(i<self.mGrid.size()):
-            cell = self.mGrid.at(i)
-            tile = cell.tile
-            if tile:
-                size = tile.size()
-                if (cell.flippedAntiDiagonally):
-                    size.transpose()
-                offset = tile.offset()
+        for tileset, count in self.mTilesetCounts.items():
+            size = tileset.tileSize()
+            transposedCount = self.mTransposedCounts[tileset]
+            if (transposedCount < count):
                 maxTileSize = maxSize(size, maxTileSize)
-                offsetMargins = maxMargins(QMargins(-offset.x(),
-                                                     -offset.y(),
-                                                     offset.x(),
-                                                     offset.y()),
-                                            offsetMargins)
-            i += 1
+            if (transposedCount > 0):
+                maxTileSize = maxSize(size.transposed(), maxTileSize)
+            offsetMargins = maxMargins(tileOffsetMargins(tileset),
+                                       offsetMargins)
 
         self.mMaxTileSize = maxTileSize
         self.mOffsetMargins = offsetMargins
@@ -168,60 +424,84 @@ class TileLayer(Layer):
         l = len(args)
         if l==1:
             condition = args[0]
-            region = QRegion()
-            for y in range(self.mHeight):
-                for x in range(self.mWidth):
-                    if (condition(self.cellAt(x, y))):
-                        rangeStart = x
-                        x += 1
-                        while(x<=self.mWidth):
-                            if (x == self.mWidth or not condition(self.cellAt(x, y))):
-                                rangeEnd = x
-                                region += QRect(rangeStart + self.mX, y + self.mY,
-                                                rangeEnd - rangeStart, 1)
-                                break
-                            x += 1
-
-            return region
+            # The condition only depends on the cell, so it is enough to
+            # evaluate it once for each distinct value
+            distinct = self.mGrid.distinctValues()
+            matching = set()
+            for value in distinct:
+                if (condition(self.unpackCell(value))):
+                    matching.add(value)
+            if (not matching):
+                return QRegion()
+            if (len(matching) == len(distinct)):
+                return QRegion(self.mX, self.mY, self.mWidth, self.mHeight)
+            if (0 in matching):
+                # Subtract the cells that don't match, which are all
+                # non-empty, rather than scanning the empty areas
+                bounds = QRegion(self.mX, self.mY, self.mWidth, self.mHeight)
+                return bounds.subtracted(self.__regionOf(self.__nonEmptySubset(distinct - matching, distinct)))
+            return self.__regionOf(self.__nonEmptySubset(matching, distinct))
         elif l==0:
             ##
             # Calculates the region occupied by the tiles of this layer. Similar to
             # Layer.bounds(), but leaves out the regions without tiles.
             ##
-            return self.region(lambda cell:not cell.isEmpty())
+            return self.__regionOf(None)
 
     ##
-    # Returns a read-only reference to the cell at the given coordinates. The
-    # coordinates have to be within this layer.
+    # Returns a copy of the cell at the given coordinates. The coordinates
+    # have to be within this layer. Changing the returned cell does not
+    # affect this layer, use setCell() for that.
     ##
     def cellAt(self, *args):
         l = len(args)
         if l==2:
             x, y = args
-            return self.mGrid.at(x + y * self.mWidth)
+            return self.unpackCell(self.mGrid.at(x, y))
         elif l==1:
             point = args[0]
-            return self.cellAt(point.x(), point.y())
+            return self.unpackCell(self.mGrid.at(point.x(), point.y()))
+
+    ##
+    # Returns the non-empty cells on row \a y between \a left and \a right
+    # (inclusive) as a list of (x, cell) pairs, ordered by x. Parts of the
+    # row that are known to be empty are skipped.
+    ##
+    def cellsInRow(self, y, left, right):
+        cells = []
+        for x, values in self.mGrid.rowSegments(y, max(0, left), min(right, self.mWidth - 1)):
+            for value in values:
+                if value:
+                    cells.append((x, self.unpackCell(value)))
+                x += 1
+        return cells
+
+    ##
+    # Returns an (x, y, width, height) area around the cell at \a x, \a y
+    # that holds only empty cells, or None when that cell may be non-empty.
+    # Used to skip empty parts of the layer quickly.
+    ##
+    def emptyAreaAt(self, x, y):
+        return self.mGrid.emptyAreaAt(x, y)
 
     ##
     # Sets the cell at the given coordinates.
     ##
     def setCell(self, x, y, cell):
-        if (cell.tile):
-            size = cell.tile.size()
-            if (cell.flippedAntiDiagonally):
-                size.transpose()
-            offset = cell.tile.offset()
-            self.mMaxTileSize = maxSize(size, self.mMaxTileSize)
-            self.mOffsetMargins = maxMargins(QMargins(-offset.x(),
-                                                 -offset.y(),
-                                                 offset.x(),
-                                                 offset.y()),
-                                        self.mOffsetMargins)
-            if (self.mMap):
-                self.mMap.adjustDrawMargins(self.drawMargins())
-
-        self.mGrid[x + y * self.mWidth] = cell
+        value = self.packCell(cell)
+        previous = self.mGrid.at(x, y)
+        if (previous == value):
+            return
+        self.mGrid.setAt(x, y, value)
+        self.mModificationCount += 1
+        if (self.mOccupancy is not None):
+            self.mOccupancy[y * self.mWidth + x] = value != 0
+        if (previous):
+            self.__uncount(previous)
+        if (value):
+            self.__count(value)
+        if VerifyTilesetCounts:
+            self.verifyTilesetCounts()
 
     ##
     # Returns a copy of the area specified by the given \a region. The
@@ -300,22 +580,25 @@ class TileLayer(Layer):
     # tile layer.
     ##
     def flip(self, direction):
-        newGrid = QVector()
-        for i in range(self.mWidth * self.mHeight):
-            newGrid.append(Cell())
-        for y in range(self.mHeight):
-            for x in range(self.mWidth):
-                dest = newGrid[x + y * self.mWidth]
-                if (direction == FlipDirection.FlipHorizontally):
-                    source = self.cellAt(self.mWidth - x - 1, y)
-                    dest = source
-                    dest.flippedHorizontally = not source.flippedHorizontally
-                elif (direction == FlipDirection.FlipVertically):
-                    source = self.cellAt(x, self.mHeight - y - 1)
-                    dest = source
-                    dest.flippedVertically = not source.flippedVertically
+        horizontally = direction == FlipDirection.FlipHorizontally
+        if horizontally:
+            flagTable = [flags ^ 4 for flags in range(8)]
+        else:
+            flagTable = [flags ^ 2 for flags in range(8)]
+        newGrid = self.__createGrid(self.mWidth, self.mHeight)
+        for rx, ry, rw, rh in self.mGrid.occupiedRects():
+            area = mirroredArea(self.mGrid.area(rx, ry, rw, rh), rw, rh,
+                                horizontally, flagTable)
+            if horizontally:
+                newGrid.setArea(self.mWidth - rx - rw, ry, rw, rh, area)
+            else:
+                newGrid.setArea(rx, self.mHeight - ry - rh, rw, rh, area)
 
         self.mGrid = newGrid
+        self.mOccupancy = None
+        self.mModificationCount += 1
+        if VerifyTilesetCounts:
+            self.verifyTilesetCounts()
 
     ##
     # Rotate this tile layer by 90 degrees left or right. The tile positions
@@ -331,87 +614,106 @@ class TileLayer(Layer):
             rotateMask = rotateLeftMask
         newWidth = self.mHeight
         newHeight = self.mWidth
-        newGrid = QVector(newWidth * newHeight)
-        for y in range(self.mHeight):
-            for x in range(self.mWidth):
-                source = self.cellAt(x, y)
-                dest = source
-                mask = (dest.flippedHorizontally << 2) | (dest.flippedVertically << 1) | (dest.flippedAntiDiagonally << 0)
-                mask = rotateMask[mask]
-                dest.flippedHorizontally = (mask & 4) != 0
-                dest.flippedVertically = (mask & 2) != 0
-                dest.flippedAntiDiagonally = (mask & 1) != 0
-                if (direction == RotateDirection.RotateRight):
-                    newGrid[x * newWidth + (self.mHeight - y - 1)] = dest
-                else:
-                    newGrid[(self.mWidth - x - 1) * newWidth + y] = dest
+        newGrid = self.__createGrid(newWidth, newHeight)
+        clockwise = direction == RotateDirection.RotateRight
+        for rx, ry, rw, rh in self.mGrid.occupiedRects():
+            area = rotatedArea(self.mGrid.area(rx, ry, rw, rh), rw, rh,
+                               clockwise, rotateMask)
+            if clockwise:
+                newGrid.setArea(self.mHeight - ry - rh, rx, rh, rw, area)
+            else:
+                newGrid.setArea(ry, self.mWidth - rx - rw, rh, rw, area)
 
-        t = self.mMaxTileSize.width()
-        self.mMaxTileSize.setWidth(self.mMaxTileSize.height())
-        self.mMaxTileSize.setHeight(t)
+        # Rotating flips the anti-diagonal flag of every cell
+        transposedCounts = Counter()
+        for tileset, count in self.mTilesetCounts.items():
+            transposedCount = count - self.mTransposedCounts[tileset]
+            if transposedCount:
+                transposedCounts[tileset] = transposedCount
+        self.mTransposedCounts = transposedCounts
+        self.mMaxTileSize = QSize(self.mMaxTileSize.height(),
+                                  self.mMaxTileSize.width())
         self.mWidth = newWidth
         self.mHeight = newHeight
         self.mGrid = newGrid
+        self.mOccupancy = None
+        self.mModificationCount += 1
+        if VerifyTilesetCounts:
+            self.verifyTilesetCounts()
 
     ##
-    # Computes and returns the set of tilesets used by this tile layer.
+    # Returns the set of tilesets used by this tile layer.
     ##
     def usedTilesets(self):
-        tilesets = QSet()
-        i = 0
-        while(i<self.mGrid.size()):
-            tile = self.mGrid.at(i).tile
-            if tile:
-                tilesets.insert(tile.tileset())
-            i += 1
-        return tilesets
+        return QSet(self.mTilesetCounts)
+
+    ##
+    # Returns the number of cells on this layer that use a tile from the
+    # given \a tileset.
+    ##
+    def tilesetReferenceCount(self, tileset):
+        return self.mTilesetCounts[tileset]
 
     ##
     # Returns whether this tile layer has any cell for which the given
     # \a condition returns True.
     ##
     def hasCell(self, condition):
-        i = 0
-        for cell in self.mGrid:
-            if (condition(cell)):
+        for value in self.mGrid.distinctValues():
+            if (condition(self.unpackCell(value))):
                 return True
-            i += 1
         return False
 
     ##
     # Returns whether this tile layer is referencing the given tileset.
     ##
     def referencesTileset(self, tileset):
-        i = 0
-        while(i<self.mGrid.size()):
-            tile = self.mGrid.at(i).tile
-            if (tile and tile.tileset() == tileset):
-                return True
-            i += 1
-        return False
+        return tileset in self.mTilesetCounts
 
     ##
     # Removes all references to the given tileset. This sets all tiles on this
     # layer that are from the given tileset to null.
     ##
     def removeReferencesToTileset(self, tileset):
-        i = 0
-        while(i<self.mGrid.size()):
-            tile = self.mGrid.at(i).tile
+        if (tileset not in self.mTilesetCounts):
+            return
+        remap = {}
+        for index in range(1, len(self.mTiles)):
+            tile = self.mTiles[index]
             if (tile and tile.tileset() == tileset):
-                self.mGrid.replace(i, Cell())
-            i += 1
+                remap[index] = 0
+        self.__remapTileIndexes(remap)
+        del self.mTilesetCounts[tileset]
+        self.mTransposedCounts.pop(tileset, None)
+        if (self.mMap):
+            self.mMap.removeTilesetReferences((tileset,))
+        if VerifyTilesetCounts:
+            self.verifyTilesetCounts()
 
     ##
     # Replaces all tiles from \a oldTileset with tiles from \a newTileset.
     ##
     def replaceReferencesToTileset(self, oldTileset, newTileset):
-        i = 0
-        while(i<self.mGrid.size()):
-            tile = self.mGrid.at(i).tile
+        remap = {}
+        for index in range(1, len(self.mTiles)):
+            tile = self.mTiles[index]
             if (tile and tile.tileset() == oldTileset):
-                self.mGrid[i].tile = newTileset.tileAt(tile.id())
-            i += 1
+                newTile = newTileset.tileAt(tile.id())
+                del self.mTileIndexes[tile]
+                self.mTiles[index] = None
+                if not newTile:
+                    remap[index] = 0
+                elif newTile in self.mTileIndexes:
+                    remap[index] = self.mTileIndexes[newTile]
+                else:
+                    self.mTiles[index] = newTile
+                    self.mTileIndexes[newTile] = index
+        self.__remapTileIndexes(remap)
+        # The cells may refer to other tiles even when no index was remapped
+        self.mModificationCount += 1
+        self.__recountTilesets()
+        if VerifyTilesetCounts:
+            self.verifyTilesetCounts()
 
     ##
     # Resizes this tile layer to \a size, while shifting all tiles by
@@ -420,21 +722,31 @@ class TileLayer(Layer):
     def resize(self, size, offset):
         if (self.size() == size and offset.isNull()):
             return
-        newGrid = QVector()
-        for i in range(size.width() * size.height()):
-            newGrid.append(Cell())
+        newGrid = self.__createGrid(size.width(), size.height())
         # Copy over the preserved part
         startX = max(0, -offset.x())
         startY = max(0, -offset.y())
         endX = min(self.mWidth, size.width() - offset.x())
         endY = min(self.mHeight, size.height() - offset.y())
-        for y in range(startY, endY):
-            for x in range(startX, endX):
-                index = x + offset.x() + (y + offset.y()) * size.width()
-                newGrid[index] = self.cellAt(x, y)
+        for rx, ry, rw, rh in self.mGrid.occupiedRects():
+            left = max(startX, rx)
+            right = min(endX, rx + rw)
+            if left >= right:
+                continue
+            top = max(startY, ry)
+            bottom = min(endY, ry + rh)
+            if top >= bottom:
+                continue
+            newGrid.setArea(left + offset.x(), top + offset.y(), right - left, bottom - top,
+                            self.mGrid.area(left, top, right - left, bottom - top))
 
         self.mGrid = newGrid
+        self.mOccupancy = None
+        self.mModificationCount += 1
         self.setSize(size)
+        self.__recountTilesets()
+        if VerifyTilesetCounts:
+            self.verifyTilesetCounts()
 
     ##
     # Offsets the tiles in this layer within \a bounds by \a offset,
@@ -443,40 +755,40 @@ class TileLayer(Layer):
     # \sa ObjectGroup.offset()
     ##
     def offsetTiles(self, offset, bounds, wrapX, wrapY):
-        newGrid = QVector()
-        for i in range(self.mWidth * self.mHeight):
-            newGrid.append(Cell())
-        for y in range(self.mHeight):
-            for x in range(self.mWidth):
-                # Skip out of bounds tiles
-                if (not bounds.contains(x, y)):
-                    newGrid[x + y * self.mWidth] = self.cellAt(x, y)
-                    continue
+        newGrid = self.__createGrid(self.mWidth, self.mHeight)
+        bounds = bounds.normalized()
+        inside = bounds.intersected(QRect(0, 0, self.mWidth, self.mHeight))
+        columnSpans = offsetSpans(bounds.left(), bounds.width(),
+                                  inside.left(), inside.right() + 1, offset.x(), wrapX)
+        rowSpans = offsetSpans(bounds.top(), bounds.height(),
+                               inside.top(), inside.bottom() + 1, offset.y(), wrapY)
+        for rx, ry, rw, rh in self.mGrid.occupiedRects():
+            # Keep out of bounds tiles in place
+            for outside in QRegion(rx, ry, rw, rh).subtracted(QRegion(bounds)).rects():
+                newGrid.setArea(outside.x(), outside.y(), outside.width(), outside.height(),
+                                self.mGrid.area(outside.x(), outside.y(),
+                                                outside.width(), outside.height()))
 
-                # Get position to pull tile value from
-                oldX = x - offset.x()
-                oldY = y - offset.y()
-                # Wrap x value that will be pulled from
-                if (wrapX and bounds.width() > 0):
-                    while oldX < bounds.left():
-                        oldX += bounds.width()
-                    while oldX > bounds.right():
-                        oldX -= bounds.width()
-
-                # Wrap y value that will be pulled from
-                if (wrapY and bounds.height() > 0):
-                    while oldY < bounds.top():
-                        oldY += bounds.height()
-                    while oldY > bounds.bottom():
-                        oldY -= bounds.height()
-
-                # Set the new tile
-                if (self.contains(oldX, oldY) and bounds.contains(oldX, oldY)):
-                    newGrid[x + y * self.mWidth] = self.cellAt(oldX, oldY)
-                else:
-                    newGrid[x + y * self.mWidth] = Cell()
+            # Move the tiles within the bounds, one span at a time
+            for top, bottom, dy in rowSpans:
+                top = max(top, ry)
+                bottom = min(bottom, ry + rh)
+                if top >= bottom:
+                    continue
+                for left, right, dx in columnSpans:
+                    left = max(left, rx)
+                    right = min(right, rx + rw)
+                    if left >= right:
+                        continue
+                    newGrid.setArea(left + dx, top + dy, right - left, bottom - top,
+                                    self.mGrid.area(left, top, right - left, bottom - top))
 
         self.mGrid = newGrid
+        self.mOccupancy = None
+        self.mModificationCount += 1
+        self.__recountTilesets()
+        if VerifyTilesetCounts:
+            self.verifyTilesetCounts()
 
     def canMergeWith(self, other):
         return other.isTileLayer()
@@ -496,33 +808,50 @@ class TileLayer(Layer):
     # account. The returned region is relative to this tile layer.
     ##
     def computeDiffRegion(self, other):
-        ret = QRegion()
         dx = other.x() - self.mX
         dy = other.y() - self.mY
         r = QRect(0, 0, self.width(), self.height())
         r &= QRect(dx, dy, other.width(), other.height())
-        for y in range(r.top(), r.bottom()+1):
-            for x in range(r.left(), r.right()+1):
-                if (self.cellAt(x, y) != other.cellAt(x - dx, y - dy)):
-                    rangeStart = x
-                    while (x <= r.right() and self.cellAt(x, y) != other.cellAt(x - dx, y - dy)):
-                        x += 1
+        if (r.isEmpty()):
+            return QRegion()
+
+        # Only the parts where either layer has tiles need to be compared
+        occupied = QRegion()
+        for rx, ry, rw, rh in self.mGrid.occupiedRects():
+            occupied += QRect(rx, ry, rw, rh)
+        for rx, ry, rw, rh in other.grid().occupiedRects():
+            occupied += QRect(rx + dx, ry + dy, rw, rh)
+        occupied &= r
 
-                    rangeEnd = x
-                    ret += QRect(rangeStart, y, rangeEnd - rangeStart, 1)
+        rows = {}
+        for rect in occupied.rects():
+            x = rect.x()
+            y = rect.y()
+            width = rect.width()
+            height = rect.height()
+            values = self.mGrid.area(x, y, width, height)
+            otherValues = self.__translateValues(other, other.grid().area(x - dx, y - dy, width, height))
+            addMaskRuns(rows, differenceMask(values, otherValues), x, y, width, height)
+        return regionFromRuns(sorted(rows.items()), 0, 0)
 
-        return ret
+    ##
+    # Returns the region, in map coordinates, where this tile layer differs
+    # from the given tile layer. Unlike computeDiffRegion(), this includes
+    # the tiles of either layer that fall outside of the other layer.
+    ##
+    def diffRegion(self, other):
+        offset = QPoint(self.mX, self.mY)
+        diff = self.computeDiffRegion(other).translated(offset)
+        overlap = QRegion(self.bounds().intersected(other.bounds()))
+        diff += self.region().subtracted(overlap)
+        diff += other.region().subtracted(overlap)
+        return diff
 
     ##
     # Returns True if all tiles in the layer are empty.
     ##
     def isEmpty(self):
-        i = 0
-        while(i<self.mGrid.size()):
-            if (not self.mGrid.at(i).isEmpty()):
-                return False
-            i += 1
-        return True
+        return self.mGrid.isEmpty()
 
     ##
     # Returns a duplicate of this TileLayer.
@@ -530,17 +859,207 @@ class TileLayer(Layer):
     # \sa Layer.clone()
     ##
     def clone(self):
-        return self.initializeClone(TileLayer(self.mName, self.mX, self.mY, self.mWidth, self.mHeight))
-
-    def begin(self):
-        return self.mGrid.begin()
-    
-    def end(self):
-        return self.mGrid.end()
-        
+        # The grid is shared with the clone, so there is no need to allocate
+        # one of the full size first
+        clone = TileLayer(self.mName, self.mX, self.mY, 0, 0)
+        clone.setSize(self.size())
+        return self.initializeClone(clone)
+
     def initializeClone(self, clone):
         super().initializeClone(clone)
-        clone.mGrid = self.mGrid
-        clone.mMaxTileSize = self.mMaxTileSize
-        clone.mOffsetMargins = self.mOffsetMargins
+        clone.mGrid = self.mGrid.clone()
+        clone.mTiles = list(self.mTiles)
+        clone.mTileIndexes = dict(self.mTileIndexes)
+        clone.mTilesetCounts = Counter(self.mTilesetCounts)
+        clone.mTransposedCounts = Counter(self.mTransposedCounts)
+        clone.mMaxTileSize = QSize(self.mMaxTileSize)
+        clone.mOffsetMargins = QMargins(self.mOffsetMargins)
         return clone
+
+    ##
+    # Returns the given set of non-empty \a values, or None when it holds all
+    # of the non-empty values among the \a distinct values of the grid.
+    ##
+    def __nonEmptySubset(self, values, distinct):
+        if (len(values) == len(distinct) - (0 in distinct)):
+            return None
+        return values
+
+    ##
+    # Returns the region of the cells holding one of the given non-empty
+    # packed \a values, or of all non-empty cells when \a values is None.
+    ##
+    def __regionOf(self, values):
+        if (values is None):
+            occupancy = self.__occupancy()
+            if (occupancy is not None):
+                return regionFromRuns(maskRuns(occupancy, self.mWidth, self.mHeight),
+                                      self.mX, self.mY)
+        rows = {}
+        for rx, ry, rw, rh in self.mGrid.occupiedRects():
+            mask = valueMask(self.mGrid.area(rx, ry, rw, rh), values)
+            addMaskRuns(rows, mask, rx, ry, rw, rh)
+        return regionFromRuns(sorted(rows.items()), self.mX, self.mY)
+
+    ##
+    # Returns the packed \a values of the given tile \a layer translated to
+    # the tile table of this layer, so that they can be compared to the
+    # values of this layer. Tiles unknown to this layer get tile indexes past
+    # the end of its table, which never match any of its cells.
+    ##
+    def __translateValues(self, layer, values):
+        # Build a table mapping the tile indexes of the other layer to ours
+        indexes = [0]
+        unknownTiles = {}
+        for tile in layer.mTiles[1:]:
+            index = self.mTileIndexes.get(tile)
+            if (index is None):
+                index = unknownTiles.setdefault(tile, len(self.mTiles) + len(unknownTiles))
+            indexes.append(index)
+        if (indexes == list(range(len(indexes)))):
+            return values
+        if numpy:
+            values = numpy.frombuffer(values, dtype=numpy.uint32)
+            table = numpy.array(indexes, dtype=numpy.uint32)
+            return (values & FlagsMask) | table[values & TileIndexMask]
+        translated = {}
+        for value in set(values):
+            translated[value] = (value & FlagsMask) | indexes[value & TileIndexMask]
+        return array('I', map(translated.__getitem__, values))
+
+    ##
+    # Returns a mask with a 1 byte for each non-empty cell, stored row by
+    # row. The mask is cached and kept up to date by setCell(), other changes
+    # drop it. Returns None for chunked grids, where the mask would cost as
+    # much memory as a dense grid.
+    ##
+    def __occupancy(self):
+        if (self.mOccupancy is None and isinstance(self.mGrid, CellGrid)):
+            values = self.mGrid.toBytes()
+            if numpy:
+                mask = numpy.frombuffer(values, dtype=numpy.uint32) != 0
+                self.mOccupancy = bytearray(mask.view(numpy.uint8).tobytes())
+            else:
+                self.mOccupancy = bytearray(map(bool, self.mGrid.values()))
+        return self.mOccupancy
+
+    ##
+    # Creates an empty grid of the given size, using the chunked backend for
+    # large layers.
+    ##
+    def __createGrid(self, width, height):
+        if (width * height > ChunkedGridThreshold):
+            return ChunkedCellGrid(width, height)
+        return CellGrid(width, height)
+
+    ##
+    # Changes the tile index of all cells according to \a remap, which maps
+    # old tile indexes to new ones. Cells remapped to 0 are cleared.
+    ##
+    def __remapTileIndexes(self, remap):
+        if not remap:
+            return
+        for index, newIndex in remap.items():
+            if newIndex == 0:
+                tile = self.mTiles[index]
+                if tile and self.mTileIndexes.get(tile) == index:
+                    del self.mTileIndexes[tile]
+                self.mTiles[index] = None
+
+        def remapped(value):
+            newIndex = remap.get(value & TileIndexMask)
+            if newIndex is None:
+                return value
+            if newIndex == 0:
+                return 0
+            return (value & FlagsMask) | newIndex
+
+        self.mGrid.mapValues(remapped)
+        self.mOccupancy = None
+        self.mModificationCount += 1
+
+    ##
+    # Counts the cell with the given packed \a value as added to this layer.
+    # Grows the draw margins when the cell uses a tileset, or a transposition
+    # of its tile size, that was not used before.
+    ##
+    def __count(self, value):
+        tileset = self.mTiles[value & TileIndexMask].tileset()
+        count = self.mTilesetCounts[tileset]
+        transposedCount = self.mTransposedCounts[tileset]
+        self.mTilesetCounts[tileset] = count + 1
+        if (count == 0 and self.mMap):
+            self.mMap.addTilesetReferences((tileset,))
+        if (value & FlippedAntiDiagonallyFlag):
+            self.mTransposedCounts[tileset] = transposedCount + 1
+            isNew = transposedCount == 0
+            size = tileset.tileSize().transposed()
+        else:
+            isNew = count == transposedCount
+            size = tileset.tileSize()
+
+        if (isNew):
+            self.mMaxTileSize = maxSize(size, self.mMaxTileSize)
+            self.mOffsetMargins = maxMargins(tileOffsetMargins(tileset),
+                                             self.mOffsetMargins)
+            if (self.mMap):
+                self.mMap.adjustDrawMargins(self.drawMargins())
+
+    ##
+    # Counts the cell with the given packed \a value as removed from this
+    # layer. Like setCell() always did, this does not shrink the draw margins.
+    ##
+    def __uncount(self, value):
+        tileset = self.mTiles[value & TileIndexMask].tileset()
+        count = self.mTilesetCounts[tileset] - 1
+        if (count > 0):
+            self.mTilesetCounts[tileset] = count
+        else:
+            del self.mTilesetCounts[tileset]
+            if (self.mMap):
+                self.mMap.removeTilesetReferences((tileset,))
+        if (value & FlippedAntiDiagonallyFlag):
+            transposedCount = self.mTransposedCounts[tileset] - 1
+            if (transposedCount > 0):
+                self.mTransposedCounts[tileset] = transposedCount
+            else:
+                del self.mTransposedCounts[tileset]
+
+    ##
+    # Recounts the tileset references from scratch, after the grid was
+    # changed in bulk.
+    ##
+    def __recountTilesets(self):
+        tilesetCounts = Counter()
+        transposedCounts = Counter()
+        for value, count in self.mGrid.valueCounts().items():
+            tile = self.mTiles[value & TileIndexMask]
+            if tile:
+                tileset = tile.tileset()
+                tilesetCounts[tileset] += count
+                if (value & FlippedAntiDiagonallyFlag):
+                    transposedCounts[tileset] += count
+        if (self.mMap):
+            self.mMap.removeTilesetReferences(self.mTilesetCounts.keys() - tilesetCounts.keys())
+            self.mMap.addTilesetReferences(tilesetCounts.keys() - self.mTilesetCounts.keys())
+        self.mTilesetCounts = tilesetCounts
+        self.mTransposedCounts = transposedCounts
+
+    ##
+    # Verifies the tileset counts of this layer, and the tileset references
+    # of its map, against a full scan of the cells.
+    #
+    # \sa VerifyTilesetCounts
+    ##
+    def verifyTilesetCounts(self):
+        tilesetCounts = Counter()
+        transposedCounts = Counter()
+        for cell in self:
+            if cell.tile:
+                tilesetCounts[cell.tile.tileset()] += 1
+                if cell.flippedAntiDiagonally:
+                    transposedCounts[cell.tile.tileset()] += 1
+        assert tilesetCounts == self.mTilesetCounts, "Tileset counts out of sync on layer '%s'"%self.mName
+        assert transposedCounts == self.mTransposedCounts, "Transposed counts out of sync on layer '%s'"%self.mName
+        if (self.mMap):
+            self.mMap.verifyTilesetReferences()
@@ -33,6 +33,7 @@ from object import Object
 from pyqtcore import QString, QList, QVector
 from PyQt5.QtCore import (
     QPoint,
+    QRect,
     QSize
 )
 from PyQt5.QtGui import (
@@ -85,9 +86,11 @@ class Tileset(Object):
         self.mFileName = QString()
         self.mTiles = QList()
         self.mTransparentColor = QColor()
+        self.mImage = QPixmap()
         self.mImageSource = QString()
         self.mTerrainTypes = QList()
         self.mWeakPointer = None
+        self.mRevision = 0
 
     ##
     # Destructor.
@@ -218,6 +221,14 @@ class Tileset(Object):
     def imageHeight(self):
         return self.mImageHeight
 
+    ##
+    # Returns the tileset image, with the transparent color masked out. The
+    # tiles loaded from it refer to their area of this image (see
+    # Tile.imageRect()). Returns a null pixmap when the tileset has no image.
+    ##
+    def image(self):
+        return self.mImage
+
     ##
     # Returns the transparent color, or an invalid color if no transparent
     # color is used.
@@ -257,22 +268,27 @@ class Tileset(Object):
     
             if (image.isNull()):
                 return False
+            # The tiles only refer to an area of the tileset image, which is
+            # masked as a whole. Their images are created when needed.
+            self.mImage = QPixmap.fromImage(image)
+            self.mRevision += 1
+            if (self.mTransparentColor.isValid()):
+                mask = image.createMaskFromColor(self.mTransparentColor.rgb())
+                self.mImage.setMask(QBitmap.fromImage(mask))
+
             stopWidth = image.width() - tileSize.width()
             stopHeight = image.height() - tileSize.height()
             oldTilesetSize = self.tileCount()
             tileNum = 0
             for y in range(margin, stopHeight+1, tileSize.height() + spacing):
                 for x in range(margin, stopWidth+1, tileSize.width() + spacing):
-                    tileImage = image.copy(x, y, tileSize.width(), tileSize.height())
-                    tilePixmap = QPixmap.fromImage(tileImage)
-                    if (self.mTransparentColor.isValid()):
-                        mask = tileImage.createMaskFromColor(self.mTransparentColor.rgb())
-                        tilePixmap.setMask(QBitmap.fromImage(mask))
-
+                    tileRect = QRect(x, y, tileSize.width(), tileSize.height())
                     if (tileNum < oldTilesetSize):
-                        self.mTiles.at(tileNum).setImage(tilePixmap)
+                        self.mTiles.at(tileNum).setImageRect(tileRect)
                     else:
-                        self.mTiles.append(Tile(tilePixmap, tileNum, self))
+                        tile = Tile(None, tileNum, self)
+                        tile.setImageRect(tileRect)
+                        self.mTiles.append(tile)
 
                     tileNum += 1
 
@@ -439,12 +455,21 @@ class Tileset(Object):
             return self.mTerrainTypes.at(terrainType1).transitionDistance(terrainType0)
         return self.mTerrainTypes.at(terrainType0).transitionDistance(terrainType1)
 
+    ##
+    # Returns a number that changes whenever tiles are added to or removed
+    # from this tileset or their images change. Tile IDs may have changed
+    # when it did.
+    ##
+    def revision(self):
+        return self.mRevision
+
     ##
     # Adds a new tile to the end of the tileset.
     ##
     def addTile(self, image, source=QString()):
         newTile = Tile(image, source, self.tileCount(), self)
         self.mTiles.append(newTile)
+        self.mRevision += 1
         if (self.mTileHeight < image.height()):
             self.mTileHeight = image.height()
         if (self.mTileWidth < image.width()):
@@ -458,15 +483,15 @@ class Tileset(Object):
         # Adjust the tile IDs of the remaining tiles
         for i in range(index + count, self.mTiles.size()):
             self.mTiles.at(i).mId += count
+        self.mRevision += 1
         self.updateTileSize()
 
     def removeTiles(self, index, count):
-        first = self.mTiles.begin() + index
-        last = first + count
-        last = self.mTiles.erase(first, last)
+        del self.mTiles[index:index + count]
         # Adjust the tile IDs of the remaining tiles
-        for last in self.mTiles:
-            last.mId -= count
+        for i in range(index, self.mTiles.size()):
+            self.mTiles.at(i).mId -= count
+        self.mRevision += 1
         self.updateTileSize()
 
     ##
@@ -481,6 +506,7 @@ class Tileset(Object):
         previousImageSize = tile.image().size()
         newImageSize = image.size()
         tile.setImage(image)
+        self.mRevision += 1
         tile.setImageSource(source)
         if (previousImageSize != newImageSize):
             # Update our max. tile size
@@ -32,7 +32,9 @@ from map import (
     orientationFromString, 
     staggerAxisFromString, 
     staggerIndexFromString, 
-    renderOrderFromString
+    renderOrderFromString,
+    isBase64LayerDataFormat,
+    base64LayerDataFormatFromString
 )
 from imagelayer import ImageLayer
 from tiled_global import Int, Int2, Float2
@@ -114,6 +116,7 @@ class VariantToMapConverter():
         map.setRenderOrder(renderOrder)
         if (nextObjectId):
             map.setNextObjectId(nextObjectId)
+        map.setCompressionLevel(variantMap.get("compressionlevel", -1))
         self.mMap = map
         map.setProperties(self.toProperties(variantMap.get("properties", {})))
         bgColor = variantMap.get("backgroundcolor", '')
@@ -310,13 +313,8 @@ class VariantToMapConverter():
         if encoding=='' or encoding == "csv":
             layerDataFormat = Map.LayerDataFormat.CSV
         elif (encoding == "base64"):
-            if compression=='':
-                layerDataFormat = Map.LayerDataFormat.Base64
-            elif (compression == "gzip"):
-                layerDataFormat = Map.LayerDataFormat.Base64Gzip
-            elif (compression == "zlib"):
-                layerDataFormat = Map.LayerDataFormat.Base64Zlib
-            else:
+            layerDataFormat = base64LayerDataFormatFromString(compression)
+            if layerDataFormat is None:
                 self.mError = self.tr("Compression method '%s' not supported"%compression)
                 return None
         else:
@@ -350,9 +348,7 @@ class VariantToMapConverter():
                 if (x >= tileLayer.width()):
                     x = 0
                     y += 1
-        elif layerDataFormat==Map.LayerDataFormat.Base64 \
-            or layerDataFormat==Map.LayerDataFormat.Base64Zlib \
-            or layerDataFormat==Map.LayerDataFormat.Base64Gzip:
+        elif isBase64LayerDataFormat(layerDataFormat):
             data = QByteArray(dataVariant)
             error = self.mGidMapper.decodeLayerData(tileLayer, data, layerDataFormat)
 
@@ -20,8 +20,16 @@
 
 from layer import Layer
 from mapobject import MapObject
-from gidmapper import GidMapper
-from map import Map, orientationToString, staggerAxisToString, staggerIndexToString, renderOrderToString
+from gidmapper import GidMapper, encodeLayersData
+from map import (
+    Map,
+    orientationToString,
+    staggerAxisToString,
+    staggerIndexToString,
+    renderOrderToString,
+    isBase64LayerDataFormat,
+    layerDataCompressionToString
+)
 from lua.luatablewriter import LuaTableWriter
 from mapformat import WritableMapFormat
 from pyqtcore import (
@@ -122,11 +130,22 @@ class LuaPlugin(WritableMapFormat):
             firstGid += tileset.tileCount()
         
         writer.writeEndTable()
+        # Encode all tile layers up front, so that they are encoded in parallel
+        encodedLayerData = {}
+        if (isBase64LayerDataFormat(map.layerDataFormat())):
+            tileLayers = map.tileLayers()
+            layerData = encodeLayersData(self.mGidMapper, tileLayers,
+                                         map.layerDataFormat(),
+                                         map.compressionLevel())
+            encodedLayerData = dict(zip(tileLayers, layerData))
+
         writer.writeStartTable("layers")
         for layer in map.layers():
             x = layer.layerType()
             if x==Layer.TileLayerType:
-                self.writeTileLayer(writer, layer, map.layerDataFormat())
+                self.writeTileLayer(writer, layer, map.layerDataFormat(),
+                                    map.compressionLevel(),
+                                    encodedLayerData.get(layer))
             elif x==Layer.ObjectGroupType:
                 self.writeObjectGroup(writer, layer)
             elif x==Layer.ImageLayerType:
@@ -231,7 +250,7 @@ class LuaPlugin(WritableMapFormat):
         writer.writeEndTable() # tiles
         writer.writeEndTable() # tileset
     
-    def writeTileLayer(self, writer, tileLayer, format):
+    def writeTileLayer(self, writer, tileLayer, format, compressionLevel = -1, layerData = None):
         writer.writeStartTable()
         writer.writeKeyAndValue("type", "tilelayer")
         writer.writeKeyAndValue("name", tileLayer.name())
@@ -249,22 +268,22 @@ class LuaPlugin(WritableMapFormat):
             self.writeProperties(writer, tileLayer.properties())
             writer.writeKeyAndValue("encoding", "lua")
             writer.writeStartTable("data")
+            gids = self.mGidMapper.cellsToGids(tileLayer).tolist()
             for y in range(0, tileLayer.height()):
                 if (y > 0):
                     writer.prepareNewLine()
                 for x in range(0, tileLayer.width()):
-                    writer.writeValue(self.mGidMapper.cellToGid(tileLayer.cellAt(x, y)))
-        elif format==Map.LayerDataFormat.Base64 \
-            or format==Map.LayerDataFormat.Base64Zlib \
-            or format==Map.LayerDataFormat.Base64Gzip:
+                    writer.writeValue(gids[x + y * tileLayer.width()])
+        elif isBase64LayerDataFormat(format):
             writer.writeKeyAndValue("encoding", "base64")
 
-            if format == Map.LayerDataFormat.Base64Zlib:
-                writer.writeKeyAndValue("compression", "zlib")
-            elif format == Map.LayerDataFormat.Base64Gzip:
-                writer.writeKeyAndValue("compression", "gzip")
+            compression = layerDataCompressionToString(format)
+            if compression != '':
+                writer.writeKeyAndValue("compression", compression)
 
-            layerData = self.mGidMapper.encodeLayerData(tileLayer, format)
+            if (layerData is None):
+                layerData = self.mGidMapper.encodeLayerData(tileLayer, format,
+                                                            compressionLevel)
             writer.writeKeyAndValue("data", layerData)
 
         writer.writeEndTable()
@@ -176,6 +176,9 @@ class Ui_MainWindow(object):
         self.actionHighlightCurrentLayer = QtWidgets.QAction(MainWindow)
         self.actionHighlightCurrentLayer.setCheckable(True)
         self.actionHighlightCurrentLayer.setObjectName("actionHighlightCurrentLayer")
+        self.actionFlattenInactiveLayers = QtWidgets.QAction(MainWindow)
+        self.actionFlattenInactiveLayers.setCheckable(True)
+        self.actionFlattenInactiveLayers.setObjectName("actionFlattenInactiveLayers")
         self.actionShowTileObjectOutlines = QtWidgets.QAction(MainWindow)
         self.actionShowTileObjectOutlines.setCheckable(True)
         self.actionShowTileObjectOutlines.setObjectName("actionShowTileObjectOutlines")
@@ -247,6 +250,7 @@ class Ui_MainWindow(object):
         self.menuView.addAction(self.menuShowObjectNames.menuAction())
         self.menuView.addAction(self.actionShowTileAnimations)
         self.menuView.addAction(self.actionHighlightCurrentLayer)
+        self.menuView.addAction(self.actionFlattenInactiveLayers)
         self.menuView.addSeparator()
         self.menuView.addAction(self.actionSnapToGrid)
         self.menuView.addAction(self.actionSnapToFineGrid)
@@ -315,6 +319,7 @@ class Ui_MainWindow(object):
         self.actionDelete.setIconText(_translate("MainWindow", "Delete"))
         self.actionHighlightCurrentLayer.setText(_translate("MainWindow", "&Highlight Current Layer"))
         self.actionHighlightCurrentLayer.setShortcut(_translate("MainWindow", "H"))
+        self.actionFlattenInactiveLayers.setText(_translate("MainWindow", "&Flatten Inactive Layers"))
         self.actionShowTileObjectOutlines.setText(_translate("MainWindow", "Show Tile Object &Outlines"))
         self.actionSnapToFineGrid.setText(_translate("MainWindow", "Snap to &Fine Grid"))
         self.actionShowTileAnimations.setText(_translate("MainWindow", "Show Tile Animations"))
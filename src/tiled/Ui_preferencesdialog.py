@@ -35,6 +35,13 @@ class Ui_PreferencesDialog(object):
         self.openLastFiles.setChecked(True)
         self.openLastFiles.setObjectName("openLastFiles")
         self.gridLayout.addWidget(self.openLastFiles, 2, 0, 1, 1)
+        self.label_5 = QtWidgets.QLabel(self.groupBox)
+        self.label_5.setObjectName("label_5")
+        self.gridLayout.addWidget(self.label_5, 3, 0, 1, 1)
+        self.saveWorkerCount = QtWidgets.QSpinBox(self.groupBox)
+        self.saveWorkerCount.setMaximum(64)
+        self.saveWorkerCount.setObjectName("saveWorkerCount")
+        self.gridLayout.addWidget(self.saveWorkerCount, 3, 1, 1, 1)
         self.verticalLayout_2.addWidget(self.groupBox)
         self.groupBox_2 = QtWidgets.QGroupBox(self.tab)
         self.groupBox_2.setObjectName("groupBox_2")
@@ -149,6 +156,7 @@ class Ui_PreferencesDialog(object):
         self.label_3.setBuddy(self.gridColor)
         self.label_4.setBuddy(self.gridFine)
         self.label.setBuddy(self.objectLineWidth)
+        self.label_5.setBuddy(self.saveWorkerCount)
 
         self.retranslateUi(PreferencesDialog)
         self.tabWidget.setCurrentIndex(0)
@@ -156,7 +164,8 @@ class Ui_PreferencesDialog(object):
         QtCore.QMetaObject.connectSlotsByName(PreferencesDialog)
         PreferencesDialog.setTabOrder(self.tabWidget, self.enableDtd)
         PreferencesDialog.setTabOrder(self.enableDtd, self.reloadTilesetImages)
-        PreferencesDialog.setTabOrder(self.reloadTilesetImages, self.languageCombo)
+        PreferencesDialog.setTabOrder(self.reloadTilesetImages, self.saveWorkerCount)
+        PreferencesDialog.setTabOrder(self.saveWorkerCount, self.languageCombo)
         PreferencesDialog.setTabOrder(self.languageCombo, self.gridColor)
         PreferencesDialog.setTabOrder(self.gridColor, self.gridFine)
         PreferencesDialog.setTabOrder(self.gridFine, self.objectLineWidth)
@@ -177,6 +186,9 @@ class Ui_PreferencesDialog(object):
         self.enableDtd.setToolTip(_translate("PreferencesDialog", "Not enabled by default since a reference to an external DTD is known to cause problems with some XML parsers."))
         self.enableDtd.setText(_translate("PreferencesDialog", "Include &DTD reference in saved maps"))
         self.openLastFiles.setText(_translate("PreferencesDialog", "Open last files on startup"))
+        self.label_5.setText(_translate("PreferencesDialog", "Save &threads:"))
+        self.saveWorkerCount.setToolTip(_translate("PreferencesDialog", "Number of threads encoding tile layers when saving a map."))
+        self.saveWorkerCount.setSpecialValueText(_translate("PreferencesDialog", "Automatic"))
         self.groupBox_2.setTitle(_translate("PreferencesDialog", "Interface"))
         self.openGL.setText(_translate("PreferencesDialog", "Hardware &accelerated drawing (OpenGL)"))
         self.label_2.setText(_translate("PreferencesDialog", "&Language:"))
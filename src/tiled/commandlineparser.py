@@ -33,12 +33,11 @@ def Callback():
     pass
 
 ##
-# A template function that will static-cast the given \a object to a type T
-# and call the member function of T given in the second template argument.
+# Calls the bound member function given as \a object, passing along the
+# \a values of the option.
 ##
-def MemberFunctionCall(object):
-    t = object
-    t.memberFunction()
+def MemberFunctionCall(object, *values):
+    object(*values)
 
 ##
 # A simple command line parser. Options should be registered through
@@ -82,10 +81,23 @@ class CommandLineParser():
         elif l==5:
             callback, data, shortName, longName, help = args
             self.mOptions.append(CommandLineParser.Option(callback, data, shortName, longName, help))
-            length = longName.length()
+            length = len(longName)
             if (self.mLongestArgument < length):
                 self.mLongestArgument = length
 
+    ##
+    # Registers a long option taking a value, given as "--name=value". When it
+    # is encountered, the member function given as \a handler is called with
+    # the value. The \a valueName is used in the help.
+    ##
+    def registerValueOption(self, handler, longName, valueName, help):
+        option = CommandLineParser.Option(MemberFunctionCall, handler, QChar(), longName, help)
+        option.valueName = valueName
+        self.mOptions.append(option)
+        length = len(option.helpName())
+        if (self.mLongestArgument < length):
+            self.mLongestArgument = length
+
     ##
     # Parses the given \a arguments. Returns False when the application is not
     # expected to run (either there was a parsing error, or the help was
@@ -107,7 +119,7 @@ class CommandLineParser():
                 self.mFilesToOpen.append(arg)
                 continue
 
-            if (arg.length() == 1):
+            if (len(arg) == 1):
                 # Traditionally a single hyphen means read file from stdin,
                 # write file to stdout. This isn't supported right now.
                 qWarning(self.tr("Bad argument %d: lonely hyphen"%index))
@@ -117,7 +129,7 @@ class CommandLineParser():
             # Long options
             if (arg.at(1) == '-'):
                 # Double hypen "--" means no more options will follow
-                if (arg.length() == 2):
+                if (len(arg) == 2):
                     noMoreArguments = True
                     continue
 
@@ -129,7 +141,7 @@ class CommandLineParser():
                 continue
 
             # Short options
-            for i in range(1, arg.length()):
+            for i in range(1, len(arg)):
                 c = arg.at(i)
                 if (not self.handleShortOption(c)):
                     qWarning(self.tr("Unknown short argument %d.%d: %s"%(index, i, c)))
@@ -150,29 +162,36 @@ class CommandLineParser():
 
     def showHelp(self):
         qWarning(self.tr("Usage:\n  %s [options] [files...]"%self.mCurrentProgramName) + "\n\n" + self.tr("Options:"))
-        qWarning("  -h %-*s : %s", self.mLongestArgument, "--help", self.tr("Display this help"))
+        qWarning("  -h %-*s : %s"%(self.mLongestArgument, "--help", self.tr("Display this help")))
         for option in self.mOptions:
-            if (not option.shortName.isNull()):
-                qWarning("  -%c %-*s : %s",
-                         option.shortName.toLatin1(),
-                         self.mLongestArgument, option.longName,
-                         option.help)
+            if (option.shortName != ''):
+                qWarning("  -%s %-*s : %s"%(option.shortName,
+                         self.mLongestArgument, option.helpName(),
+                         option.help))
             else:
-                qWarning("     %-*s : %s",
-                         self.mLongestArgument, option.longName,
-                         option.help)
+                qWarning("     %-*s : %s"%(self.mLongestArgument, option.helpName(),
+                         option.help))
 
-        qWarning()
+        qWarning('')
 
     def handleLongOption(self, longName):
         if (longName == "--help"):
             self.mShowHelp = True
             return True
 
+        name, separator, value = longName.partition('=')
         for option in self.mOptions:
-            if (longName == option.longName):
+            if (name != option.longName):
+                continue
+            if (option.valueName != ''):
+                if (separator == ''):
+                    return False
+                option.callback(option.data, value)
+            elif (separator != ''):
+                return False
+            else:
                 option.callback(option.data)
-                return True
+            return True
 
         return False
 
@@ -182,7 +201,7 @@ class CommandLineParser():
             return True
 
         for option in self.mOptions:
-            if (c == option.shortName):
+            if (option.valueName == '' and c == option.shortName):
                 option.callback(option.data)
                 return True
 
@@ -212,3 +231,12 @@ class CommandLineParser():
                 self.shortName = shortName
                 self.longName = longName
                 self.help = help
+            self.valueName = QString()
+
+        ##
+        # Returns the name of the option as shown in the help.
+        ##
+        def helpName(self):
+            if (self.valueName != ''):
+                return self.longName + "=" + self.valueName
+            return self.longName
@@ -60,11 +60,23 @@ class ImageLayerItem(QGraphicsItem):
         self.prepareGeometryChange()
         self.mBoundingRect = QRectF(self.mMapDocument.renderer().boundingRect_(self.mLayer))
 
+    ##
+    # Returns the image layer displayed by this item.
+    ##
+    def imageLayer(self):
+        return self.mLayer
+
+    ##
+    # Draws the part \a exposed of the layer, given in item coordinates.
+    ##
+    def drawLayer(self, painter, exposed):
+        renderer = self.mMapDocument.renderer()
+        renderer.drawImageLayer(painter, self.mLayer, exposed)
+
     # QGraphicsItem
     def boundingRect(self):
         return self.mBoundingRect
 
     def paint(self, painter, option, widget = None):
         # TODO: Display a border around the layer when selected
-        renderer = self.mMapDocument.renderer()
-        renderer.drawImageLayer(painter, self.mLayer, option.exposedRect)
+        self.drawLayer(painter, option.exposedRect)
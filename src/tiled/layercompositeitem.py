@@ -0,0 +1,163 @@
+##
+# layercompositeitem.py
+#
+# This file is part of Tiled.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+##
+
+from tilelayeritem import (
+    TileLayerItem,
+    sharedChunkCache,
+    newChunkOwner,
+    canDrawChunks,
+    drawChunks
+)
+from PyQt5.QtCore import (
+    QRectF
+)
+from PyQt5.QtWidgets import (
+    QGraphicsItem
+)
+
+##
+# A graphics item displaying a stack of tile and image layers flattened into
+# one image.
+#
+# The MapScene uses it in place of the items of the layers that are not being
+# edited, which are hidden meanwhile. The layers are drawn the way their items
+# would draw them, using the opacity and position of those items, into chunks
+# kept in the shared chunk cache. The chunks have to be invalidated when one of
+# the layers changes (see invalidateRegion() and invalidate()), while changes
+# to the layer items themselves require calling syncWithLayerItems().
+##
+class LayerCompositeItem(QGraphicsItem):
+
+    ##
+    # Constructor.
+    #
+    # @param layerItems  the tile and image layer items to flatten, from
+    #                    bottom to top
+    # @param mapDocument the map document owning the map of these layers
+    ##
+    def __init__(self, layerItems, mapDocument):
+        super().__init__()
+
+        self.mBoundingRect = QRectF()
+        self.mLayerItems = list(layerItems)
+        self.mMapDocument = mapDocument
+        self.mChunkOwner = newChunkOwner()
+        self.mModificationCounts = []
+        self.mLayerItemStates = []
+
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+        self.syncWithLayerItems()
+
+    ##
+    # Returns the layer items flattened by this item.
+    ##
+    def layerItems(self):
+        return self.mLayerItems
+
+    ##
+    # Updates the size of this item and drops its chunks. Should be called
+    # when the size, position or opacity of one of the layer items changed.
+    ##
+    def syncWithLayerItems(self):
+        self.prepareGeometryChange()
+        self.invalidate()
+        boundingRect = QRectF()
+        for item in self.mLayerItems:
+            boundingRect = boundingRect.united(item.boundingRect().translated(item.pos()))
+        self.mBoundingRect = boundingRect
+        self.mLayerItemStates = self.__layerItemStates()
+
+    ##
+    # Returns whether the opacity or position of one of the layer items
+    # changed since the last call to syncWithLayerItems().
+    ##
+    def layerItemsChanged(self):
+        return self.__layerItemStates() != self.mLayerItemStates
+
+    ##
+    # Drops all pre-rendered chunks.
+    ##
+    def invalidate(self):
+        sharedChunkCache.removeChunks(self.mChunkOwner)
+        self.mModificationCounts = self.__modificationCounts()
+
+    ##
+    # Drops the pre-rendered chunks intersecting \a rect, given in scene
+    # coordinates. Should be called when one of the layers changed there.
+    ##
+    def invalidateRegion(self, rect):
+        sharedChunkCache.removeChunks(self.mChunkOwner, rect)
+        self.mModificationCounts = self.__modificationCounts()
+
+    ##
+    # Drops all pre-rendered chunks when one of the layers uses \a tileset.
+    ##
+    def tilesetChanged(self, tileset):
+        for item in self.mLayerItems:
+            if (type(item) == TileLayerItem and item.tileLayer().referencesTileset(tileset)):
+                self.invalidate()
+                return
+
+    ##
+    # Drops all pre-rendered chunks when one of the layers uses animated tiles
+    # from \a tileset.
+    ##
+    def tileAnimationsAdvanced(self, tileset):
+        for item in self.mLayerItems:
+            if (type(item) == TileLayerItem and item.usesAnimatedTiles(tileset)):
+                sharedChunkCache.removeChunks(self.mChunkOwner)
+                return
+
+    # QGraphicsItem
+    def boundingRect(self):
+        return self.mBoundingRect
+
+    def paint(self, painter, option, widget = None):
+        if (not canDrawChunks(painter.worldTransform())):
+            self.__drawLayers(painter, option.exposedRect)
+            return
+
+        # Changes that were not reported invalidate the whole composite
+        if (self.__modificationCounts() != self.mModificationCounts):
+            for item in self.mLayerItems:
+                if (type(item) == TileLayerItem):
+                    item.invalidate()
+            self.invalidate()
+
+        exposed = option.exposedRect.intersected(self.mBoundingRect)
+        if (not exposed.isEmpty()):
+            drawChunks(painter, self.mChunkOwner, exposed, self.__drawLayers)
+
+    def __drawLayers(self, painter, exposed):
+        for item in self.mLayerItems:
+            painter.save()
+            painter.setOpacity(painter.opacity() * item.opacity())
+            painter.translate(item.pos())
+            item.drawLayer(painter, exposed.translated(-item.pos()))
+            painter.restore()
+
+    def __modificationCounts(self):
+        counts = []
+        for item in self.mLayerItems:
+            if (type(item) == TileLayerItem):
+                counts.append(item.tileLayer().modificationCount())
+        return counts
+
+    def __layerItemStates(self):
+        return [(item.opacity(), item.pos()) for item in self.mLayerItems]
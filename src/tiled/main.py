@@ -30,6 +30,7 @@ from pluginmanager import PluginManager
 from languagemanager import LanguageManager
 from mainwindow import MainWindow
 from commandlineparser import CommandLineParser
+from gidmapper import setEncodeWorkerCount
 from PyQt5.QtCore import (
     Qt,
     qWarning,
@@ -50,27 +51,32 @@ class CommandLineHandler(CommandLineParser):
         self.showedVersion = False
         self.disableOpenGL = False
         self.exportMap = False
+        self.saveWorkerCount = None
 
-        self.option(
+        self.option(self.showVersion,
                     'v',
                     "--version",
                     self.tr("Display the version"))
-        self.option(
+        self.option(self.justQuit,
                     QChar(),
                     "--quit",
                     self.tr("Only check validity of arguments"))
-        self.option(
+        self.option(self.setDisableOpenGL,
                     QChar(),
                     "--disable-opengl",
                     self.tr("Disable hardware accelerated rendering"))
-        self.option(
+        self.option(self.setExportMap,
                     QChar(),
                     "--export-map",
                     self.tr("Export the specified tmx file to target"))
-        self.option(
+        self.option(self.showExportFormats,
                     QChar(),
                     "--export-formats",
                     self.tr("Print a list of supported export formats"))
+        self.registerValueOption(self.setSaveWorkerCount,
+                    "--save-workers",
+                    "N",
+                    self.tr("Encode tile layers using N threads when saving (0 for one per processor)"))
 
     def tr(self, sourceText, disambiguation = '', n = -1):
         return QCoreApplication.translate('CommandLineHandler', sourceText, disambiguation, n)
@@ -90,6 +96,17 @@ class CommandLineHandler(CommandLineParser):
     def setExportMap(self):
         self.exportMap = True
 
+    def setSaveWorkerCount(self, value):
+        try:
+            count = int(value)
+        except ValueError:
+            count = -1
+        if (count < 0):
+            qWarning(self.tr("Invalid number of save workers: %s"%value))
+            self.quit = True
+            return
+        self.saveWorkerCount = count
+
     def showExportFormats(self):
         PluginManager.instance().loadPlugins()
 
@@ -102,8 +119,8 @@ class CommandLineHandler(CommandLineParser):
         self.quit = True
 
     # Convenience wrapper around registerOption
-    def option(self, shortName, longName, help):
-        CommandLineParser.registerOption(self, shortName, longName, help)
+    def option(self, handler, shortName, longName, help):
+        self.registerOption(handler, shortName, longName, help)
 
 def main(argv):
     a = TiledApplication(argv)
@@ -140,6 +157,11 @@ def main(argv):
         return 0
     if (commandLine.disableOpenGL):
         preferences.Preferences.instance().setUseOpenGL(False)
+    if (commandLine.saveWorkerCount is not None):
+        # Load the preferences first so that they don't override the option,
+        # which only applies to this session
+        preferences.Preferences.instance()
+        setEncodeWorkerCount(commandLine.saveWorkerCount)
     PluginManager.instance().loadPlugins()
     if (commandLine.exportMap):
         # Get the path to the source file and target file
@@ -243,6 +243,7 @@ class MainWindow(QMainWindow):
         self.mUi.actionSnapToGrid.setChecked(prefs.snapToGrid())
         self.mUi.actionSnapToFineGrid.setChecked(prefs.snapToFineGrid())
         self.mUi.actionHighlightCurrentLayer.setChecked(prefs.highlightCurrentLayer())
+        self.mUi.actionFlattenInactiveLayers.setChecked(prefs.flattenInactiveLayers())
         
         objectLabelVisibilityGroup = QActionGroup(self)
         self.mUi.actionNoLabels.setActionGroup(objectLabelVisibilityGroup)
@@ -328,6 +329,7 @@ class MainWindow(QMainWindow):
         self.mUi.actionSnapToGrid.toggled.connect(prefs.setSnapToGrid)
         self.mUi.actionSnapToFineGrid.toggled.connect(prefs.setSnapToFineGrid)
         self.mUi.actionHighlightCurrentLayer.toggled.connect(prefs.setHighlightCurrentLayer)
+        self.mUi.actionFlattenInactiveLayers.toggled.connect(prefs.setFlattenInactiveLayers)
         self.mUi.actionZoomIn.triggered.connect(self.zoomIn)
         self.mUi.actionZoomOut.triggered.connect(self.zoomOut)
         self.mUi.actionZoomNormal.triggered.connect(self.zoomNormal)
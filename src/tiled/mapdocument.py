@@ -44,6 +44,7 @@ from layermodel import LayerModel
 from isometricrenderer import IsometricRenderer
 from imagelayer import ImageLayer
 from hexagonalrenderer import HexagonalRenderer
+from maprenderer import TileVariantCache, TileColorCache
 from flipmapobjects import FlipMapObjects
 from changeselectedarea import ChangeSelectedArea
 from changeproperties import ChangeProperties
@@ -224,6 +225,8 @@ class MapDocument(QObject):
             _x = 0
         self.mCurrentLayerIndex = _x
         self.mLayerModel.setMapDocument(self)
+        self.tilesetChanged.connect(TileVariantCache.instance().invalidate)
+        self.tilesetChanged.connect(TileColorCache.instance().invalidate)
         # Forward signals emitted from the layer model
         self.mLayerModel.layerAdded.connect(self.onLayerAdded)
         self.mLayerModel.layerAboutToBeRemoved.connect(self.onLayerAboutToBeRemoved)
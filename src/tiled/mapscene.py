@@ -27,6 +27,7 @@ from tilesetmanager import TilesetManager
 from imagelayeritem import ImageLayerItem
 from tileselectionitem import TileSelectionItem
 from tilelayeritem import TileLayerItem
+from layercompositeitem import LayerCompositeItem
 import preferences
 from objectgroupitem import ObjectGroupItem
 from objectgroup import ObjectGroup
@@ -73,23 +74,26 @@ class MapScene(QGraphicsScene):
         self.mDefaultBackgroundColor = Qt.darkGray
 
         self.mLayerItems = QVector()
+        self.mLayerComposites = QList()
         self.mObjectItems = QMap()
         self.mObjectLineWidth = 0.0
         self.mSelectedObjectItems = QSet()
         self.mLastMousePos = QPointF()
         self.mShowTileObjectOutlines = False
         self.mHighlightCurrentLayer = False
+        self.mFlattenInactiveLayers = False
         self.mGridVisible = False
 
         self.setBackgroundBrush(self.mDefaultBackgroundColor)
         tilesetManager = TilesetManager.instance()
         tilesetManager.tilesetChanged.connect(self.tilesetChanged)
-        tilesetManager.repaintTileset.connect(self.tilesetChanged)
+        tilesetManager.repaintTileset.connect(self.repaintTileset)
         prefs = preferences.Preferences.instance()
         prefs.showGridChanged.connect(self.setGridVisible)
         prefs.showTileObjectOutlinesChanged.connect(self.setShowTileObjectOutlines)
         prefs.objectTypesChanged.connect(self.syncAllObjectItems)
         prefs.highlightCurrentLayerChanged.connect(self.setHighlightCurrentLayer)
+        prefs.flattenInactiveLayersChanged.connect(self.setFlattenInactiveLayers)
         prefs.gridColorChanged.connect(self.update)
         prefs.objectLineWidthChanged.connect(self.setObjectLineWidth)
         self.mDarkRectangle.setPen(QPen(Qt.NoPen))
@@ -100,6 +104,7 @@ class MapScene(QGraphicsScene):
         self.mObjectLineWidth = prefs.objectLineWidth()
         self.mShowTileObjectOutlines = prefs.showTileObjectOutlines()
         self.mHighlightCurrentLayer = prefs.highlightCurrentLayer()
+        self.mFlattenInactiveLayers = prefs.flattenInactiveLayers()
         # Install an event filter so that we can get key events on behalf of the
         # active tool without having to have the current focus.
         QCoreApplication.instance().installEventFilter(self)
@@ -134,6 +139,7 @@ class MapScene(QGraphicsScene):
             renderer.setFlag(RenderFlag.ShowTileObjectOutlines, self.mShowTileObjectOutlines)
             self.mMapDocument.mapChanged.connect(self.mapChanged)
             self.mMapDocument.regionChanged.connect(self.repaintRegion)
+            self.mMapDocument.tilesetChanged.connect(self.tilesetChanged)
             self.mMapDocument.tileLayerDrawMarginsChanged.connect(self.tileLayerDrawMarginsChanged)
             self.mMapDocument.layerAdded.connect(self.layerAdded)
             self.mMapDocument.layerRemoved.connect(self.layerRemoved)
@@ -323,12 +329,31 @@ class MapScene(QGraphicsScene):
             return
         self.mHighlightCurrentLayer = highlightCurrentLayer
         self.updateCurrentLayerHighlight()
+        self.updateLayerComposites()
+
+    ##
+    # Sets whether the visible tile and image layers below and above the
+    # current layer should be flattened into cached images, which makes
+    # repainting maps with many layers cheaper.
+    ##
+    def setFlattenInactiveLayers(self, flattenInactiveLayers):
+        if (self.mFlattenInactiveLayers == flattenInactiveLayers):
+            return
+        self.mFlattenInactiveLayers = flattenInactiveLayers
+        self.updateLayerComposites()
 
     ##
     # Refreshes the map scene.
     ##
     def refreshScene(self):
+        # Drop the pre-rendered chunks of the items about to be deleted
+        for item in self.mLayerItems:
+            if (type(item) == TileLayerItem):
+                item.invalidate()
+        for composite in self.mLayerComposites:
+            composite.invalidate()
         self.mLayerItems.clear()
+        self.mLayerComposites.clear()
         self.mObjectItems.clear()
         self.removeItem(self.mDarkRectangle)
         self.clear()
@@ -360,6 +385,7 @@ class MapScene(QGraphicsScene):
         self.mObjectSelectionItem.setZValue(10000 - 1)
         self.addItem(self.mObjectSelectionItem)
         self.updateCurrentLayerHighlight()
+        self.updateLayerComposites()
 
     ##
     # Repaints the specified region. The region is in tile coordinates.
@@ -367,17 +393,28 @@ class MapScene(QGraphicsScene):
     def repaintRegion(self, region, layer):
         renderer = self.mMapDocument.renderer()
         margins = self.mMapDocument.map().drawMargins()
+        index = self.mMapDocument.map().layers().indexOf(layer)
+        layerItem = None
+        if (index != -1 and type(self.mLayerItems.at(index)) == TileLayerItem):
+            layerItem = self.mLayerItems.at(index)
         for r in region.rects():
             boundingRect = QRectF(renderer.boundingRect(r))
-            self.update(QRectF(renderer.boundingRect(r).adjusted(-margins.left(),
+            paintedRect = QRectF(renderer.boundingRect(r).adjusted(-margins.left(),
                                                       -margins.top(),
                                                       margins.right(),
-                                                      margins.bottom())))
+                                                      margins.bottom()))
+            if (layerItem):
+                layerItem.invalidateRegion(paintedRect)
+                composite = self.compositeForLayerItem(layerItem)
+                if (composite):
+                    composite.invalidateRegion(paintedRect.translated(layerItem.pos()))
+            self.update(paintedRect)
             boundingRect.translate(layer.offset())
             self.update(boundingRect)
 
     def currentLayerIndexChanged(self):
         self.updateCurrentLayerHighlight()
+        self.updateLayerComposites()
         # New layer may have a different offset, affecting the grid
         if self.mGridVisible:
             self.update()
@@ -395,6 +432,8 @@ class MapScene(QGraphicsScene):
 
         for item in self.mObjectItems.values():
             item.syncWithMapObject()
+        for composite in self.mLayerComposites:
+            composite.syncWithLayerItems()
         map = self.mMapDocument.map()
         if (map.backgroundColor().isValid()):
             self.setBackgroundBrush(map.backgroundColor())
@@ -405,12 +444,35 @@ class MapScene(QGraphicsScene):
         if (not self.mMapDocument):
             return
         if (contains(self.mMapDocument.map().tilesets(), tileset)):
+            for item in self.mLayerItems:
+                if (type(item) == TileLayerItem):
+                    item.tilesetChanged(tileset)
+            for composite in self.mLayerComposites:
+                composite.tilesetChanged(tileset)
+            self.update()
+
+    ##
+    # Repaints the layers showing animated tiles of \a tileset, after the tile
+    # animations advanced.
+    ##
+    def repaintTileset(self, tileset):
+        if (not self.mMapDocument):
+            return
+        if (contains(self.mMapDocument.map().tilesets(), tileset)):
+            for item in self.mLayerItems:
+                if (type(item) == TileLayerItem):
+                    item.tileAnimationsAdvanced(tileset)
+            for composite in self.mLayerComposites:
+                composite.tileAnimationsAdvanced(tileset)
             self.update()
 
     def tileLayerDrawMarginsChanged(self, tileLayer):
         index = self.mMapDocument.map().layers().indexOf(tileLayer)
         item = self.mLayerItems.at(index)
         item.syncWithTileLayer()
+        composite = self.compositeForLayerItem(item)
+        if (composite):
+            composite.syncWithLayerItems()
 
     def layerAdded(self, index):
         layer = self.mMapDocument.map().layerAt(index)
@@ -421,9 +483,15 @@ class MapScene(QGraphicsScene):
         for item in self.mLayerItems:
             item.setZValue(z)
             z += 1
+        self.updateLayerComposites()
 
     def layerRemoved(self, index):
+        layerItem = self.mLayerItems.at(index)
         self.mLayerItems.remove(index)
+        if (type(layerItem) == TileLayerItem):
+            layerItem.invalidate()
+        self.removeItem(layerItem)
+        self.updateLayerComposites()
 
     ##
     # A layer has changed. This can mean that the layer visibility, opacity or
@@ -438,6 +506,7 @@ class MapScene(QGraphicsScene):
             multiplier = opacityFactor
         layerItem.setOpacity(layer.opacity() * multiplier)
         layerItem.setPos(layer.offset())
+        self.updateLayerComposites()
 
         # Layer offset may have changed, affecting the scene rect and grid
         self.updateSceneRect()
@@ -461,6 +530,9 @@ class MapScene(QGraphicsScene):
         item = self.mLayerItems.at(index)
         item.syncWithImageLayer()
         item.update()
+        composite = self.compositeForLayerItem(item)
+        if (composite):
+            composite.syncWithLayerItems()
 
     ##
     # When the tile offset of a tileset has changed, it can affect the bounding
@@ -472,6 +544,8 @@ class MapScene(QGraphicsScene):
             tli = item
             if type(tli) == TileLayerItem:
                 tli.syncWithTileLayer()
+        for composite in self.mLayerComposites:
+            composite.syncWithLayerItems()
         for item in self.mObjectItems:
             cell = item.mapObject().cell()
             if (not cell.isEmpty() and cell.tile.tileset() == tileset):
@@ -612,6 +686,78 @@ class MapScene(QGraphicsScene):
             multiplier = _x
             self.mLayerItems.at(i).setOpacity(layer.opacity() * multiplier)
 
+    ##
+    # Replaces the items of the visible tile and image layers below and above
+    # the current layer by items showing them flattened, when enabled. Object
+    # groups keep their own items, so the layers around them are flattened
+    # separately. Composites flattening the same layer items as before are
+    # kept, along with their pre-rendered chunks.
+    ##
+    def updateLayerComposites(self):
+        oldComposites = self.mLayerComposites
+        self.mLayerComposites = QList()
+        for run in self.flattenedLayerRuns():
+            composite = None
+            for oldComposite in oldComposites:
+                if (oldComposite.layerItems() == run):
+                    composite = oldComposite
+                    break
+            if (composite):
+                oldComposites.removeAll(composite)
+                if (composite.layerItemsChanged()):
+                    composite.syncWithLayerItems()
+            else:
+                composite = LayerCompositeItem(run, self.mMapDocument)
+                self.addItem(composite)
+            composite.setZValue(run.first().zValue())
+            self.mLayerComposites.append(composite)
+            for item in run:
+                item.setVisible(False)
+
+        for composite in oldComposites:
+            composite.invalidate()
+            self.removeItem(composite)
+
+    ##
+    # Returns the runs of layer items to flatten, after making the visibility
+    # of all layer items match their layers.
+    ##
+    def flattenedLayerRuns(self):
+        runs = QList()
+        if (not self.mMapDocument):
+            return runs
+
+        map = self.mMapDocument.map()
+        for i in range(self.mLayerItems.size()):
+            self.mLayerItems.at(i).setVisible(map.layerAt(i).isVisible())
+        if (not self.mFlattenInactiveLayers):
+            return runs
+
+        currentLayerIndex = self.mMapDocument.currentLayerIndex()
+        run = QList()
+        for i in range(self.mLayerItems.size()):
+            item = self.mLayerItems.at(i)
+            if (i == currentLayerIndex or
+                    type(item) not in (TileLayerItem, ImageLayerItem)):
+                if (run.size() >= 2):
+                    runs.append(run)
+                run = QList()
+            elif (item.isVisible()):
+                run.append(item)
+        if (run.size() >= 2):
+            runs.append(run)
+        return runs
+
+    ##
+    # Returns the composite showing \a layerItem, or None when it is not
+    # flattened.
+    ##
+    def compositeForLayerItem(self, layerItem):
+        for composite in self.mLayerComposites:
+            if (layerItem in composite.layerItems()):
+                return composite
+        return None
+
     def eventFilter(self, object, event):
         x = event.type()
         if x==QEvent.KeyPress or x==QEvent.KeyRelease:
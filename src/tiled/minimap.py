@@ -34,13 +34,15 @@ from PyQt5.QtCore import (
     QPoint,
     QRectF,
     QTimer,
-    QPointF
+    QPointF,
+    QMarginsF
 )
 from PyQt5.QtGui import (
     QPainter,
     QImage,
     QPen,
     QColor, 
+    QRegion,
     QTransform
 )
 from PyQt5.QtWidgets import (
@@ -63,6 +65,12 @@ class MiniMap(QFrame):
         self.mDragging = False
         self.mMouseMoveCursorState = False
         self.mRedrawMapImage = False
+        self.mRebuildMapImage = True
+        self.mDirtyRects = QList()
+        self.mImageScale = 0.0
+        self.mImageMargins = QMarginsF()
+        self.mLayerRects = {}
+        self.mObjectRects = {}
         self.mRenderFlags = MiniMapRenderFlag.DrawTiles | MiniMapRenderFlag.DrawObjects | MiniMapRenderFlag.DrawImages | MiniMapRenderFlag.IgnoreInvisibleLayer
 
         self.mMapImageUpdateTimer = QTimer()
@@ -90,7 +98,22 @@ class MiniMap(QFrame):
         self.mMapDocument = map
         
         if (self.mMapDocument):
-            self.mMapDocument.undoStack().indexChanged.connect(self.scheduleMapImageUpdate)
+            self.mMapDocument.mapChanged.connect(self.scheduleMapImageUpdate)
+            self.mMapDocument.tilesetChanged.connect(self.scheduleMapImageUpdate)
+            self.mMapDocument.tilesetRemoved.connect(self.scheduleMapImageUpdate)
+            self.mMapDocument.tilesetTileOffsetChanged.connect(self.scheduleMapImageUpdate)
+            self.mMapDocument.tileLayerDrawMarginsChanged.connect(self.scheduleMapImageUpdate)
+            self.mMapDocument.tileAnimationChanged.connect(self.scheduleMapImageUpdate)
+            self.mMapDocument.regionChanged.connect(self.regionChanged)
+            self.mMapDocument.layerAdded.connect(self.layerChanged)
+            self.mMapDocument.layerAboutToBeRemoved.connect(self.layerAboutToBeRemoved)
+            self.mMapDocument.layerChanged.connect(self.layerChanged)
+            self.mMapDocument.objectGroupChanged.connect(self.layerContentsChanged)
+            self.mMapDocument.imageLayerChanged.connect(self.layerContentsChanged)
+            self.mMapDocument.objectsInserted.connect(self.objectsInserted)
+            self.mMapDocument.objectsRemoved.connect(self.objectsRemoved)
+            self.mMapDocument.objectsChanged.connect(self.objectsChanged)
+            self.mMapDocument.objectsIndexChanged.connect(self.objectsInserted)
             mapView = dm.viewForDocument(self.mMapDocument)
             if mapView:
                 mapView.horizontalScrollBar().valueChanged.connect(self.update)
@@ -100,19 +123,163 @@ class MiniMap(QFrame):
         self.scheduleMapImageUpdate()
 
     def setRenderFlags(self, flags):
+        if (self.mRenderFlags == flags):
+            return
         self.mRenderFlags = flags
+        self.scheduleMapImageUpdate()
 
     def sizeHint(self):
         return QSize(200, 200)
 
-    ## Schedules a redraw of the minimap image. */
+    ## Schedules a redraw of the whole minimap image. */
     def scheduleMapImageUpdate(self):
+        self.mRebuildMapImage = True
         self.mMapImageUpdateTimer.start(100)
 
+    ##
+    # Schedules a redraw of the part of the minimap image showing \a rect,
+    # given in map pixel coordinates.
+    ##
+    def scheduleMapRectUpdate(self, rect):
+        if (rect.isEmpty()):
+            return
+        self.mDirtyRects.append(rect)
+        self.mMapImageUpdateTimer.start(100)
+
+    ##
+    # Schedules a redraw of the changed \a region of \a layer. The region is
+    # in tile coordinates.
+    ##
+    def regionChanged(self, region, layer):
+        renderer = self.mMapDocument.renderer()
+        margins = self.mMapDocument.map().drawMargins()
+        for r in region.rects():
+            rect = QRectF(renderer.boundingRect(r)).adjusted(-margins.left(),
+                                                             -margins.top(),
+                                                             margins.right(),
+                                                             margins.bottom())
+            self.scheduleMapRectUpdate(rect.translated(layer.offset()))
+
+    ##
+    # Schedules a redraw of the area covered by the layer at \a index, both
+    # where it was last drawn and where it is now. Used when a layer was
+    # added or changed its visibility, opacity or offset.
+    ##
+    def layerChanged(self, index):
+        layer = self.mMapDocument.map().layerAt(index)
+        rect = self.mLayerRects.get(layer)
+        if (rect is not None):
+            self.scheduleMapRectUpdate(rect)
+        rect = self.layerRect(layer)
+        self.mLayerRects[layer] = rect
+        self.scheduleMapRectUpdate(rect)
+        if (type(layer) == ObjectGroup):
+            for object in layer.objects():
+                self.mObjectRects[object] = self.objectRect(object)
+
+    ##
+    # Schedules a redraw of the area where the layer at \a index was last
+    # drawn and forgets about the layer and its objects.
+    ##
+    def layerAboutToBeRemoved(self, index):
+        layer = self.mMapDocument.map().layerAt(index)
+        rect = self.mLayerRects.pop(layer, None)
+        if (rect is not None):
+            self.scheduleMapRectUpdate(rect)
+        if (type(layer) == ObjectGroup):
+            # The objects may have moved out of the recorded layer area
+            self.objectsRemoved(layer.objects())
+
+    ##
+    # Schedules a redraw of the area covered by \a layer, which is an object
+    # group or an image layer that changed.
+    ##
+    def layerContentsChanged(self, layer):
+        index = self.mMapDocument.map().layers().indexOf(layer)
+        if (index != -1):
+            self.layerChanged(index)
+
+    ##
+    # Schedules a redraw of the objects \a first to \a last of
+    # \a objectGroup, which were inserted or changed their drawing order.
+    ##
+    def objectsInserted(self, objectGroup, first, last):
+        self.objectsChanged(objectGroup.objects()[first:last + 1])
+
+    ##
+    # Schedules a redraw of the areas covered by \a objects, both where they
+    # were last drawn and where they are now.
+    ##
+    def objectsChanged(self, objects):
+        for object in objects:
+            rect = self.mObjectRects.pop(object, None)
+            if (rect is not None):
+                self.scheduleMapRectUpdate(rect)
+            if (object.objectGroup()):
+                rect = self.objectRect(object)
+                self.mObjectRects[object] = rect
+                self.scheduleMapRectUpdate(rect)
+
+    ##
+    # Schedules a redraw of the areas where the removed \a objects were last
+    # drawn and forgets about them.
+    ##
+    def objectsRemoved(self, objects):
+        for object in objects:
+            rect = self.mObjectRects.pop(object, None)
+            if (rect is not None):
+                self.scheduleMapRectUpdate(rect)
+
+    ##
+    # Returns the area covered by \a layer, in map pixel coordinates.
+    ##
+    def layerRect(self, layer):
+        renderer = self.mMapDocument.renderer()
+        tp = type(layer)
+        if (tp == TileLayer):
+            margins = layer.drawMargins()
+            rect = QRectF(renderer.boundingRect(layer.bounds())).adjusted(-margins.left(),
+                                                                          -margins.top(),
+                                                                          margins.right(),
+                                                                          margins.bottom())
+        elif (tp == ObjectGroup):
+            rect = QRectF()
+            for object in layer.objects():
+                rect = rect.united(self.objectRect(object))
+            return rect
+        elif (tp == ImageLayer):
+            rect = renderer.boundingRect_(layer)
+        else:
+            return QRectF()
+        return rect.translated(layer.offset())
+
+    ##
+    # Returns the area covered by \a object, in map pixel coordinates.
+    ##
+    def objectRect(self, object):
+        renderer = self.mMapDocument.renderer()
+        rect = renderer.boundingRect(object)
+        if (object.rotation() != 0.0):
+            origin = renderer.pixelToScreenCoords_(object.position())
+            transform = QTransform()
+            transform.translate(origin.x(), origin.y())
+            transform.rotate(object.rotation())
+            transform.translate(-origin.x(), -origin.y())
+            rect = transform.mapRect(rect)
+        objectGroup = object.objectGroup()
+        if (objectGroup):
+            rect.translate(objectGroup.offset())
+        return rect
+
     def paintEvent(self, pe):
         super().paintEvent(pe)
         if (self.mRedrawMapImage):
-            self.renderMapToImage()
+            if (self.mRebuildMapImage):
+                self.renderMapToImage()
+            elif (not self.mDirtyRects.isEmpty()):
+                self.renderMapToImage(self.mDirtyRects)
+            self.mRebuildMapImage = False
+            self.mDirtyRects = QList()
             self.mRedrawMapImage = False
 
         if (self.mMapImage.isNull() or self.mImageRect.isEmpty()):
@@ -238,7 +405,12 @@ class MiniMap(QFrame):
         imageRect.moveCenter(r.center())
         self.mImageRect = imageRect
 
-    def renderMapToImage(self):
+    ##
+    # Renders the map to the minimap image. When \a dirtyRects is given, only
+    # the part of the image showing these map areas is redrawn, unless the
+    # image needs to be rebuilt because its size or placement changed.
+    ##
+    def renderMapToImage(self, dirtyRects = None):
         if (not self.mMapDocument):
             self.mMapImage = QImage()
             return
@@ -261,9 +433,44 @@ class MiniMap(QFrame):
         if (self.mMapImage.size() != imageSize):
             self.mMapImage = QImage(imageSize, QImage.Format_ARGB32_Premultiplied)
             self.updateImageRect()
+            dirtyRects = None
 
         if (imageSize.isEmpty()):
             return
+
+        # Parts can only be redrawn while the map is placed the same way
+        imageMargins = QMarginsF(margins)
+        if (scale != self.mImageScale or imageMargins != self.mImageMargins):
+            dirtyRects = None
+        self.mImageScale = scale
+        self.mImageMargins = imageMargins
+
+        # Determine the area of the image to redraw and the matching map area
+        imageRect = QRectF(self.mMapImage.rect())
+        dirtyRegion = QRegion(self.mMapImage.rect())
+        exposed = QRectF()
+        if (dirtyRects is not None):
+            dirtyRegion = QRegion()
+            for rect in dirtyRects:
+                rect = QRectF((rect.x() + margins.left()) * scale,
+                              (rect.y() + margins.top()) * scale,
+                              rect.width() * scale,
+                              rect.height() * scale)
+                # Grow to cover smoothly scaled edges and the shadows of
+                # objects, which are offset by a pixel
+                rect = rect.toAlignedRect().adjusted(-3, -3, 3, 3)
+                dirtyRegion |= QRegion(rect.intersected(self.mMapImage.rect()))
+            if (dirtyRegion.isEmpty()):
+                return
+            imageRect = QRectF(dirtyRegion.boundingRect())
+            exposed = QRectF(imageRect.x() / scale - margins.left(),
+                             imageRect.y() / scale - margins.top(),
+                             imageRect.width() / scale,
+                             imageRect.height() / scale)
+        else:
+            self.mLayerRects = {}
+            self.mObjectRects = {}
+
         drawObjects = bool(self.mRenderFlags & MiniMapRenderFlag.DrawObjects)
         drawTiles = bool(self.mRenderFlags & MiniMapRenderFlag.DrawTiles)
         drawImages = bool(self.mRenderFlags & MiniMapRenderFlag.DrawImages)
@@ -272,28 +479,40 @@ class MiniMap(QFrame):
         # Remember the current render flags
         renderFlags = renderer.flags()
         renderer.setFlag(RenderFlag.ShowTileObjectOutlines, False)
-        self.mMapImage.fill(Qt.transparent)
         painter = QPainter(self.mMapImage)
+        painter.setClipRegion(dirtyRegion)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        painter.fillRect(imageRect, Qt.transparent)
+        painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
         painter.setRenderHints(QPainter.SmoothPixmapTransform)
         painter.setTransform(QTransform.fromScale(scale, scale))
         painter.translate(margins.left(), margins.top())
         renderer.setPainterScale(scale)
         for layer in self.mMapDocument.map().layers():
+            if (dirtyRects is None):
+                self.mLayerRects[layer] = self.layerRect(layer)
+                if (type(layer) == ObjectGroup):
+                    for object in layer.objects():
+                        self.mObjectRects[object] = self.objectRect(object)
             if (visibleLayersOnly and not layer.isVisible()):
                 continue
             painter.setOpacity(layer.opacity())
             painter.translate(layer.offset())
+            layerExposed = exposed.translated(-layer.offset())
             tileLayer = layer
             objGroup = layer
             imageLayer = layer
             tp = type(layer)
             if (tp==TileLayer and drawTiles):
-                renderer.drawTileLayer(painter, tileLayer)
+                renderer.drawTileLayer(painter, tileLayer, layerExposed)
             elif (tp==ObjectGroup and drawObjects):
                 objects = objGroup.objects()
                 if (objGroup.drawOrder() == ObjectGroup.DrawOrder.TopDownOrder):
                     objects = QList(sorted(objects, key=lambda x:x.y(), reverse=True))
                 for object in objects:
+                    if (not exposed.isNull() and
+                            not self.objectRect(object).intersects(exposed)):
+                        continue
                     if (object.isVisible()):
                         if (object.rotation() != 0.0):
                             origin = renderer.pixelToScreenCoords_(object.position())
@@ -307,7 +526,7 @@ class MiniMap(QFrame):
                         if (object.rotation() != 0.0):
                             painter.restore()
             elif (tp==ImageLayer and drawImages):
-                renderer.drawImageLayer(painter, imageLayer)
+                renderer.drawImageLayer(painter, imageLayer, layerExposed)
                 
             painter.translate(-layer.offset())
             
@@ -66,6 +66,8 @@ class NewMapDialog(QDialog):
         self.mUi.layerFormat.addItem(QCoreApplication.translate("PreferencesDialog", "Base64 (gzip compressed)"))
         self.mUi.layerFormat.addItem(QCoreApplication.translate("PreferencesDialog", "Base64 (zlib compressed)"))
         self.mUi.layerFormat.addItem(QCoreApplication.translate("PreferencesDialog", "CSV"))
+        self.mUi.layerFormat.addItem(QCoreApplication.translate("PreferencesDialog", "Base64 (lzma compressed)"))
+        self.mUi.layerFormat.addItem(QCoreApplication.translate("PreferencesDialog", "Base64 (bzip2 compressed)"))
         self.mUi.renderOrder.addItem(QCoreApplication.translate("PreferencesDialog", "Right Down"))
         self.mUi.renderOrder.addItem(QCoreApplication.translate("PreferencesDialog", "Right Up"))
         self.mUi.renderOrder.addItem(QCoreApplication.translate("PreferencesDialog", "Left Down"))
@@ -98,17 +98,13 @@ class PaintTileLayer(QUndoCommand):
             self.mErased.resize(combinedBounds.size(), shift)
             self.mSource.resize(combinedBounds.size(), shift)
 
-        mX = combinedBounds.left()
+        self.mX = combinedBounds.left()
         self.mY = combinedBounds.top()
         self.mPaintedRegion = combinedRegion
         # Copy the painted tiles from the other command over
         pos = QPoint(o.mX, o.mY) - combinedBounds.topLeft()
         self.mSource.merge(pos, o.mSource)
         # Copy the newly erased tiles from the other command over
-        for rect in newRegion.rects():
-            for y in range(rect.top(), rect.bottom()+1):
-                for x in range(rect.left(), rect.right()+1):
-                    self.mErased.setCell(x - mX,
-                                     y - self.mY,
-                                     o.mErased.cellAt(x - o.mX, y - o.mY))
+        self.mErased.setCells(pos.x(), pos.y(), o.mErased,
+                              newRegion.translated(-combinedBounds.topLeft()))
         return True
@@ -19,6 +19,7 @@
 ##
 
 from tilesetmanager import TilesetManager
+import gidmapper
 import languagemanager
 from tiled_global import Int, Float
 from documentmanager import DocumentManager
@@ -73,6 +74,7 @@ class Preferences(QObject):
     gridFineChanged = pyqtSignal(int)
     objectLineWidthChanged = pyqtSignal(float)
     highlightCurrentLayerChanged = pyqtSignal(bool)
+    flattenInactiveLayersChanged = pyqtSignal(bool)
     showTilesetGridChanged = pyqtSignal(bool)
     objectLabelVisibilityChanged = pyqtSignal(int)
     useOpenGLChanged = pyqtSignal(bool)
@@ -98,6 +100,7 @@ class Preferences(QObject):
         self.mMapRenderOrder = Map.RenderOrder(self.intValue("MapRenderOrder", Map.RenderOrder.RightDown.value))
         self.mDtdEnabled = self.boolValue("DtdEnabled")
         self.mReloadTilesetsOnChange = self.boolValue("ReloadTilesets", True)
+        self.mSaveWorkerCount = self.intValue("SaveWorkerCount", 0)
         self.mStampsDirectory = self.stringValue("StampsDirectory")
         self.mSettings.endGroup()
         # Retrieve interface settings
@@ -111,6 +114,7 @@ class Preferences(QObject):
         self.mGridFine = self.intValue("GridFine", 4)
         self.mObjectLineWidth = self.realValue("ObjectLineWidth", 2)
         self.mHighlightCurrentLayer = self.boolValue("HighlightCurrentLayer")
+        self.mFlattenInactiveLayers = self.boolValue("FlattenInactiveLayers")
         self.mShowTilesetGrid = self.boolValue("ShowTilesetGrid", True)
         self.mLanguage = self.stringValue("Language")
         self.mUseOpenGL = self.boolValue("OpenGL")
@@ -133,6 +137,7 @@ class Preferences(QObject):
         tilesetManager = TilesetManager.instance()
         tilesetManager.setReloadTilesetsOnChange(self.mReloadTilesetsOnChange)
         tilesetManager.setAnimateTiles(self.mShowTileAnimations)
+        gidmapper.setEncodeWorkerCount(self.mSaveWorkerCount)
         # Keeping track of some usage information
         self.mSettings.beginGroup("Install")
         self.mFirstRun = QDate.fromString(self.mSettings.value("FirstRun"))
@@ -197,6 +202,9 @@ class Preferences(QObject):
     def highlightCurrentLayer(self):
         return self.mHighlightCurrentLayer
 
+    def flattenInactiveLayers(self):
+        return self.mFlattenInactiveLayers
+
     def showTilesetGrid(self):
         return self.mShowTilesetGrid
 
@@ -265,6 +273,21 @@ class Preferences(QObject):
         tilesetManager = TilesetManager.instance()
         tilesetManager.setReloadTilesetsOnChange(self.mReloadTilesetsOnChange)
 
+    ##
+    # Returns the number of threads encoding tile layers when saving a map,
+    # 0 meaning one thread per processor.
+    ##
+    def saveWorkerCount(self):
+        return self.mSaveWorkerCount
+
+    def setSaveWorkerCount(self, count):
+        if (self.mSaveWorkerCount == count):
+            return
+        self.mSaveWorkerCount = count
+        self.mSettings.setValue("Storage/SaveWorkerCount",
+                            self.mSaveWorkerCount)
+        gidmapper.setEncodeWorkerCount(self.mSaveWorkerCount)
+
     def setUseOpenGL(self, useOpenGL):
         if (self.mUseOpenGL == useOpenGL):
             return
@@ -409,6 +432,14 @@ class Preferences(QObject):
                             self.mHighlightCurrentLayer)
         self.highlightCurrentLayerChanged.emit(self.mHighlightCurrentLayer)
 
+    def setFlattenInactiveLayers(self, flatten):
+        if (self.mFlattenInactiveLayers == flatten):
+            return
+        self.mFlattenInactiveLayers = flatten
+        self.mSettings.setValue("Interface/FlattenInactiveLayers",
+                            self.mFlattenInactiveLayers)
+        self.flattenInactiveLayersChanged.emit(self.mFlattenInactiveLayers)
+
     def setShowTilesetGrid(self, showTilesetGrid):
         if (self.mShowTilesetGrid == showTilesetGrid):
             return
@@ -78,6 +78,7 @@ class PreferencesDialog(QDialog):
         self.mUi.openGL.toggled.connect(self.useOpenGLToggled)
         self.mUi.gridColor.colorChanged.connect(preferences.Preferences.instance().setGridColor)
         self.mUi.gridFine.valueChanged.connect(preferences.Preferences.instance().setGridFine)
+        self.mUi.saveWorkerCount.valueChanged.connect(preferences.Preferences.instance().setSaveWorkerCount)
         self.mUi.objectLineWidth.valueChanged.connect(self.objectLineWidthChanged)
         self.mUi.objectTypesTable.selectionModel().selectionChanged.connect(self.selectedObjectTypesChanged)
         self.mUi.objectTypesTable.doubleClicked.connect(self.objectTypeIndexClicked)
@@ -189,6 +190,7 @@ class PreferencesDialog(QDialog):
         self.mUi.reloadTilesetImages.setChecked(prefs.reloadTilesetsOnChange())
         self.mUi.enableDtd.setChecked(prefs.dtdEnabled())
         self.mUi.openLastFiles.setChecked(prefs.openLastFilesOnStartup())
+        self.mUi.saveWorkerCount.setValue(prefs.saveWorkerCount())
         if (self.mUi.openGL.isEnabled()):
             self.mUi.openGL.setChecked(prefs.useOpenGL())
         # Not found (-1) ends up at index 0, system default
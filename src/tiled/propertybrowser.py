@@ -138,6 +138,8 @@ class PropertyBrowser(QtTreePropertyBrowser):
         self.mLayerFormatNames.append(QCoreApplication.translate("PreferencesDialog", "Base64 (gzip compressed)"))
         self.mLayerFormatNames.append(QCoreApplication.translate("PreferencesDialog", "Base64 (zlib compressed)"))
         self.mLayerFormatNames.append(QCoreApplication.translate("PreferencesDialog", "CSV"))
+        self.mLayerFormatNames.append(QCoreApplication.translate("PreferencesDialog", "Base64 (lzma compressed)"))
+        self.mLayerFormatNames.append(QCoreApplication.translate("PreferencesDialog", "Base64 (bzip2 compressed)"))
         self.mRenderOrderNames.append(QCoreApplication.translate("PreferencesDialog", "Right Down"))
         self.mRenderOrderNames.append(QCoreApplication.translate("PreferencesDialog", "Right Up"))
         self.mRenderOrderNames.append(QCoreApplication.translate("PreferencesDialog", "Left Down"))
@@ -51,15 +51,15 @@ class ThumbnailRenderer():
     def __init__(self, map):
         
         self.mMap = map
-        self.mVisibleLayersOnly(True)
-        self.mIncludeBackgroundColor(False)
+        self.mVisibleLayersOnly = True
+        self.mIncludeBackgroundColor = False
 
         x = map.orientation()
-        if x==Map.Isometric:
+        if x==Map.Orientation.Isometric:
             self.mRenderer = IsometricRenderer(map)
-        elif x==Map.Staggered:
+        elif x==Map.Orientation.Staggered:
             self.mRenderer = StaggeredRenderer(map)
-        elif x==Map.Hexagonal:
+        elif x==Map.Orientation.Hexagonal:
             self.mRenderer = HexagonalRenderer(map)
         else:
             self.mRenderer = OrthogonalRenderer(map)
@@ -89,8 +89,7 @@ class ThumbnailRenderer():
                           (size.height() - scaledSize.height()) / 2)
         # Scale the map and translate it to adjust for its margins
         painter.scale(scale, scale)
-        painter.translate(margins.left() + (size.width() - scaledSize.width()) / 2,
-                          margins.top() + (size.height() - scaledSize.height()) / 2)
+        painter.translate(margins.left(), margins.top())
         if (smoothTransform(scale)):
             painter.setRenderHints(QPainter.SmoothPixmapTransform)
         self.mRenderer.setPainterScale(scale)
@@ -105,7 +104,7 @@ class ThumbnailRenderer():
                 self.mRenderer.drawTileLayer(painter, tileLayer)
             elif (objGroup):
                 objects = objGroup.objects()
-                if (objGroup.drawOrder() == ObjectGroup.TopDownOrder):
+                if (objGroup.drawOrder() == ObjectGroup.DrawOrder.TopDownOrder):
                     objects = QList(sorted(objects, key=lambda x:x.y(), reverse=True))
                 for object in objects:
                     if (object.isVisible()):
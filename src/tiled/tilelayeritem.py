@@ -18,14 +18,155 @@
 # this program. If not, see <http://www.gnu.org/licenses/>.
 ##
 
+import math
+from collections import OrderedDict
 from PyQt5.QtCore import (
+    Qt,
     QRectF
 )
+from PyQt5.QtGui import (
+    QPainter,
+    QPixmap,
+    QTransform
+)
 from PyQt5.QtWidgets import (
     QGraphicsItem
 )
+
+##
+# Width and height in device pixels of the pre-rendered chunks of a tile
+# layer.
+##
+ChunkSize = 512
+
+##
+# Keeps pre-rendered chunks of tile layers, shared by all tile layer items.
+# When their total size exceeds maximumCost() bytes, the least recently used
+# chunks are dropped.
+##
+class TileLayerChunkCache():
+    DefaultMaximumCost = 128 * 1024 * 1024
+
+    def __init__(self):
+        self.mChunks = OrderedDict()
+        self.mMaximumCost = TileLayerChunkCache.DefaultMaximumCost
+        self.mTotalCost = 0
+
+    ##
+    # Returns the chunk stored under \a key, or None when there is none.
+    ##
+    def chunk(self, key):
+        entry = self.mChunks.get(key)
+        if (not entry):
+            return None
+        self.mChunks.move_to_end(key)
+        return entry[0]
+
+    def insert(self, key, pixmap):
+        if (key in self.mChunks):
+            self.__remove(key)
+        cost = pixmap.width() * pixmap.height() * 4
+        self.mChunks[key] = (pixmap, cost)
+        self.mTotalCost += cost
+        while (self.mTotalCost > self.mMaximumCost and len(self.mChunks) > 1):
+            self.mTotalCost -= self.mChunks.popitem(last=False)[1][1]
+
+    ##
+    # Drops the chunks of \a owner. When \a rect is given, only the chunks
+    # intersecting it are dropped.
+    ##
+    def removeChunks(self, owner, rect = None):
+        for key in list(self.mChunks):
+            if (key[0] != owner):
+                continue
+            if (rect is not None and not chunkRect(key[1], key[2], key[3]).intersects(rect)):
+                continue
+            self.__remove(key)
+
+    ##
+    # Sets the maximum total size of the cached chunks, in bytes.
+    ##
+    def setMaximumCost(self, cost):
+        self.mMaximumCost = cost
+
+    def maximumCost(self):
+        return self.mMaximumCost
+
+    def totalCost(self):
+        return self.mTotalCost
+
+    def __remove(self, key):
+        self.mTotalCost -= self.mChunks.pop(key)[1]
+
+sharedChunkCache = TileLayerChunkCache()
+
+##
+# Returns the area in item coordinates covered by the chunk at \a x, \a y
+# when rendering at the given \a scale.
+##
+def chunkRect(scale, x, y):
+    size = ChunkSize / scale
+    return QRectF(x * size, y * size, size, size)
+
+chunkOwnerCount = 0
+
+##
+# Returns a new key under which an item can store its chunks in the shared
+# chunk cache.
+##
+def newChunkOwner():
+    global chunkOwnerCount
+    chunkOwnerCount += 1
+    return chunkOwnerCount
+
+##
+# Returns whether painting with the world \a transform can use pre-rendered
+# chunks, which is the case when it neither rotates nor stretches.
+##
+def canDrawChunks(transform):
+    return (transform.type() <= QTransform.TxScale and
+            transform.m11() == transform.m22() and transform.m11() > 0)
+
+##
+# Paints the area \a exposed, given in item coordinates, from the chunks of
+# \a owner. Missing chunks are rendered by calling \a drawContents with a
+# painter and the rect to draw.
+##
+def drawChunks(painter, owner, exposed, drawContents):
+    scale = painter.worldTransform().m11()
+    size = ChunkSize / scale
+    startX = math.floor(exposed.left() / size)
+    startY = math.floor(exposed.top() / size)
+    endX = math.ceil(exposed.right() / size)
+    endY = math.ceil(exposed.bottom() / size)
+    for y in range(startY, endY):
+        for x in range(startX, endX):
+            key = (owner, scale, x, y)
+            chunk = sharedChunkCache.chunk(key)
+            if (chunk is None):
+                chunk = renderChunk(painter, scale, x, y, drawContents)
+                sharedChunkCache.insert(key, chunk)
+            painter.drawPixmap(chunkRect(scale, x, y), chunk, QRectF(chunk.rect()))
+
+def renderChunk(painter, scale, x, y, drawContents):
+    rect = chunkRect(scale, x, y)
+    chunk = QPixmap(ChunkSize, ChunkSize)
+    chunk.fill(Qt.transparent)
+    chunkPainter = QPainter(chunk)
+    chunkPainter.setRenderHints(painter.renderHints())
+    chunkPainter.scale(scale, scale)
+    chunkPainter.translate(-rect.topLeft())
+    drawContents(chunkPainter, rect)
+    chunkPainter.end()
+    return chunk
+
 ##
 # A graphics item displaying a tile layer in a QGraphicsView.
+#
+# The layer is painted from chunks that are rendered once for each zoom level
+# and kept in the shared chunk cache, so that repaints only need to copy a few
+# pixmaps. The chunks have to be invalidated when the layer or the images of
+# its tiles change (see invalidateRegion() and invalidate()).
 ##
 class TileLayerItem(QGraphicsItem):
 
@@ -41,6 +182,9 @@ class TileLayerItem(QGraphicsItem):
         self.mBoundingRect = QRectF()
         self.mLayer = layer
         self.mMapDocument = mapDocument
+        self.mChunkOwner = newChunkOwner()
+        self.mModificationCount = layer.modificationCount()
+        self.mAnimatedTilesets = {}
 
         self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
         self.syncWithTileLayer()
@@ -57,6 +201,7 @@ class TileLayerItem(QGraphicsItem):
     ##
     def syncWithTileLayer(self):
         self.prepareGeometryChange()
+        self.invalidate()
         renderer = self.mMapDocument.renderer()
         boundingRect = QRectF(renderer.boundingRect(self.mLayer.bounds()))
         margins = self.mLayer.drawMargins()
@@ -70,11 +215,78 @@ class TileLayerItem(QGraphicsItem):
                                               margins.right(),
                                               margins.bottom())
 
+    ##
+    # Drops all pre-rendered chunks of this layer.
+    ##
+    def invalidate(self):
+        sharedChunkCache.removeChunks(self.mChunkOwner)
+        self.mModificationCount = self.mLayer.modificationCount()
+        self.mAnimatedTilesets = {}
+
+    ##
+    # Drops the pre-rendered chunks intersecting \a rect, given in item
+    # coordinates. Should be called when the cells painted there changed.
+    ##
+    def invalidateRegion(self, rect):
+        sharedChunkCache.removeChunks(self.mChunkOwner, rect)
+        self.mModificationCount = self.mLayer.modificationCount()
+        self.mAnimatedTilesets = {}
+
+    ##
+    # Drops all pre-rendered chunks when the layer uses \a tileset. Should be
+    # called when the images of its tiles changed.
+    ##
+    def tilesetChanged(self, tileset):
+        if (self.mLayer.referencesTileset(tileset)):
+            self.invalidate()
+
+    ##
+    # Returns whether the layer shows animated tiles from \a tileset.
+    ##
+    def usesAnimatedTiles(self, tileset):
+        animated = self.mAnimatedTilesets.get(tileset)
+        if (animated is None):
+            animated = self.mLayer.hasCell(lambda cell: not cell.isEmpty() and
+                                                        cell.tile.tileset() is tileset and
+                                                        cell.tile.isAnimated())
+            self.mAnimatedTilesets[tileset] = animated
+        return animated
+
+    ##
+    # Drops the pre-rendered chunks when the layer uses animated tiles from
+    # \a tileset. Should be called when the tile animations advanced.
+    ##
+    def tileAnimationsAdvanced(self, tileset):
+        if (self.usesAnimatedTiles(tileset)):
+            sharedChunkCache.removeChunks(self.mChunkOwner)
+
+    ##
+    # Returns the tile layer displayed by this item.
+    ##
+    def tileLayer(self):
+        return self.mLayer
+
+    ##
+    # Draws the part \a exposed of the layer, given in item coordinates,
+    # without using the pre-rendered chunks.
+    ##
+    def drawLayer(self, painter, exposed):
+        self.mMapDocument.renderer().drawTileLayer(painter, self.mLayer, exposed)
+
     # QGraphicsItem
     def boundingRect(self):
         return self.mBoundingRect
 
     def paint(self, painter, option, widget = None):
-        renderer = self.mMapDocument.renderer()
         # TODO: Display a border around the layer when selected
-        renderer.drawTileLayer(painter, self.mLayer, option.exposedRect)
+        if (not canDrawChunks(painter.worldTransform())):
+            self.drawLayer(painter, option.exposedRect)
+            return
+
+        # Changes that were not reported invalidate the whole layer
+        if (self.mLayer.modificationCount() != self.mModificationCount):
+            self.invalidate()
+
+        exposed = option.exposedRect.intersected(self.mBoundingRect)
+        if (not exposed.isEmpty()):
+            drawChunks(painter, self.mChunkOwner, exposed, self.drawLayer)
@@ -21,6 +21,7 @@
 
 from tileset import Tileset
 from tileanimationdriver import TileAnimationDriver
+from maprenderer import TileVariantCache, TileColorCache
 from filesystemwatcher import FileSystemWatcher
 from PyQt5.QtCore import (
     QTimer,
@@ -81,6 +82,8 @@ class TilesetManager(QObject):
         self.mChangedFilesTimer.setSingleShot(True)
         self.mChangedFilesTimer.timeout.connect(self.fileChangedTimeout)
         self.mAnimationDriver.update.connect(self.advanceTileAnimations)
+        self.tilesetChanged.connect(TileVariantCache.instance().invalidate)
+        self.tilesetChanged.connect(TileColorCache.instance().invalidate)
 
     ##
     # Destructor.
@@ -159,6 +162,8 @@ class TilesetManager(QObject):
             self.mTilesets.remove(tileset)
             if (tileset.imageSource()!=''):
                 self.mWatcher.removePath(tileset.imageSource())
+            TileVariantCache.instance().invalidate(tileset)
+            TileColorCache.instance().invalidate(tileset)
 
     ##
     # Convenience method to add references to multiple tilesets.